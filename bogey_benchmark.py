@@ -0,0 +1,191 @@
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import queue as queue_module
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import numpy as np
+
+# Benchmarks the stages of the bogey analysis on seeded synthetic tours (see synthetic_tour.py) of increasing size,
+# reporting the wall time of each stage, the throughput in player pairs per second and the peak memory (RSS).
+# Each size is run in a new process in its own temporary folder, where the synthetic tour is written as the test
+# dataset, so that the peak memory of one size does not carry over to the next.
+parser = argparse.ArgumentParser()
+parser.add_argument('--sizes', type=str, nargs='+', required=False, default=['1000:100', '10000:1000', '100000:5000', '1000000:20000'], help='sizes to run in matches:players format, e.g., 10000000:50000 (default = 1000:100 10000:1000 100000:5000 1000000:20000)')
+parser.add_argument('--seed', type=int, required=False, default=0, help='seed of the synthetic tours (default = 0)')
+parser.add_argument('-w', '--workers', type=int, required=False, default=1, help='number of worker processes used to score the player pairs (default = 1)')
+parser.add_argument('-o', '--output', type=str, required=False, default=None, help='json file to write the results to')
+parser.add_argument('--baseline', type=str, required=False, default=None, help='json file of the results of a previous benchmark to compare with')
+parser.add_argument('--tolerance', type=float, required=False, default=0.2, help='relative slowdown of a stage over the baseline that is reported as a regression (default = 0.2)')
+
+STAGES = ['generate', 'load_csv', 'load_store', 'prepare', 'filter', 'pair_index', 'totals_fisher', 'score', 'write', 'end_to_end']
+
+def get_peak_rss_mb():
+    # Peak resident memory of this process in MB (ru_maxrss is in KB on Linux and in bytes on macOS)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def run_size(n_matches, n_players, seed, workers, folder, queue):
+    """
+    Runs the benchmark of one size in the given folder and puts its results in the queue. Run in a new process.
+
+    Parameters:
+    - n_matches (int): Number of matches of the synthetic tour
+    - n_players (int): Number of players of the synthetic tour
+    - seed (int): Seed of the synthetic tour
+    - workers (int): Number of worker processes used to score the player pairs
+    - folder (str): Folder to write the synthetic tour and the output files to
+    - queue (Queue): Queue to put the results in
+    """
+    os.chdir(folder)
+    from synthetic_tour import write_matches
+    from match_data import DATASET_FILES
+    from match_store import load_match_store
+    from p_adjust import p_adjust
+    from result_store import write_result_lists
+    import bogey_tennis_fisher as bogey
+
+    times = {}
+    peak_rss = {}
+    def timed(stage, fn, *args):
+        start = time.perf_counter()
+        result = fn(*args)
+        times[stage] = time.perf_counter() - start
+        peak_rss[stage] = get_peak_rss_mb()
+        return result
+
+    timed('generate', write_matches, DATASET_FILES['test'], n_matches, n_players, seed)
+    # The first load parses the csv file and builds the columnar cache and the match store
+    timed('load_csv', load_match_store, 'test')
+    all_matches = timed('load_store', lambda: load_match_store('test').to_frame())
+    matches = timed('prepare', bogey.prepare_matches, all_matches, 'odds')
+
+    # Filtering is timed on a restricted run (non grand slams in the second half of the tour), while the later
+    # stages use all the matches
+    days = all_matches['Day'].to_numpy()
+    middle = str(np.datetime64(int(days[len(days) // 2]), 'D'))
+    filter_args = bogey.parser.parse_args(['-d', 'test', '-g', '0', '-s', middle])
+    timed('filter', bogey.filter_matches, matches, filter_args)
+
+    args = bogey.parser.parse_args(['-d', 'test', '--progress', 'off', '-w', str(workers)])
+    df = bogey.filter_matches(matches, args)
+    pair_index = timed('pair_index', bogey.build_pair_index, df, df['P_i'].unique(), df['P_j'].unique())
+
+    def totals_fisher():
+        totals = bogey.get_pair_totals(df, pair_index)
+        observed = np.stack([totals[['expected_wins_p1', 'actual_wins_p1']].to_numpy(dtype=float),
+                             totals[['expected_wins_p2', 'actual_wins_p2']].to_numpy(dtype=float)], axis=1)
+        oddsratios, p_vals_fisher = bogey.fisher_exact_batch(observed)
+        return totals, oddsratios, p_vals_fisher, p_adjust(p_vals_fisher, args.p_adj_method)
+    totals, oddsratios, p_vals_fisher, p_vals_fisher_adj = timed('totals_fisher', totals_fisher)
+
+    bogey.set_shared(df, pair_index, totals, oddsratios, p_vals_fisher, p_vals_fisher_adj)
+    scored = timed('score', lambda: list(bogey.score_pairs(list(range(len(pair_index))), workers, 'test')))
+
+    def write():
+        with open('benchmark_results.csv', 'w', encoding='UTF8', newline='') as f, open('benchmark_metrics.csv', 'w', encoding='UTF8', newline='') as metrics_f:
+            writer = csv.writer(f)
+            metrics_writer = csv.writer(metrics_f, lineterminator='\n')
+            for data, metrics in scored:
+                writer.writerow(data)
+                metrics_writer.writerow(data + metrics)
+        write_result_lists('benchmark_results.csv', [pair[0] for pair in pair_index], [pair[1] for pair in pair_index],
+                           [pair[2] for pair in pair_index], df['Day'].to_numpy(), df['p1_won'].to_numpy(dtype=bool), df['upset'].to_numpy(dtype=bool))
+    timed('write', write)
+    del scored
+
+    # The whole analysis, as run by bogey_tennis_fisher.py on the loaded matches
+    timed('end_to_end', bogey.run_analysis, args, all_matches, matches)
+
+    queue.put({
+        'matches': n_matches,
+        'players': n_players,
+        'seed': seed,
+        'workers': workers,
+        'pairs': len(pair_index),
+        'seconds': times,
+        'peak_rss_mb': peak_rss,
+        'pairs_per_sec_score': len(pair_index) / times['score'] if times['score'] > 0 else None,
+        'pairs_per_sec_end_to_end': len(pair_index) / times['end_to_end'] if times['end_to_end'] > 0 else None,
+    })
+
+def print_result(result):
+    print('---------- ' + str(result['matches']) + ' matches, ' + str(result['players']) + ' players, ' + str(result['pairs']) + ' player pairs ----------')
+    for stage in STAGES:
+        print(stage.ljust(15) + str(round(result['seconds'][stage], 3)).rjust(10) + ' s' + str(round(result['peak_rss_mb'][stage], 1)).rjust(12) + ' MB peak RSS')
+    print('pairs/sec'.ljust(15) + str(round(result['pairs_per_sec_score'] or 0, 1)).rjust(10) + ' scoring, ' + str(round(result['pairs_per_sec_end_to_end'] or 0, 1)) + ' end to end')
+
+def find_regressions(results, baseline, tolerance):
+    """
+    Compares the stage times with a previous benchmark of the same sizes and seed.
+
+    Parameters:
+    - results (list): Results of this benchmark
+    - baseline (list): Results of the previous benchmark
+    - tolerance (float): Relative slowdown that is reported as a regression
+
+    Returns:
+    - regressions (list): Description of each stage that is slower than in the baseline by more than the tolerance
+    """
+    previous = {(r['matches'], r['players'], r['seed']): r for r in baseline}
+    regressions = []
+    for result in results:
+        key = (result['matches'], result['players'], result['seed'])
+        if key not in previous:
+            continue
+        for stage in STAGES:
+            before, after = previous[key]['seconds'].get(stage), result['seconds'][stage]
+            # Stages that take less than 0.1 s are too noisy to compare
+            if before is not None and max(before, after) > 0.1 and after > before * (1 + tolerance):
+                regressions.append(str(key[0]) + ' matches, ' + stage + ': ' + str(round(before, 3)) + ' s -> ' + str(round(after, 3)) + ' s')
+    return regressions
+
+def main():
+    args = parser.parse_args()
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+    context = multiprocessing.get_context('spawn')
+
+    results = []
+    for size in args.sizes:
+        n_matches, n_players = [int(value) for value in size.split(':')]
+        folder = tempfile.mkdtemp(prefix='bogey_benchmark_')
+        try:
+            queue = context.Queue()
+            # Spawned processes import the analysis modules from the package folder
+            sys.path.insert(0, package_dir)
+            process = context.Process(target=run_size, args=(n_matches, n_players, args.seed, args.workers, folder, queue))
+            process.start()
+            result = None
+            while result is None:
+                try:
+                    result = queue.get(timeout=1)
+                except queue_module.Empty:
+                    if not process.is_alive():
+                        raise RuntimeError('The benchmark of ' + size + ' failed with exit code ' + str(process.exitcode))
+            process.join()
+        finally:
+            shutil.rmtree(folder, ignore_errors=True)
+        print_result(result)
+        results.append(result)
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            regressions = find_regressions(results, json.load(f), args.tolerance)
+        if regressions:
+            print('Regressions over ' + args.baseline + ':')
+            for regression in regressions:
+                print(regression)
+            sys.exit(1)
+        print('No regressions over ' + args.baseline)
+
+if __name__ == '__main__':
+    main()
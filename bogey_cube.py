@@ -0,0 +1,272 @@
+import argparse
+import time
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from match_data import DATASET_FILES, get_source_signature
+from match_store import load_match_store, get_store_path, write_array_folder, read_array_folder, is_array_folder_current
+from fisher_batch import fisher_exact_batch
+from p_adjust import p_adjust, P_ADJUST_METHODS
+import bogey_tennis_fisher as bogey
+
+# Aggregate cube of the bogey analysis, for instant filtered queries. The Fisher's exact test of a pair only needs the
+# sums of its expected and actual wins, so these are summed once per dataset and upset type into cells of
+# (pair, Series, Surface, Tournament, year). Any filter on those dimensions is then answered by summing the selected
+# cells of each pair instead of filtering and grouping the matches again. The first match of each player as P_i and
+# as P_j is also kept per (Series, Surface, Tournament, year) cell, so that the output rows are in the same order as
+# the rows of bogey_tennis_fisher.py. The cube is cached next to the match store and rebuilt when the match data
+# file changes.
+parser = argparse.ArgumentParser()
+parser.add_argument('-p1', '--player_1', type=str, required=False, default='all', help='player name in format Last Name Initial., enclosed in double quotes e.g., "Djokovic N." (default = all players)')
+parser.add_argument('-p2', '--player_2', type=str, required=False, default='all', help='player name in format Last Name Initial., enclosed in double quotes e.g., "Djokovic N." (default = all players)')
+parser.add_argument('-d', '--dataset', type=str, required=True, help='atp or wta')
+parser.add_argument('-g', '--grand_slam', type=int, required=False, default=2, help='0 = non grand slams, 1 = grand slams only, 2 = grand slams and non grand slams (default)')
+parser.add_argument('-t', '--tournament', type=str, required=False, default='all', help='tournament name, e.g., Australian Open')
+parser.add_argument('--series', type=str, nargs='+', required=False, default=None, help='series to include, e.g., Masters 1000 "ATP250" (default = all series)')
+parser.add_argument('--surface', type=str, nargs='+', required=False, default=None, help='surfaces to include, e.g., Clay Grass (default = all surfaces)')
+parser.add_argument('--s_year', type=int, required=False, default=None, help='first year to include (default = min year in dataset)')
+parser.add_argument('--e_year', type=int, required=False, default=None, help='last year to include (default = max year in dataset)')
+parser.add_argument('-p', '--p_adj_method', type=str, required=False, choices=P_ADJUST_METHODS, default='BH', help='p-value adjustment for multiple comparisons method, e.g., bonferroni, hochberg, BH, holm, hommel, BY')
+parser.add_argument('-u', '--upset', type=str, required=False, choices=['odds','elo'], default='odds', help='whether an unexpected result is based on the betting odds or elo rating (default=odds)')
+parser.add_argument('--rebuild', action='store_true', help='rebuild the cube even if the match data file has not changed')
+
+# Dimensions of the cells of the cube, other than the pair
+CUBE_DIMENSIONS = ['series', 'surface', 'tournament', 'year']
+
+CUBE_COLUMNS = ['player1', 'player2', 'matches', 'expected_wins_p1', 'expected_wins_p2', 'actual_wins_p1', 'actual_wins_p2', 'or', 'p_value_fisher', 'p_value_fisher_adj']
+
+class PairCube:
+    """
+    Per-pair sums of the matches of one dataset and upset type in (Series, Surface, Tournament, year) cells. The cell
+    arrays have one value per non-empty cell of a pair; the first_p_i and first_p_j arrays have one value per
+    non-empty cell of a player, with the position in the match data file of the player's first match in the cell.
+    """
+
+    def __init__(self, dataset, upset, arrays):
+        self.dataset = dataset
+        self.upset = upset
+        self.players = arrays['players']
+        self.pair_p1 = arrays['pair_p1']
+        self.pair_p2 = arrays['pair_p2']
+        for name in ['series', 'surface', 'tournament']:
+            setattr(self, name + '_categories', arrays[name + '_categories'])
+        self.cells = {name: arrays['cell_' + name] for name in ['pair'] + CUBE_DIMENSIONS + ['matches', 'expected_wins_p1', 'expected_wins_p2', 'actual_wins_p1']}
+        self.first_p_i = {name: arrays['first_p_i_' + name] for name in ['player', 'row'] + CUBE_DIMENSIONS}
+        self.first_p_j = {name: arrays['first_p_j_' + name] for name in ['player', 'row'] + CUBE_DIMENSIONS}
+
+    def __len__(self):
+        return len(self.cells['pair'])
+
+    def get_code(self, dimension, value):
+        # Code of a Series, Surface or Tournament value, or -2 (which no cell has) if the value is not in the dataset
+        categories = getattr(self, dimension + '_categories')
+        k = np.flatnonzero(categories == value)
+        return int(k[0]) if len(k) else -2
+
+    def get_mask(self, cells, args):
+        """
+        Selects the cells that match the filters of a query.
+
+        Parameters:
+        - cells (dict): Dimension arrays of the cells, e.g., self.cells
+        - args (Namespace): Options of the query
+
+        Returns:
+        - mask (array): Boolean array, True for the selected cells
+        """
+        mask = np.ones(len(cells['year']), dtype=bool)
+        if args.tournament != 'all':
+            mask &= cells['tournament'] == self.get_code('tournament', args.tournament)
+
+        # Matches without a series count as non grand slams, as in bogey_tennis_fisher.py
+        if args.grand_slam == 0:
+            mask &= cells['series'] != self.get_code('series', 'Grand Slam')
+        elif args.grand_slam == 1:
+            mask &= cells['series'] == self.get_code('series', 'Grand Slam')
+
+        if args.series is not None:
+            mask &= np.isin(cells['series'], [self.get_code('series', series) for series in args.series])
+        if args.surface is not None:
+            mask &= np.isin(cells['surface'], [self.get_code('surface', surface) for surface in args.surface])
+        if args.s_year is not None:
+            mask &= cells['year'] >= args.s_year
+        if args.e_year is not None:
+            mask &= cells['year'] <= args.e_year
+        return mask
+
+    def get_players(self, first, args):
+        # Players with a match in the selected cells, in order of their first match, as pandas unique would give them
+        mask = self.get_mask(first, args) & (first['player'] >= 0)
+        first_row = pd.Series(first['row'][mask]).groupby(first['player'][mask]).min().sort_values(kind='stable')
+        return self.players[first_row.index.to_numpy()]
+
+    def query(self, args):
+        """
+        Runs the Fisher's exact test of every pair over the matches selected by the filters of a query.
+
+        Parameters:
+        - args (Namespace): Options of the query
+
+        Returns:
+        - results (DataFrame): One row per pair that played in the selected matches, with the columns CUBE_COLUMNS,
+          in the order of the output rows of bogey_tennis_fisher.py
+        """
+        mask = self.get_mask(self.cells, args)
+        pair = self.cells['pair'][mask]
+        n_pairs = len(self.pair_p1)
+
+        def pair_sum(name):
+            return np.bincount(pair, weights=self.cells[name][mask], minlength=n_pairs)
+
+        matches = pair_sum('matches').astype(np.int64)
+        played = np.flatnonzero(matches > 0)
+        players_1 = self.get_players(self.first_p_i, args) if args.player_1 == 'all' else [args.player_1]
+        players_2 = self.get_players(self.first_p_j, args) if args.player_2 == 'all' else [args.player_2]
+        played = played[bogey.get_scan_order(pd.Index(self.pair_p1[played]), pd.Index(self.pair_p2[played]), players_1, players_2)]
+
+        matches = matches[played]
+        actual_wins_p1 = pair_sum('actual_wins_p1')[played].astype(np.int64)
+        totals = pd.DataFrame({
+            'matches': matches,
+            'expected_wins_p1': pair_sum('expected_wins_p1')[played],
+            'expected_wins_p2': pair_sum('expected_wins_p2')[played],
+            'actual_wins_p1': actual_wins_p1,
+            'actual_wins_p2': matches - actual_wins_p1,
+        })
+        observed = np.stack([totals[['expected_wins_p1', 'actual_wins_p1']].to_numpy(dtype=float),
+                             totals[['expected_wins_p2', 'actual_wins_p2']].to_numpy(dtype=float)], axis=1)
+        oddsratios, p_vals_fisher = fisher_exact_batch(observed)
+
+        return pd.DataFrame({
+            'player1': self.pair_p1[played].astype(object),
+            'player2': self.pair_p2[played].astype(object),
+            'matches': totals['matches'],
+            'expected_wins_p1': totals['expected_wins_p1'],
+            'expected_wins_p2': totals['expected_wins_p2'],
+            'actual_wins_p1': totals['actual_wins_p1'],
+            'actual_wins_p2': totals['actual_wins_p2'],
+            'or': oddsratios,
+            'p_value_fisher': p_vals_fisher,
+            'p_value_fisher_adj': p_adjust(p_vals_fisher, args.p_adj_method),
+        }, columns=CUBE_COLUMNS)
+
+def get_cube_path(dataset, upset):
+    return get_store_path(dataset) + '_cube_' + upset
+
+def get_match_dimensions(matches):
+    # Series, Surface and Tournament codes into the match store's categories, and the year, of every match
+    dimensions = {name: matches[name.capitalize()].cat.codes.to_numpy().astype(np.int32) for name in ['series', 'surface', 'tournament']}
+    dimensions['year'] = (matches['Day'].to_numpy().astype('datetime64[D]').astype('datetime64[Y]').astype(np.int64) + 1970).astype(np.int16)
+    return dimensions
+
+def get_first_matches(players, dimensions):
+    """
+    Finds the first match of each player in each (Series, Surface, Tournament, year) cell.
+
+    Parameters:
+    - players (array): Player code of every match, e.g., of the P_i player
+    - dimensions (dict): Dimension arrays of every match, as returned by get_match_dimensions
+
+    Returns:
+    - first (dict): The arrays player, row (position of the first match) and the dimensions, with one value per cell
+    """
+    keys = [players] + [dimensions[name] for name in CUBE_DIMENSIONS]
+    rows = pd.Series(np.arange(len(players), dtype=np.int64)).groupby(keys, sort=False).min()
+    first = {'player': rows.index.get_level_values(0).to_numpy().astype(np.int32), 'row': rows.to_numpy()}
+    for k, name in enumerate(CUBE_DIMENSIONS):
+        first[name] = rows.index.get_level_values(k + 1).to_numpy().astype(dimensions[name].dtype)
+    return first
+
+def build_pair_cube(dataset, upset):
+    """
+    Sums the matches of a dataset into the cells of the cube of an upset type and writes it to the cube folder as one
+    .npy file per array, replacing the folder atomically.
+
+    Parameters:
+    - dataset (str): 'atp', 'wta' or 'test'
+    - upset (str): 'odds' or 'elo'
+    """
+    store = load_match_store(dataset)
+    matches = bogey.prepare_matches(store.to_frame(), upset)
+    dimensions = get_match_dimensions(matches)
+    arrays = {'players': store.players}
+    for name in ['series', 'surface', 'tournament']:
+        arrays[name + '_categories'] = getattr(store, name + '_categories')
+
+    # The players of each pair, taken from the first match of the pair
+    pair_code = matches['pair_code'].to_numpy()
+    first_rows = pd.Series(np.arange(len(matches))).groupby(pair_code).first().to_numpy()
+    arrays['pair_p1'] = matches['pair_p1'].to_numpy(dtype=object)[first_rows].astype(str)
+    arrays['pair_p2'] = matches['pair_p2'].to_numpy(dtype=object)[first_rows].astype(str)
+
+    # Missing probabilities are skipped when summing, as in get_pair_totals
+    values = pd.DataFrame({
+        'matches': np.ones(len(matches), dtype=np.int64),
+        'expected_wins_p1': np.nan_to_num(matches['p1_win_prob'].to_numpy(dtype=float)),
+        'expected_wins_p2': np.nan_to_num(matches['p2_win_prob'].to_numpy(dtype=float)),
+        'actual_wins_p1': matches['p1_won'].to_numpy(dtype=np.int64),
+    })
+    sums = values.groupby([pair_code] + [dimensions[name] for name in CUBE_DIMENSIONS], sort=False).sum()
+    arrays['cell_pair'] = sums.index.get_level_values(0).to_numpy().astype(np.int32)
+    for k, name in enumerate(CUBE_DIMENSIONS):
+        arrays['cell_' + name] = sums.index.get_level_values(k + 1).to_numpy().astype(dimensions[name].dtype)
+    for name in values.columns:
+        arrays['cell_' + name] = sums[name].to_numpy()
+
+    for column in ['P_i', 'P_j']:
+        first = get_first_matches(matches[column].cat.codes.to_numpy(), dimensions)
+        for name, values in first.items():
+            arrays['first_' + column.lower() + '_' + name] = values
+    arrays['source'] = get_source_signature(DATASET_FILES[dataset])
+
+    write_array_folder(get_cube_path(dataset, upset), arrays)
+
+def load_pair_cube(dataset, upset, rebuild=False):
+    """
+    Loads the cube of a dataset and upset type, building it first if it does not exist or the match data file has changed.
+
+    Parameters:
+    - dataset (str): 'atp', 'wta' or 'test'
+    - upset (str): 'odds' or 'elo'
+    - rebuild (bool): Whether to build the cube even if it is up to date (default = False)
+
+    Returns:
+    - cube (PairCube): The cube, with its arrays memory-mapped read-only
+    """
+    cube_path = get_cube_path(dataset, upset)
+    if rebuild:
+        build_pair_cube(dataset, upset)
+    while True:
+        if not is_array_folder_current(cube_path, DATASET_FILES[dataset]):
+            build_pair_cube(dataset, upset)
+        arrays = read_array_folder(cube_path)
+        if arrays is not None:
+            return PairCube(dataset, upset, arrays)
+
+def get_cube_filename(args):
+    # Same name as the result file of bogey_tennis_fisher.py with the same options, with a different prefix and the
+    # series, surface and year filters
+    filename = bogey.get_output_filename(argparse.Namespace(**dict(vars(args), s_date='min', e_date='max')))
+    filename = filename[:-len('.csv')].replace('bogey_results_output', 'bogey_cube_output', 1)
+    for values in [args.series, args.surface]:
+        if values is not None:
+            filename += '_' + '_'.join(value.lower().replace(' ', '_') for value in values)
+    if args.s_year is not None or args.e_year is not None:
+        filename += '_' + ('min' if args.s_year is None else str(args.s_year)) + '_' + ('max' if args.e_year is None else str(args.e_year))
+    return filename + '.csv'
+
+def main():
+    args = parser.parse_args()
+    start = time.time()
+
+    cube = load_pair_cube(args.dataset, args.upset, args.rebuild)
+    loaded = time.time()
+    results = cube.query(args)
+
+    filename = get_cube_filename(args)
+    results.to_csv(filename, index=False)
+    print(datetime.now().strftime('%d/%m/%Y %H:%M:%S') + ' ' + str(len(results)) + ' player pairs written to ' + filename + ', cube of ' + str(len(cube)) + ' cells loaded in '
+          + str(round(loaded - start, 1)) + 's and queried in ' + str(round(time.time() - loaded, 2)) + 's')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,198 @@
+import argparse
+import multiprocessing
+import time
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from match_store import load_match_store
+from fisher_batch import fisher_exact_batch
+from p_adjust import p_adjust, P_ADJUST_METHODS
+import bogey_tennis_fisher as bogey
+
+# Monte Carlo null calibration of the bogey p-values. The 2x2 table of bogey_tennis_fisher.py mixes fractional
+# expected wins with integer actual wins, so here the null distribution of the wins of each pair is simulated
+# instead: the outcome of every match is drawn from its pre-match win probabilities (the normalized betting odds or
+# the Elo ratings), and the p-value of a pair is the share of simulations in which the wins of player 1 are at least as
+# far from the expected wins as the actual wins are. Pairs are simulated in batches, and a pair stops as soon as its
+# p-value is clearly above alpha, so that the simulations go to the pairs that are close to significant.
+parser = argparse.ArgumentParser()
+parser.add_argument('-p1', '--player_1', type=str, required=False, default='all', help='player name in format Last Name Initial., enclosed in double quotes e.g., "Djokovic N." (default = all players)')
+parser.add_argument('-p2', '--player_2', type=str, required=False, default='all', help='player name in format Last Name Initial., enclosed in double quotes e.g., "Djokovic N." (default = all players)')
+parser.add_argument('-d', '--dataset', type=str, required=True, help='atp or wta')
+parser.add_argument('-g', '--grand_slam', type=int, required=False, default=2, help='0 = non grand slams, 1 = grand slams only, 2 = grand slams and non grand slams (default)')
+parser.add_argument('-t', '--tournament', type=str, required=False, default='all', help='tournament name, e.g., Australian Open')
+parser.add_argument('-s', '--s_date', type=str, required=False, default='min', help='start date in YYYY-MM-DD format (default = min date in dataset)')
+parser.add_argument('-e', '--e_date', type=str, required=False, default='max', help='end date in YYYY-MM-DD format (default = max date in dataset)')
+parser.add_argument('-p', '--p_adj_method', type=str, required=False, choices=P_ADJUST_METHODS, default='BH', help='p-value adjustment for multiple comparisons method, e.g., bonferroni, hochberg, BH, holm, hommel, BY')
+parser.add_argument('-u', '--upset', type=str, required=False, choices=['odds','elo'], default='odds', help='whether an unexpected result is based on the betting odds or elo rating (default=odds)')
+parser.add_argument('--alpha', type=float, required=False, default=0.05, help='significance level that the p-values are calibrated around (default = 0.05)')
+parser.add_argument('--batch', type=int, required=False, default=1000, help='simulations per pair between stopping checks (default = 1000)')
+parser.add_argument('--max_sims', type=int, required=False, default=100000, help='maximum simulations per pair (default = 100000)')
+parser.add_argument('--z', type=float, required=False, default=3.0, help='a pair stops when the lower end of the Wilson interval of its p-value, with this z score, is above alpha (default = 3)')
+parser.add_argument('--seed', type=int, required=False, default=0, help='seed of the simulations, the same seed always gives the same p-values for any number of workers (default = 0)')
+parser.add_argument('-w', '--workers', type=int, required=False, default=1, help='number of worker processes used to simulate the pairs (default = 1)')
+
+# Matches per shard of pairs. Shards do not depend on the number of workers, and each shard has its own random
+# stream, so the results only depend on the seed
+SHARD_MATCHES = 50000
+
+# Largest number of random draws held in memory at once
+MAX_DRAWS = 1 << 22
+
+def wilson_lower_bound(k, n, z):
+    # Lower end of the Wilson score interval of a proportion of k successes in n trials
+    p = k / n
+    center = p + z * z / (2 * n)
+    half = z * np.sqrt(p * (1 - p) / n + z * z / (4 * n * n))
+    return (center - half) / (1 + z * z / n)
+
+def simulate_shard(shard):
+    """
+    Simulates the wins of the pairs of a shard under the null hypothesis that every match is won with its pre-match
+    win probability, until each pair's p-value is clearly above alpha or it reaches the maximum number of simulations.
+
+    Parameters:
+    - shard (dict): The win probabilities of player 1 in the matches of the pairs (probs, laid out pair after pair
+      with the pairs starting at offsets), the expected and actual wins of player 1 of each pair, the random seed
+      sequence of the shard and the alpha, batch, max_sims and z options
+
+    Returns:
+    - exceed (array): Number of simulations of each pair at least as extreme as the actual wins
+    - sims (array): Number of simulations of each pair
+    """
+    rng = np.random.default_rng(shard['seed'])
+    probs, offsets = shard['probs'], shard['offsets']
+    n_pairs = len(offsets) - 1
+    matches = np.diff(offsets)
+    # A small tolerance so that simulations as far from the expected wins as the actual wins are counted despite rounding
+    distance = np.abs(shard['actual'] - shard['expected']) - 1e-9
+
+    exceed = np.zeros(n_pairs, dtype=np.int64)
+    sims = np.zeros(n_pairs, dtype=np.int64)
+    active = np.arange(n_pairs)
+    while len(active):
+        # Matches of the active pairs, laid out pair after pair
+        active_matches = matches[active]
+        starts = np.zeros(len(active), dtype=np.int64)
+        starts[1:] = np.cumsum(active_matches)[:-1]
+        match_positions = np.repeat(offsets[active] - starts, active_matches) + np.arange(active_matches.sum())
+        active_probs = probs[match_positions]
+
+        # Every active pair has had the same number of simulations, since the pairs only ever stop
+        n_sims = min(shard['batch'], shard['max_sims'] - sims[active[0]])
+        chunk = max(1, MAX_DRAWS // len(active_probs))
+        for done in range(0, n_sims, chunk):
+            draws = rng.random((min(chunk, n_sims - done), len(active_probs))) < active_probs
+            wins = np.add.reduceat(draws, starts, axis=1, dtype=np.int64)
+            exceed[active] += (np.abs(wins - shard['expected'][active]) >= distance[active]).sum(axis=0)
+        sims[active] += n_sims
+
+        lower = wilson_lower_bound(exceed[active], sims[active], shard['z'])
+        active = active[(lower <= shard['alpha']) & (sims[active] < shard['max_sims'])]
+    return exceed, sims
+
+def split_into_shards(probs, matches, expected, actual, settings):
+    """
+    Splits the pairs into contiguous shards of about SHARD_MATCHES matches, each with its own random stream.
+
+    Parameters:
+    - probs (array): Win probabilities of player 1 in the matches of the pairs, laid out pair after pair
+    - matches (array): Number of matches of each pair
+    - expected (array): Expected wins of player 1 of each pair
+    - actual (array): Actual wins of player 1 of each pair
+    - settings (dict): The seed, alpha, batch, max_sims and z options
+
+    Returns:
+    - shards (list): The inputs of simulate_shard for each shard
+    """
+    offsets = np.zeros(len(matches) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(matches)
+    bounds = [0]
+    for k in range(1, len(matches) + 1):
+        if offsets[k] - offsets[bounds[-1]] >= SHARD_MATCHES or k == len(matches):
+            bounds.append(k)
+    seeds = np.random.SeedSequence(settings['seed']).spawn(max(len(bounds) - 1, 1))
+    shards = []
+    for k, (start, end) in enumerate(zip(bounds[:-1], bounds[1:])):
+        shards.append(dict(settings, seed=seeds[k], probs=probs[offsets[start]:offsets[end]], offsets=offsets[start:end + 1] - offsets[start],
+                           expected=expected[start:end], actual=actual[start:end]))
+    return shards
+
+def run_montecarlo(args, matches, player_index=None):
+    """
+    Runs the Fisher's exact tests of bogey_tennis_fisher.py and the Monte Carlo tests of every pair.
+
+    Parameters:
+    - args (Namespace): Options of the run
+    - matches (DataFrame): Matches of the dataset with the columns added by prepare_matches for args.upset
+    - player_index (PlayerIndex): Adjacency index of matches, used when a player is given (default = None, no index,
+      the matches of the player are looked up with bogey_tennis_fisher.get_player_rows)
+
+    Returns:
+    - results (DataFrame): One row per pair, in the order of the output rows of bogey_tennis_fisher.py, with the
+      Fisher and Monte Carlo p-values and the number of simulations of each pair
+    """
+    df, players_1, players_2 = bogey.get_run_matches(matches, args, player_index)
+    pair_index = bogey.build_pair_index(df, players_1, players_2)
+    totals = bogey.get_pair_totals(df, pair_index)
+
+    observed = np.stack([totals[['expected_wins_p1', 'actual_wins_p1']].to_numpy(dtype=float),
+                         totals[['expected_wins_p2', 'actual_wins_p2']].to_numpy(dtype=float)], axis=1)
+    _, p_vals_fisher = fisher_exact_batch(observed)
+
+    # Missing probabilities count as zero, as in the expected wins
+    rows = np.concatenate([rows for _, _, rows in pair_index]) if pair_index else np.array([], dtype=np.int64)
+    probs = np.nan_to_num(df['p1_win_prob'].to_numpy(dtype=float)[rows])
+    expected = totals['expected_wins_p1'].to_numpy(dtype=float)
+    actual = totals['actual_wins_p1'].to_numpy(dtype=np.int64)
+    settings = dict(seed=args.seed, alpha=args.alpha, batch=args.batch, max_sims=args.max_sims, z=args.z)
+    shards = split_into_shards(probs, totals['matches'].to_numpy(), expected, actual, settings)
+
+    if args.workers > 1 and len(shards) > 1:
+        with multiprocessing.get_context().Pool(args.workers) as pool:
+            simulated = pool.map(simulate_shard, shards)
+    else:
+        simulated = [simulate_shard(shard) for shard in shards]
+    exceed = np.concatenate([e for e, _ in simulated]) if simulated else np.array([], dtype=np.int64)
+    sims = np.concatenate([s for _, s in simulated]) if simulated else np.array([], dtype=np.int64)
+
+    # The estimate counts the actual wins as one of the simulations, so it is never zero
+    p_vals_mc = (exceed + 1) / (sims + 1)
+    return pd.DataFrame({
+        'player1': [str(p1) for p1, _, _ in pair_index],
+        'player2': [str(p2) for _, p2, _ in pair_index],
+        'matches': totals['matches'],
+        'expected_wins_p1': expected,
+        'actual_wins_p1': actual,
+        'p_value_fisher': p_vals_fisher,
+        'p_value_fisher_adj': p_adjust(p_vals_fisher, args.p_adj_method),
+        'p_value_mc': p_vals_mc,
+        'p_value_mc_adj': p_adjust(p_vals_mc, args.p_adj_method),
+        'simulations': sims,
+    })
+
+def get_montecarlo_filename(args):
+    # Same name as the result file of bogey_tennis_fisher.py with the same options, with a different prefix
+    return bogey.get_output_filename(args).replace('bogey_results_output', 'bogey_montecarlo_output', 1)
+
+def main():
+    args = parser.parse_args()
+    start = time.time()
+
+    all_matches = load_match_store(args.dataset).to_frame()
+    matches = bogey.prepare_matches(all_matches, args.upset)
+    results = run_montecarlo(args, matches)
+
+    filename = get_montecarlo_filename(args)
+    results.to_csv(filename, index=False)
+
+    # Compare the pairs found significant by the two tests
+    fisher_significant = results['p_value_fisher_adj'] < args.alpha
+    mc_significant = results['p_value_mc_adj'] < args.alpha
+    print(datetime.now().strftime('%d/%m/%Y %H:%M:%S') + ' ' + str(len(results)) + ' player pairs written to ' + filename + ' in ' + str(round(time.time() - start, 1)) + 's')
+    print(str(results['simulations'].sum()) + ' simulations, ' + str((results['simulations'] >= args.max_sims).sum()) + ' pairs simulated ' + str(args.max_sims) + ' times')
+    print('Significant at ' + str(args.alpha) + ': ' + str(fisher_significant.sum()) + ' pairs with Fisher\'s exact test, ' + str(mc_significant.sum()) + ' pairs with the Monte Carlo test, '
+          + str((fisher_significant & mc_significant).sum()) + ' with both')
+
+if __name__ == '__main__':
+    main()
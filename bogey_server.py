@@ -0,0 +1,301 @@
+import argparse
+import asyncio
+import json
+import os
+import stat
+import threading
+import time
+import traceback
+from collections import OrderedDict
+from datetime import datetime
+from urllib.parse import urlsplit, parse_qs
+import numpy as np
+from match_store import load_match_store, date_to_day
+from fisher_batch import fisher_exact_batch
+from p_adjust import p_adjust, P_ADJUST_METHODS
+from player_index import PlayerIndex
+import bogey_tennis_fisher as bogey
+
+# Long-lived head-to-head query server. The datasets are loaded from the match store when the server starts, and
+# prepared once for each upset type by the first query that uses it. Each query is answered from a filtered view of
+# the matches, with its player pairs looked up in a player adjacency index. The players of the most recent filter combinations are kept in an LRU cache,
+# so a query only filters and scores the matches of the players it asks for. Queries are HTTP GET requests, on localhost or on a Unix socket, e.g.,
+#   curl 'http://127.0.0.1:8765/query?dataset=atp&player_1=Djokovic%20N.&player_2=Murray%20A.'
+parser = argparse.ArgumentParser()
+parser.add_argument('-d', '--datasets', type=str, nargs='+', required=False, default=['atp', 'wta'], help='datasets to load, e.g., atp wta (default = atp wta)')
+parser.add_argument('--host', type=str, required=False, default='127.0.0.1', help='address to listen on (default = 127.0.0.1)')
+parser.add_argument('--port', type=int, required=False, default=8765, help='port to listen on (default = 8765)')
+parser.add_argument('--socket', type=str, required=False, default=None, help='path of a Unix socket to listen on instead of the host and port')
+parser.add_argument('--cache_size', type=int, required=False, default=32, help='number of filtered views kept in the LRU cache (default = 32)')
+
+# Match data columns needed to prepare the matches for each upset type, which not every dataset has
+UPSET_COLUMNS = {'odds': ['AvgW', 'AvgL'], 'elo': ['Elo_i_before_match', 'Elo_j_before_match']}
+
+# Query parameters, with the names of the options of bogey_tennis_fisher.py
+QUERY_PARAMETERS = ['dataset', 'player_1', 'player_2', 'upset', 'grand_slam', 'tournament', 's_date', 'e_date', 'p_adj_method']
+
+class QueryError(Exception):
+    # Invalid query, answered with 400 Bad Request
+    pass
+
+class FilteredView:
+    """
+    One combination of the grand slam, tournament and date filters of a dataset, with the players of its matches in
+    the order in which bogey_tennis_fisher.py scans them for one-vs-all queries.
+    """
+
+    def __init__(self, matches, player_index, args):
+        self.matches = matches
+        self.player_index = player_index
+        df = bogey.filter_matches(matches, args)
+        self.players_1 = df['P_i'].unique()
+        self.players_2 = df['P_j'].unique()
+
+    def get_pairs(self, args):
+        """
+        Looks up the matches of the players of a query in the player index, and indexes their player pairs in the
+        order of the output rows of bogey_tennis_fisher.py run with the same players.
+
+        Parameters:
+        - args (Namespace): Options of the query, with the filters of the view
+
+        Returns:
+        - df (DataFrame): Filtered matches of the players
+        - pair_index (list): List of (p1, p2, rows) tuples, as returned by build_pair_index
+        """
+        df = bogey.get_player_matches(self.matches, args, self.player_index)
+        players_1 = self.players_1 if args.player_1 == 'all' else [args.player_1]
+        players_2 = self.players_2 if args.player_2 == 'all' else [args.player_2]
+        return df, bogey.build_pair_index(df, players_1, players_2)
+
+class ViewCache:
+    """
+    LRU cache of the filtered views of the most recent filter combinations.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.views = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, build):
+        # Returns the view of the key, building it with build() and evicting the least recently used view if needed
+        if key in self.views:
+            self.hits += 1
+            self.views.move_to_end(key)
+            return self.views[key]
+        self.misses += 1
+        view = build()
+        self.views[key] = view
+        if len(self.views) > self.maxsize:
+            self.views.popitem(last=False)
+        return view
+
+def get_query_args(params, datasets):
+    """
+    Builds the options of a query from the parameters of its URL, with the defaults of bogey_tennis_fisher.py.
+
+    Parameters:
+    - params (dict): Query parameters, as parsed by parse_qs
+    - datasets (list): Datasets loaded by the server
+
+    Returns:
+    - args (Namespace): Options of the query
+    """
+    unknown = set(params) - set(QUERY_PARAMETERS)
+    if unknown:
+        raise QueryError('unknown parameters: ' + ', '.join(sorted(unknown)))
+    values = {name: value[-1] for name, value in params.items()}
+    if values.get('dataset') not in datasets:
+        raise QueryError('dataset must be one of: ' + ', '.join(datasets))
+    args = bogey.parser.parse_args(['-d', values.pop('dataset')])
+    for name, value in values.items():
+        setattr(args, name, value)
+
+    if args.player_1 == 'all' and args.player_2 == 'all':
+        raise QueryError('give player_1, player_2 or both, all-vs-all runs are written by bogey_tennis_fisher.py')
+    if args.upset not in ['odds', 'elo']:
+        raise QueryError('upset must be odds or elo')
+    if args.p_adj_method not in P_ADJUST_METHODS:
+        raise QueryError('p_adj_method must be one of: ' + ', '.join(P_ADJUST_METHODS))
+    if args.grand_slam not in ['0', '1', '2', 2]:
+        raise QueryError('grand_slam must be 0, 1 or 2')
+    args.grand_slam = int(args.grand_slam)
+    for date in [args.s_date, args.e_date]:
+        try:
+            if date not in ['min', 'max']:
+                date_to_day(date)
+        except ValueError:
+            raise QueryError('dates must be in YYYY-MM-DD format, not ' + date)
+    return args
+
+def score_query(view, args):
+    """
+    Scores the player pairs of a query, as bogey_tennis_fisher.py would for the same options.
+
+    Parameters:
+    - view (FilteredView): Filtered view of the filters of the query
+    - args (Namespace): Options of the query
+
+    Returns:
+    - rows (list): One dict per pair with the columns of the metrics file
+    """
+    df, pair_index = view.get_pairs(args)
+    totals = bogey.get_pair_totals(df, pair_index)
+    observed = np.stack([totals[['expected_wins_p1', 'actual_wins_p1']].to_numpy(dtype=float),
+                         totals[['expected_wins_p2', 'actual_wins_p2']].to_numpy(dtype=float)], axis=1)
+    oddsratios, p_vals_fisher = fisher_exact_batch(observed)
+    # The p-values are adjusted over the pairs of the query, as in a run with the same players
+    p_vals_fisher_adj = p_adjust(p_vals_fisher, args.p_adj_method)
+
+    # The data of the pairs is kept with the query rather than in the module globals of bogey_tennis_fisher.py, as
+    # queries are scored concurrently in the threads of the server
+    shared = bogey.get_shared(df, pair_index, totals, oddsratios, p_vals_fisher, p_vals_fisher_adj)
+    columns = bogey.RESULT_COLUMNS + bogey.METRICS_COLUMNS
+    rows = []
+    for i in range(len(pair_index)):
+        data, metrics = bogey.score_pair(i, shared)
+        rows.append({name: value.item() if isinstance(value, np.generic) else value for name, value in zip(columns, data + metrics)})
+    return rows
+
+class QueryServer:
+    """
+    Holds the matches of each dataset, their matches prepared for each upset type that has been queried, and the
+    cache of filtered views.
+    """
+
+    def __init__(self, datasets, cache_size):
+        self.datasets = datasets
+        self.all_matches = {}
+        self.prepared = {}
+        self.player_indexes = {}
+        for dataset in datasets:
+            self.all_matches[dataset] = load_match_store(dataset).to_frame()
+            # The players of each match are the same for both upset types, so the index is shared by them
+            self.player_indexes[dataset] = PlayerIndex(self.all_matches[dataset])
+        self.cache = ViewCache(cache_size)
+        # Queries are answered in a thread pool, so the views and prepared matches are built under a lock
+        self.lock = threading.Lock()
+        self.queries = 0
+        self.start = time.time()
+
+    def get_prepared(self, dataset, upset):
+        # Prepares the matches of a dataset for an upset type the first time they are queried
+        if (dataset, upset) not in self.prepared:
+            all_matches = self.all_matches[dataset]
+            missing = [column for column in UPSET_COLUMNS[upset] if column not in all_matches]
+            if missing:
+                raise QueryError('upset ' + upset + ' needs the ' + ', '.join(missing) + ' columns, which the ' + dataset + ' dataset does not have')
+            self.prepared[(dataset, upset)] = bogey.prepare_matches(all_matches, upset)
+        return self.prepared[(dataset, upset)]
+
+    def get_view(self, args):
+        key = (args.dataset, args.upset, args.grand_slam, args.tournament, args.s_date, args.e_date)
+        with self.lock:
+            return self.cache.get(key, lambda: FilteredView(self.get_prepared(args.dataset, args.upset), self.player_indexes[args.dataset], args))
+
+    def query(self, params):
+        # Answers a /query request
+        start = time.perf_counter()
+        args = get_query_args(params, self.datasets)
+        rows = score_query(self.get_view(args), args)
+        with self.lock:
+            self.queries += 1
+        return {'settings': {name: getattr(args, name) for name in QUERY_PARAMETERS}, 'pairs': len(rows), 'rows': rows,
+                'seconds': time.perf_counter() - start}
+
+    def stats(self):
+        # Answers a /stats request
+        return {'datasets': self.datasets, 'uptime_sec': time.time() - self.start, 'queries': self.queries,
+                'cached_views': len(self.cache.views), 'cache_size': self.cache.maxsize,
+                'cache_hits': self.cache.hits, 'cache_misses': self.cache.misses}
+
+    def handle_request(self, target):
+        """
+        Answers a GET request.
+
+        Parameters:
+        - target (str): Path and query string of the request
+
+        Returns:
+        - status (str): HTTP status line of the response
+        - body (dict): JSON body of the response
+        """
+        url = urlsplit(target)
+        try:
+            if url.path == '/query':
+                return '200 OK', self.query(parse_qs(url.query, keep_blank_values=True))
+            if url.path == '/stats':
+                return '200 OK', self.stats()
+            return '404 Not Found', {'error': 'unknown path ' + url.path + ', use /query or /stats'}
+        except QueryError as e:
+            return '400 Bad Request', {'error': str(e)}
+        except Exception as e:
+            # Any other error is a bug, which is logged and answered without closing the connection or the server
+            traceback.print_exc()
+            return '500 Internal Server Error', {'error': type(e).__name__ + ': ' + str(e)}
+
+    async def handle_connection(self, reader, writer):
+        # Answers the requests of one connection, which is kept open until the client closes it or asks to close it
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                parts = request_line.decode('latin-1').split()
+                if len(parts) != 3:
+                    status, body = '400 Bad Request', {'error': 'malformed request line'}
+                elif parts[0] != 'GET':
+                    status, body = '405 Method Not Allowed', {'error': 'only GET requests are supported'}
+                else:
+                    # The query is scored in a thread, so that the server keeps reading and answering other requests
+                    status, body = await asyncio.get_running_loop().run_in_executor(None, self.handle_request, parts[1])
+
+                keep_alive = headers.get('connection', '').lower() != 'close' and len(parts) == 3 and parts[2] == 'HTTP/1.1'
+                payload = json.dumps(body).encode('utf-8')
+                writer.write(('HTTP/1.1 ' + status + '\r\nContent-Type: application/json\r\nContent-Length: ' + str(len(payload))
+                              + '\r\nConnection: ' + ('keep-alive' if keep_alive else 'close') + '\r\n\r\n').encode('latin-1') + payload)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+async def serve(server_args):
+    start = time.time()
+    query_server = QueryServer(server_args.datasets, server_args.cache_size)
+    if server_args.socket is not None:
+        server = await asyncio.start_unix_server(query_server.handle_connection, path=server_args.socket)
+        address = server_args.socket
+    else:
+        server = await asyncio.start_server(query_server.handle_connection, server_args.host, server_args.port)
+        address = 'http://' + server_args.host + ':' + str(server_args.port)
+    print(datetime.now().strftime('%d/%m/%Y %H:%M:%S') + ' Loaded ' + ', '.join(server_args.datasets) + ' in ' + str(round(time.time() - start, 1)) + 's, listening on ' + address, flush=True)
+    async with server:
+        await server.serve_forever()
+
+def main():
+    server_args = parser.parse_args()
+    # A socket left behind by an earlier server is replaced, but any other file at the path is left alone
+    if server_args.socket is not None and os.path.exists(server_args.socket):
+        if not stat.S_ISSOCK(os.stat(server_args.socket).st_mode):
+            parser.error(server_args.socket + ' exists and is not a socket')
+        os.remove(server_args.socket)
+    try:
+        asyncio.run(serve(server_args))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
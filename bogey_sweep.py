@@ -0,0 +1,92 @@
+import argparse
+import itertools
+import multiprocessing
+import time
+from datetime import datetime
+from match_store import load_match_store
+from p_adjust import P_ADJUST_METHODS
+from progress import PROGRESS_MODES
+import bogey_tennis_fisher as bogey
+
+# Runs the bogey analysis for every combination of the given options in a single process, replacing the shell loop
+# in Archive/run.sh that started the script (and loaded the dataset) again for every combination. Each dataset is
+# loaded once, and the odds, player pairs and win probabilities are prepared once per dataset and upset type and
+# shared by all the scenarios that use them.
+parser = argparse.ArgumentParser()
+parser.add_argument('-d', '--datasets', type=str, nargs='+', required=False, default=['atp', 'wta'], help='datasets to run, e.g., atp wta (default = atp wta)')
+parser.add_argument('-u', '--upsets', type=str, nargs='+', required=False, choices=['odds','elo'], default=['odds', 'elo'], help='upset types to run (default = odds elo)')
+parser.add_argument('-g', '--grand_slams', type=int, nargs='+', required=False, choices=[0, 1, 2], default=[0, 1, 2], help='grand slam options to run (default = 0 1 2)')
+parser.add_argument('-t', '--tournaments', type=str, nargs='+', required=False, default=['all'], help='tournament names to run, enclosed in double quotes e.g., "Australian Open" "US Open" (default = all)')
+parser.add_argument('--windows', type=str, nargs='+', required=False, default=['min:max'], help='date windows to run in start:end format, e.g., 2006-01-01:2006-12-31 (default = min:max)')
+parser.add_argument('-p', '--p_adj_method', type=str, required=False, choices=P_ADJUST_METHODS, default='BH', help='p-value adjustment for multiple comparisons method, e.g., bonferroni, hochberg, BH, holm, hommel, BY')
+parser.add_argument('--test', type=str, required=False, choices=['fisher', 'poisson-binomial'], default='fisher', help="test of the wins of each pair: fisher, or poisson-binomial to also add the exact Poisson-binomial test (default = fisher)")
+parser.add_argument('-j', '--jobs', type=int, required=False, default=1, help='number of scenarios run at the same time in worker processes (default = 1)')
+parser.add_argument('--incremental', action='store_true', help='update the output files of the previous --incremental run of each scenario with the matches added since then')
+parser.add_argument('--progress', type=str, required=False, choices=PROGRESS_MODES, default='text', help='how the progress of each scenario is reported: text, json (one JSON object per line) or off (default = text)')
+parser.add_argument('--progress_interval', type=float, required=False, default=5.0, help='seconds between progress reports (default = 5)')
+
+# Matches of the dataset being swept, set before the pool is created so that forked workers inherit them
+_prepared = {}
+
+def get_scenario_args(dataset, upset, grand_slam, tournament, window, sweep_args):
+    """
+    Builds the options of one scenario, as if it had been run as bogey_tennis_fisher.py from the command line.
+
+    Parameters:
+    - dataset (str): 'atp', 'wta' or 'test'
+    - upset (str): 'odds' or 'elo'
+    - grand_slam (int): 0, 1 or 2
+    - tournament (str): Tournament name, or 'all'
+    - window (str): Date window in start:end format
+    - sweep_args (Namespace): Options of the sweep
+
+    Returns:
+    - args (Namespace): Options of the scenario
+    """
+    s_date, e_date = window.split(':')
+    argv = ['-d', dataset, '-u', upset, '-g', str(grand_slam), '-t', tournament, '-s', s_date, '-e', e_date, '-p', sweep_args.p_adj_method, '--test', sweep_args.test,
+            '--progress', sweep_args.progress, '--progress_interval', str(sweep_args.progress_interval)]
+    if sweep_args.incremental:
+        argv.append('--incremental')
+    return bogey.parser.parse_args(argv)
+
+def run_scenario(args):
+    # Runs one scenario on the prepared matches of its dataset and upset type
+    start = time.time()
+    all_matches, matches = _prepared[(args.dataset, args.upset)]
+    # An incremental scenario is computed in full if its previous run cannot be updated
+    if not (args.incremental and bogey.update_run(args)):
+        bogey.run_analysis(args, all_matches, matches)
+    return bogey.get_output_filename(args), time.time() - start
+
+def main():
+    sweep_args = parser.parse_args()
+    # Scenarios that only differ in the date window or filters share a dataset, so the pool is only created per dataset.
+    # Fork is needed so that the workers inherit the prepared matches
+    use_pool = sweep_args.jobs > 1 and 'fork' in multiprocessing.get_all_start_methods()
+
+    n_scenarios = 0
+    for dataset in sweep_args.datasets:
+        # Load the dataset once, and prepare it once per upset type
+        all_matches = load_match_store(dataset).to_frame()
+        _prepared.clear()
+        for upset in sweep_args.upsets:
+            _prepared[(dataset, upset)] = (all_matches, bogey.prepare_matches(all_matches, upset))
+
+        scenarios = [get_scenario_args(dataset, *options, sweep_args)
+                     for options in itertools.product(sweep_args.upsets, sweep_args.grand_slams, sweep_args.tournaments, sweep_args.windows)]
+        if use_pool:
+            # Scenarios are already run in parallel, so each scenario scores its pairs in its own worker process
+            with multiprocessing.get_context('fork').Pool(sweep_args.jobs) as pool:
+                results = pool.imap(run_scenario, scenarios)
+                for filename, seconds in results:
+                    n_scenarios += 1
+                    print(datetime.now().strftime('%d/%m/%Y %H:%M:%S') + ' Scenario ' + str(n_scenarios) + ' written to ' + filename + ' in ' + str(round(seconds, 1)) + 's')
+        else:
+            for args in scenarios:
+                filename, seconds = run_scenario(args)
+                n_scenarios += 1
+                print(datetime.now().strftime('%d/%m/%Y %H:%M:%S') + ' Scenario ' + str(n_scenarios) + ' written to ' + filename + ' in ' + str(round(seconds, 1)) + 's')
+
+if __name__ == '__main__':
+    main()
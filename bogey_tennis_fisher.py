@@ -10,9 +10,16 @@ import pandas as pd
 import numpy as np
 import warnings
 import argparse
-from datetime import datetime
-import ast
 import os
+import json
+import multiprocessing
+from fisher_batch import fisher_exact_batch
+from poisson_binomial import poisson_binomial_test_batch
+from match_store import load_match_store, date_to_day
+from result_store import write_result_lists, load_result_lists, get_result_lists_path
+from p_adjust import p_adjust, P_ADJUST_METHODS
+from progress import Progress, PROGRESS_MODES
+from profiling import Profiler
 pd.options.mode.chained_assignment = None
 warnings.filterwarnings("ignore")
 
@@ -24,121 +31,552 @@ parser.add_argument('-g', '--grand_slam', type=int, required=False, default=2, h
 parser.add_argument('-t', '--tournament', type=str, required=False, default='all', help='tournament name, e.g., Australian Open')
 parser.add_argument('-s', '--s_date', type=str, required=False, default='min', help='start date in YYYY-MM-DD format (default = min date in dataset)')
 parser.add_argument('-e', '--e_date', type=str, required=False, default='max', help='end date in YYYY-MM-DD format (default = max date in dataset)')
-parser.add_argument('-p', '--p_adj_method', type=str, required=False, default='BH', help='p-value adjustment for multiple comparisons method, e.g., bonferroni, hochberg, BH, holm, hommel, BY')
+parser.add_argument('-p', '--p_adj_method', type=str, required=False, choices=P_ADJUST_METHODS, default='BH', help='p-value adjustment for multiple comparisons method, e.g., bonferroni, hochberg, BH, holm, hommel, BY')
+parser.add_argument('--test', type=str, required=False, choices=['fisher', 'poisson-binomial'], default='fisher', help="test of the wins of each pair: fisher (Fisher's exact test), or poisson-binomial to also add the exact Poisson-binomial test of the actual wins over the match win probabilities (default = fisher)")
 parser.add_argument('-u', '--upset', type=str, required=False, choices=['odds','elo'], default='odds', help='whether an unexpected result is based on the betting odds or elo rating (default=odds)')
-args, _ = parser.parse_known_args()
-
-def add_upset_type_column1(p1, p2, match_df):
-    # Check if the implied win probability for the loser is higher than the implied win probability for the winner,
-    # indicating a potential upset
-    if 1/match_df["AvgW"] < 1/match_df["AvgL"] and match_df['Winner'] == p1:
-        return "UW"  # Upset win for p1
-    elif 1/match_df["AvgW"] < 1/match_df["AvgL"] and match_df['Winner'] == p2:
-        return "UL"  # Upset loss for p2
-    else:
-        return "N"  # Non-upset
-
-def add_upset_type_column2(p1, p2, match_df):
-    # Check if the implied win probability for the loser is higher than the implied win probability for the winner,
-    # indicating a potential upset
-    if 1/match_df["AvgW"] < 1/match_df["AvgL"] and match_df['Winner'] == p2:
-        return "UW"  # Upset win for p2
-    elif 1/match_df["AvgW"] < 1/match_df["AvgL"] and match_df['Winner'] == p1:
-        return "UL"  # Upset loss for p1
-    else:
-        return "N"  # Non-upset
-
-def get_winner(p1, p2, match_df):
-    match_result_list = []
-    for winner in match_df['Winner']:
-        if winner == p1:
-            match_result_list.append('p1')
-        elif winner == p2:
-            match_result_list.append('p2')
-    return match_result_list
-
-def get_upset_result_list(p1, p2, match_df):
-    """
-    Extracts the upset types and dates from the match_df DataFrame for matches between players p1 and p2 
-    by utilizing the add_upset_type_column1 and add_upset_type_column2 functions. 
-    The upset types are stored in the upset_result_list, and the dates are returned as a separate list.
-    
+parser.add_argument('--incremental', action='store_true', help='update the output files of the previous --incremental run with the same options, folding in only the matches added to the end of the data file since then')
+parser.add_argument('--checkpoint', action='store_true', help='record the completed player pairs in a journal file, so that an interrupted run can be resumed with --resume')
+parser.add_argument('--resume', action='store_true', help='resume an interrupted run that was started with --checkpoint, skipping the player pairs it completed')
+parser.add_argument('--progress', type=str, required=False, choices=PROGRESS_MODES, default='text', help='how the progress is reported: text, json (one JSON object per line) or off (default = text)')
+parser.add_argument('--progress_interval', type=float, required=False, default=5.0, help='seconds between progress reports (default = 5)')
+parser.add_argument('--profile', action='store_true', help='record the wall time, CPU time, calls and peak memory (tracemalloc) of each stage of the run, and write them to a json report next to the output file')
+parser.add_argument('--profile_hot_loop', action='store_true', help='also profile the loop over the player pairs with cProfile, and dump its statistics next to the output file')
+parser.add_argument('-w', '--workers', type=int, required=False, default=1, help='number of worker processes used to score the player pairs (default = 1, no worker processes)')
+
+def add_upset_columns(df):
+    """
+    Classifies every match of the dataset as an upset or non-upset at once. A match is an upset if the implied win
+    probability of the loser is higher than the implied win probability of the winner, and upsets are oriented to the
+    canonical player pair: an upset win (UW) if p1 of the pair won, and an upset loss (UL) if p2 won.
+
+    Parameters:
+    - df (DataFrame): DataFrame containing the matches, with the columns added by add_win_probability_columns
+
+    Returns:
+    - df (DataFrame): df with the added columns upset (bool), result_type ('U' or 'N') and upset_type_p1 ('UW', 'UL' or 'N')
+    """
+    with np.errstate(divide='ignore'):
+        upset = 1/df["AvgW"].to_numpy(dtype=float) < 1/df["AvgL"].to_numpy(dtype=float)
+    p1_won = df['p1_won'].to_numpy(dtype=bool)
+
+    df['upset'] = upset
+    df['result_type'] = np.where(upset, 'U', 'N').astype(object)
+    df['upset_type_p1'] = np.where(upset, np.where(p1_won, 'UW', 'UL'), 'N').astype(object)
+    return df
+
+# Function to replace missing average odds with the Bet365 odds
+def fill_missing_odds(df):
+    # if AvgW or AvgL is null, replace with B365 odds
+    df['AvgW'] = df['AvgW'].fillna(df['B365W'])
+    df['AvgL'] = df['AvgL'].fillna(df['B365L'])
+    return df
+
+# Function to get the canonical (alphabetically sorted) player pair for every match,
+# so that a pair is the same regardless of which player won
+def get_canonical_pairs(df):
+    winner = df['Winner'].to_numpy(dtype=object)
+    loser = df['Loser'].to_numpy(dtype=object)
+    swap = winner > loser
+    return np.where(swap, loser, winner), np.where(swap, winner, loser)
+
+def add_pair_columns(df):
+    """
+    Adds the canonical player pair of every match to the DataFrame, as the columns pair_p1 and pair_p2 and an
+    integer pair_code that identifies the pair, so that the pairs only have to be worked out once per dataset.
+
     Parameters:
-    - p1 (str): Player 1
-    - p2 (str): Player 2
-    - match_df (DataFrame): DataFrame containing matches between p1 and p2
-    
+    - df (DataFrame): DataFrame containing the matches
+
     Returns:
-    - upset_result_list (list): List containing the upset types
-    - list(match_df['Date']) (list): List of dates corresponding to the matches between p1 and p2.
-    """
-    
-    # Add two columns to the match_df DataFrame: "upset_type_p1" and "upset_type_p2"
-    # Values in these columns are determined by applying the add_upset_type_column1 and add_upset_type_column2 functions,
-    # respectively, to each row of the DataFrame
-    match_df["upset_type_p1"] = match_df.apply(lambda x: add_upset_type_column1(p1, p2, x), axis=1)
-    match_df["upset_type_p2"] = match_df.apply(lambda x: add_upset_type_column2(p1, p2, x), axis=1)
-
-    upset_result_list = []
-    # Iterate over the values in the "upset_type_p1" column of the DataFrame
-    # If the value is not equal to 'N' (non-upset), append it to upset_result_list
-    for r in match_df["upset_type_p1"]:
-        if r != 'N':
-            upset_result_list.append(r)
-
-    return upset_result_list, list(match_df['Date'])
-
-# Function to check if a match result is an upset or non-upset
-# Returns "U" for upset and "N" for non-upset
-def check_upset_nonupset_results(p1, p2, match_df):
-    if (1/match_df["AvgW"] < 1/match_df["AvgL"] and match_df['Winner'] == p1) or (1/match_df["AvgW"] < 1/match_df["AvgL"] and match_df['Winner'] == p2):
-        return "U" # Upset
+    - df (DataFrame): df with the added columns pair_p1, pair_p2 and pair_code
+    """
+    df['pair_p1'], df['pair_p2'] = get_canonical_pairs(df)
+    df['pair_code'] = df.groupby(['pair_p1', 'pair_p2'], sort=False).ngroup().to_numpy(dtype=np.int64)
+    return df
+
+def get_all_pairs(df):
+    """
+    Groups the matches of every player pair in one groupby pass over the canonical (min, max) player pairs added by
+    add_pair_columns.
+
+    Parameters:
+    - df (DataFrame): DataFrame containing the (filtered) matches
+
+    Returns:
+    - pairs (list): List of (p1, p2, rows) tuples, where rows are the positions in df of the matches between p1 and p2
+    """
+    groups = pd.Series(np.arange(len(df))).groupby(df['pair_code'].to_numpy(), sort=False).indices
+    if len(groups) == 0:
+        return []
+
+    # The players of each pair, taken from the first match of the pair
+    group_rows = list(groups.values())
+    first_rows = np.array([rows[0] for rows in group_rows])
+    return list(zip(df['pair_p1'].to_numpy(dtype=object)[first_rows], df['pair_p2'].to_numpy(dtype=object)[first_rows], group_rows))
+
+def build_pair_index(df, players_1, players_2):
+    """
+    Builds a head-to-head index of the player pairs that have actually played each other, from the pairs grouped by
+    get_all_pairs.
+
+    Pairs are returned in the order in which a scan over every combination of players_1 x players_2 would first
+    reach them, and pairs that such a scan would never reach are dropped, so the output rows are in the same order
+    as the previous all-combinations loop.
+
+    Parameters:
+    - df (DataFrame): DataFrame containing the (filtered) matches
+    - players_1 (array-like): Players that can be the first player of a combination
+    - players_2 (array-like): Players that can be the second player of a combination
+
+    Returns:
+    - pair_index (list): List of (p1, p2, rows) tuples, where rows are the positions in df of the matches between p1 and p2
+    """
+    pairs = get_all_pairs(df)
+    if not pairs:
+        return []
+    first = pd.Index([pair[0] for pair in pairs])
+    second = pd.Index([pair[1] for pair in pairs])
+    return [pairs[k] for k in get_scan_order(first, second, players_1, players_2)]
+
+def get_scan_order(first, second, players_1, players_2):
+    """
+    Orders player pairs by the position in which a scan over every combination of players_1 x players_2 would first
+    reach them, in either orientation, and drops the pairs that such a scan would never reach.
+
+    Parameters:
+    - first (Index): First player of each pair
+    - second (Index): Second player of each pair
+    - players_1 (array-like): Players that can be the first player of a combination
+    - players_2 (array-like): Players that can be the second player of a combination
+
+    Returns:
+    - order (array): Positions of the reached pairs in first and second, in scan order
+    """
+    # Position of each combination (a, b) in the players_1 x players_2 scan, in either orientation
+    players_1 = pd.Index(pd.unique(np.asarray(players_1, dtype=object)))
+    players_2 = pd.Index(pd.unique(np.asarray(players_2, dtype=object)))
+    n = len(players_2)
+    never = np.iinfo(np.int64).max
+
+    def scan_position(a, b):
+        i = players_1.get_indexer(a).astype(np.int64)
+        j = players_2.get_indexer(b).astype(np.int64)
+        return np.where((i >= 0) & (j >= 0), i * n + j, never)
+
+    position = np.minimum(scan_position(first, second), scan_position(second, first))
+    order = np.argsort(position, kind='stable')
+    return order[position[order] != never]
+
+def add_win_probability_columns(df, upset):
+    """
+    Adds the pre-match win probabilities of both players of every match to the DataFrame, computed once for the whole
+    dataset and oriented to the canonical player pair (p1 is the alphabetically first player of the pair).
+
+    Parameters:
+    - df (DataFrame): DataFrame containing the matches, with the columns added by add_pair_columns
+    - upset (str): 'odds' to use the normalized betting odds-implied probabilities, or 'elo' to use the pre-match Elo ratings
+
+    Returns:
+    - df (DataFrame): df with the added columns p1_won, p1_win_prob and p2_win_prob
+    """
+    pair_p1 = df['pair_p1'].to_numpy(dtype=object)
+    p1_won = df['Winner'].to_numpy(dtype=object) == pair_p1
+
+    if upset == 'odds':
+        # Convert the odds into probabilities and normalize them so that they sum to one for each match
+        winner_win_prob = 1 / df['AvgW'].to_numpy(dtype=float)
+        loser_win_prob = 1 / df['AvgL'].to_numpy(dtype=float)
+        total_probability = winner_win_prob + loser_win_prob
+        winner_win_prob_norm = winner_win_prob / total_probability
+        loser_win_prob_norm = loser_win_prob / total_probability
+
+        player1_win_prob = np.where(p1_won, winner_win_prob_norm, loser_win_prob_norm)
+        player2_win_prob = np.where(p1_won, loser_win_prob_norm, winner_win_prob_norm)
+
+    elif upset == 'elo':
+        # Get the pre-match Elo ratings of each player of the pair
+        p1_is_p_i = df['P_i'].to_numpy(dtype=object) == pair_p1
+        elo_i = df['Elo_i_before_match'].to_numpy(dtype=float)
+        elo_j = df['Elo_j_before_match'].to_numpy(dtype=float)
+        player1_elo = np.where(p1_is_p_i, elo_i, elo_j)
+        player2_elo = np.where(p1_is_p_i, elo_j, elo_i)
+
+        # Convert the Elo ratings into win probabilities
+        player1_win_prob = (10 ** (player1_elo/400)) / ((10 ** (player1_elo/400)) + (10 ** (player2_elo/400)))
+        player2_win_prob = (10 ** (player2_elo/400)) / ((10 ** (player1_elo/400)) + (10 ** (player2_elo/400)))
+
+    df['p1_won'] = p1_won
+    df['p1_win_prob'] = player1_win_prob
+    df['p2_win_prob'] = player2_win_prob
+    return df
+
+def get_pair_totals(df, pair_index):
+    """
+    Calculates the expected and actual number of wins of both players of every pair in a single grouped reduction
+    over the per-match columns added by add_win_probability_columns.
+
+    Parameters:
+    - df (DataFrame): DataFrame containing the (filtered) matches, with the win probability columns
+    - pair_index (list): List of (p1, p2, rows) tuples, as returned by build_pair_index
+
+    Returns:
+    - totals (DataFrame): DataFrame with one row per pair, in pair_index order, with the columns matches,
+      expected_wins_p1, expected_wins_p2, actual_wins_p1 and actual_wins_p2
+    """
+    n_pairs = len(pair_index)
+    matches = np.array([len(rows) for _, _, rows in pair_index], dtype=np.int64)
+    rows = np.concatenate([rows for _, _, rows in pair_index]) if n_pairs else np.array([], dtype=np.int64)
+    codes = np.repeat(np.arange(n_pairs), matches)
+
+    # Missing probabilities are skipped when summing, as in a pandas sum
+    p1_won = df['p1_won'].to_numpy(dtype=bool)[rows]
+    player1_win_prob = np.nan_to_num(df['p1_win_prob'].to_numpy(dtype=float)[rows])
+    player2_win_prob = np.nan_to_num(df['p2_win_prob'].to_numpy(dtype=float)[rows])
+
+    actual_wins_p1 = np.bincount(codes, weights=p1_won, minlength=n_pairs).astype(np.int64)
+    return pd.DataFrame({
+        'matches': matches,
+        # Calculate the expected number of matches won by each player based on the sum of the implied probabilities
+        'expected_wins_p1': np.bincount(codes, weights=player1_win_prob, minlength=n_pairs),
+        'expected_wins_p2': np.bincount(codes, weights=player2_win_prob, minlength=n_pairs),
+        'actual_wins_p1': actual_wins_p1,
+        'actual_wins_p2': matches - actual_wins_p1,
+    })
+
+# Columns added to the result columns in the metrics file
+METRICS_COLUMNS = ['upset_results_set', 'total_matches', 'upset_matches', 'upset_wins', 'upset_losses', 'upset_percentage', 'upset_win_percentage', 'upset_loss_percentage']
+
+# Columns of the result file, followed by METRICS_COLUMNS in the metrics file
+RESULT_COLUMNS = ['player1', 'player2', 'match_results', 'results_set', 'upset_results', 'results_set_with_dates', 'upset_results_set_with_dates', 'or', 'p_value_fisher', 'expected_wins_p1', 'expected_wins_p2', 'actual_wins_p1', 'actual_wins_p2', 'p_value_fisher_adj']
+
+# Columns added to the result columns by the --test poisson-binomial option
+POISSON_BINOMIAL_COLUMNS = ['p_value_poisson_binomial', 'p_value_poisson_binomial_adj']
+
+# Adjusted p-value below which a pair is counted as significant in the progress reports
+SIGNIFICANCE_LEVEL = 0.05
+
+# Version of the result and metrics files and of the run state, recorded in the run state so that files written by an
+# older version are recomputed in full rather than updated incrementally
+RESULT_FORMAT = 4
+
+# Read-only data shared with the worker processes that score the player pairs. It is set before the pool is
+# created, so forked workers inherit it instead of having the DataFrame pickled to them
+_shared = {}
+
+def _init_worker(shared):
+    # Only used when worker processes cannot be forked. Each worker memory-maps the match store and takes the
+    # filtered matches from it, so the DataFrame does not have to be pickled to the workers
+    shared = dict(shared)
+    match_rows = shared.pop('match_rows')
+    df = fill_missing_odds(load_match_store(shared.pop('dataset')).to_frame().iloc[match_rows])
+    _shared.update(shared, df=df, dates=df['Date'].to_numpy(dtype=object))
+
+def get_shared(df, pair_index, totals, oddsratios, p_vals_fisher, p_vals_fisher_adj, p_vals_pb=None, p_vals_pb_adj=None):
+    # Builds the data used by score_pair, with the columns it slices for every pair converted to arrays once
+    return dict(df=df, pair_index=pair_index, totals=totals, p1_won=df['p1_won'].to_numpy(dtype=bool),
+                oddsratios=oddsratios, p_vals_fisher=p_vals_fisher, p_vals_fisher_adj=p_vals_fisher_adj,
+                p_vals_pb=p_vals_pb, p_vals_pb_adj=p_vals_pb_adj,
+                is_upset=df['upset'].to_numpy(dtype=bool), result_types=df['result_type'].to_numpy(dtype=object),
+                upset_types_p1=df['upset_type_p1'].to_numpy(dtype=object), dates=df['Date'].to_numpy(dtype=object))
+
+def set_shared(df, pair_index, totals, oddsratios, p_vals_fisher, p_vals_fisher_adj, p_vals_pb=None, p_vals_pb_adj=None):
+    # Sets the data used by score_pair in this process and in the worker processes
+    _shared.update(get_shared(df, pair_index, totals, oddsratios, p_vals_fisher, p_vals_fisher_adj, p_vals_pb, p_vals_pb_adj))
+
+def score_pair(i, shared=None):
+    """
+    Builds the output row of the i-th player pair of the pair index.
+
+    Parameters:
+    - i (int): Position of the pair in the pair index
+    - shared (dict): Data of the pairs, as returned by get_shared (default = the data set by set_shared)
+
+    Returns:
+    - data (list): Output row for the pair
+    - metrics (list): Upset metrics of the pair, added to the output row in the metrics file
+    """
+    if shared is None:
+        shared = _shared
+    p1, p2, rows = shared['pair_index'][i]
+    totals = shared['totals']
+
+    # Get the upset/non-upset results and dates of all historical matches between player 1 and player 2,
+    # as slices of the columns classified for the whole dataset by add_upset_columns
+    historical_results = shared['result_types'][rows].tolist()
+    historical_results_dates = shared['dates'][rows].tolist()
+
+    # Considering only the upset results, get the set of upset types — upset wins and upset losses — between the two players
+    upset_types = shared['upset_types_p1'][rows]
+    upset_results = upset_types[shared['is_upset'][rows]].tolist()
+    upset_results_dates = historical_results_dates
+
+    match_results_list = ['p1' if won else 'p2' for won in shared['p1_won'][rows]]
+
+    # Get the number of wins for each player, and the expected number of wins based on the implied probabilities
+    player1_wins = int(totals['actual_wins_p1'].iat[i])
+    player2_wins = int(totals['actual_wins_p2'].iat[i])
+    expected_matches_won_p1 = totals['expected_wins_p1'].iat[i]
+    expected_matches_won_p2 = totals['expected_wins_p2'].iat[i]
+
+    oddsratio, p_val_fisher = shared['oddsratios'][i], shared['p_vals_fisher'][i]
+    p_val_fisher_adj = shared['p_vals_fisher_adj'][i]
+
+    data = [str(p1), str(p2), match_results_list, historical_results, upset_results, historical_results_dates, upset_results_dates, oddsratio, p_val_fisher, expected_matches_won_p1, expected_matches_won_p2, player1_wins, player2_wins, p_val_fisher_adj]
+    if shared['p_vals_pb'] is not None:
+        data += [shared['p_vals_pb'][i], shared['p_vals_pb_adj'][i]]
+    return data, get_upset_metrics(historical_results, upset_results)
+
+# Function to calculate the upset metrics of a pair from its results and upset results
+def get_upset_metrics(historical_results, upset_results):
+    total_matches = len(historical_results)
+    upset_matches = historical_results.count('U')
+
+    # Calculate the number of upset wins and losses
+    upset_wins = upset_results.count('UW')
+    upset_losses = upset_results.count('UL')
+
+    # Calculate the upset percentage, upset win percentage, and upset loss percentage (left empty when undefined)
+    def percentage(count, total):
+        return (count / total) * 100 if total > 0 else ''
+
+    return [upset_results, total_matches, upset_matches, upset_wins, upset_losses,
+            percentage(upset_matches, total_matches), percentage(upset_wins, upset_matches), percentage(upset_losses, upset_matches)]
+
+def score_shard(shard):
+    return [score_pair(i) for i in shard]
+
+def split_into_shards(pair_index, positions, n_shards):
+    """
+    Splits the pairs to score into contiguous shards with roughly equal numbers of matches, so that writing the shards
+    in order gives the same rows in the same order as scoring the pairs one by one.
+
+    Parameters:
+    - pair_index (list): List of (p1, p2, rows) tuples, as returned by build_pair_index
+    - positions (list): Positions in the pair index of the pairs to score, in order
+    - n_shards (int): Number of shards
+
+    Returns:
+    - shards (list): List of lists of positions in the pair index
+    """
+    cumulative_matches = np.cumsum([len(pair_index[i][2]) for i in positions])
+    if len(cumulative_matches) == 0:
+        return []
+    targets = cumulative_matches[-1] * np.arange(1, n_shards) / n_shards
+    bounds = [0] + list(np.searchsorted(cumulative_matches, targets, side='right')) + [len(positions)]
+    return [list(positions[start:end]) for start, end in zip(bounds[:-1], bounds[1:]) if end > start]
+
+def score_pairs(positions, workers, dataset):
+    """
+    Scores the given player pairs, either one by one or in a pool of worker processes, and yields the output rows
+    in the order of positions.
+
+    Parameters:
+    - positions (list): Positions in the pair index of the pairs to score, in order
+    - workers (int): Number of worker processes (1 = score the pairs in this process)
+    - dataset (str): Dataset of the matches, used by workers that cannot be forked to map the match store
+
+    Returns:
+    - rows (generator): Output row of each pair
+    """
+    if workers > 1:
+        # Score the pairs in a pool of worker processes, in shards that are written in order as they complete
+        if 'fork' in multiprocessing.get_all_start_methods():
+            context, initializer, initargs = multiprocessing.get_context('fork'), None, ()
+        else:
+            shared = {k: v for k, v in _shared.items() if k not in ['df', 'dates']}
+            shared.update(dataset=dataset, match_rows=_shared['df'].index.to_numpy())
+            context, initializer, initargs = multiprocessing.get_context(), _init_worker, (shared,)
+        shards = split_into_shards(_shared['pair_index'], positions, workers * 4)
+        with context.Pool(workers, initializer=initializer, initargs=initargs) as pool:
+            for shard_rows in pool.imap(score_shard, shards):
+                yield from shard_rows
     else:
-        return "N" # Non-upset
-
-# Function to get the historical results list (upset or non-upset) and the corresponding dates
-def get_historical_results_list(p1, p2, match_df):
-    # Add a column to the DataFrame with the upset/non-upset results using check_upset_nonupset_results function
-    match_df["hr_check"] = match_df.apply(lambda x: check_upset_nonupset_results(p1, p2, x), axis=1) 
-    
-    results_list = list(match_df['hr_check'])
-    dates_list = list(match_df['Date'])
-    time_diff_list = []
-
-    for i in range(1, len(dates_list)):
-        if args.dataset == 'atp':
-            date1 = datetime.strptime(dates_list[i-1], '%Y-%m-%d')
-            date2 = datetime.strptime(dates_list[i], '%Y-%m-%d')
-        elif args.dataset == 'wta':
-            date1 = datetime.strptime(dates_list[i-1], '%d/%m/%Y')
-            date2 = datetime.strptime(dates_list[i], '%d/%m/%Y')
-        time_diff = (date2 - date1).days
-        time_diff_list.append(time_diff)
-
-    return results_list, dates_list, time_diff_list
-
-# Function to create a list of tuples from two input lists
-def list_of_tuples(l1, l2):
-    return list(map(lambda x, y:(x,y), l1, l2))
-
-def unique(list1):
-    x = np.array(list1)
-    return list(np.unique(x))
-
-# Function to determine wins and losses for a player
-def get_wins_losses(player, matches_df):
-    player_matches = matches_df[(matches_df['Winner'] == player) | (matches_df['Loser'] == player)]
-    wins = len(player_matches[player_matches['Winner'] == player]['Winner'])
-    losses = len(player_matches[player_matches['Loser'] == player]['Loser'])
-    return wins, losses
-
-def main():
-    if args.dataset == 'test':
-        df = pd.read_csv('Data_Clean_Test.csv', low_memory=False)
-    elif args.dataset == 'wta':
-        df = pd.read_csv('Data_Clean_WTA.csv', low_memory=False)
-    elif args.dataset == 'atp':
-        df = pd.read_csv('Data_Clean_ATP_Elo_WElo.csv', low_memory=False)
+        for i in positions:
+            yield score_pair(i)
+
+def read_result_rows(filename):
+    # Reads the rows of a result or metrics file, keyed by player pair
+    with open(filename, encoding='UTF8', newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        return header, {(row[0], row[1]): row for row in reader}
+
+def get_run_settings(args):
+    # Options that determine which matches and pairs are in a result file
+    return {k: getattr(args, k) for k in ['dataset', 'upset', 'grand_slam', 'tournament', 's_date', 'e_date', 'player_1', 'player_2', 'p_adj_method', 'test']}
+
+def get_state_filename(file_prefix):
+    return file_prefix + '_state.npz'
+
+def read_run_state(args, file_prefix):
+    """
+    Reads the state of the previous --incremental run with the same output files, and checks that it can be updated.
+
+    Parameters:
+    - args (Namespace): Options of the run
+    - file_prefix (str): Output filename without the .csv extension
+
+    Returns:
+    - state (dict): The arrays of the run state, as written by write_run_state, and its n_matches and match_hashes,
+      or None if the output must be computed in full
+    """
+    filename = file_prefix + '.csv'
+    state_filename = get_state_filename(file_prefix)
+    if not all(os.path.exists(name) for name in [state_filename, filename, file_prefix + '_metrics.csv', get_result_lists_path(filename)]):
+        print('No previous run found, computing the results for all player pairs')
+        return None
+
+    with np.load(state_filename) as arrays:
+        state = {name: arrays[name] for name in arrays.files}
+    run = json.loads(str(state.pop('run')))
+    if run['format'] != RESULT_FORMAT:
+        print('The previous run wrote an older version of the output files, computing the results for all player pairs')
+        return None
+    if run['settings'] != get_run_settings(args):
+        print('The previous run used different options, computing the results for all player pairs')
+        return None
+    state.update(n_matches=run['n_matches'], match_hashes=run['match_hashes'])
+    return state
+
+def write_run_state(args, file_prefix, n_matches, match_hashes, state):
+    """
+    Writes the state of an --incremental run, from which the next --incremental run with the same options folds in the
+    matches added to the match data file.
+
+    Parameters:
+    - args (Namespace): Options of the run
+    - file_prefix (str): Output filename without the .csv extension
+    - n_matches (int): Number of matches of the dataset
+    - match_hashes (list): List of [start, end, digest] hashes of the matches of the dataset, as given by hash_rows
+      of the match store, one for the matches added by each run
+    - state (dict): Arrays of the state of the player pairs, as returned by get_pair_state
+    """
+    run = {'settings': get_run_settings(args), 'format': RESULT_FORMAT, 'n_matches': n_matches, 'match_hashes': match_hashes}
+    # Write to a temporary file first, so that an interrupted run never leaves a partial state behind
+    state_filename = get_state_filename(file_prefix)
+    tmp_filename = state_filename + '.tmp.npz'
+    np.savez(tmp_filename, run=json.dumps(run), **state)
+    os.replace(tmp_filename, state_filename)
+
+def get_pair_state(df, pairs, totals, in_output, oddsratios, p_vals_fisher, p_vals_pb, players_1, players_2):
+    """
+    Builds the state of the player pairs of a run: the positions in the match store of the matches of each pair
+    (in compressed sparse row form, as in the player index), their totals, and the test results of the pairs in the
+    output files.
+
+    Parameters:
+    - df (DataFrame): DataFrame containing the matches of the pairs, indexed by their positions in the match store
+    - pairs (list): List of (p1, p2, rows) tuples of every pair of the matches of the run, where rows are positions in df
+    - totals (DataFrame): Totals of each pair, as returned by get_pair_totals
+    - in_output (array): Whether each pair is in the output files
+    - oddsratios (array): Odds ratio of each pair (nan for the pairs that are not in the output files)
+    - p_vals_fisher (array): Fisher's exact test p-value of each pair (nan for the pairs that are not in the output files)
+    - p_vals_pb (array): Poisson-binomial test p-value of each pair, or None if the run does not use the test
+    - players_1 (array-like): Players that can be the first player of a pair
+    - players_2 (array-like): Players that can be the second player of a pair
+
+    Returns:
+    - state (dict): Arrays of the state
+    """
+    positions = df.index.to_numpy()
+    offsets = np.zeros(len(pairs) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(rows) for _, _, rows in pairs])
+    state = {
+        'player1': np.array([str(pair[0]) for pair in pairs], dtype=str),
+        'player2': np.array([str(pair[1]) for pair in pairs], dtype=str),
+        'offsets': offsets,
+        'rows': np.concatenate([positions[rows] for _, _, rows in pairs]).astype(np.int64) if pairs else np.array([], dtype=np.int64),
+        'matches': totals['matches'].to_numpy(dtype=np.int64),
+        'expected_wins_p1': totals['expected_wins_p1'].to_numpy(dtype=float),
+        'expected_wins_p2': totals['expected_wins_p2'].to_numpy(dtype=float),
+        'actual_wins_p1': totals['actual_wins_p1'].to_numpy(dtype=np.int64),
+        'in_output': np.asarray(in_output, dtype=bool),
+        'oddsratio': np.asarray(oddsratios, dtype=float),
+        'p_value_fisher': np.asarray(p_vals_fisher, dtype=float),
+        'players_1': np.array([str(player) for player in players_1], dtype=str),
+        'players_2': np.array([str(player) for player in players_2], dtype=str),
+    }
+    if p_vals_pb is not None:
+        state['p_value_poisson_binomial'] = np.asarray(p_vals_pb, dtype=float)
+    return state
+
+def add_pair_rows(offsets, rows, pairs, new_rows, n_pairs):
+    """
+    Adds matches to the positions of the matches of the player pairs of a run state.
+
+    Parameters:
+    - offsets (array): Offsets of the matches of each pair in rows
+    - rows (array): Positions of the matches of each pair, one pair after the other
+    - pairs (array): Position in the state of the pair of each added match
+    - new_rows (array): Position of each added match, after the positions of the matches in rows
+    - n_pairs (int): Number of pairs, including the pairs that are new to the state
+
+    Returns:
+    - offsets (array): Offsets of the matches of each pair in rows
+    - rows (array): Positions of the matches of each pair, with the added matches after the previous ones
+    """
+    old_pairs = np.repeat(np.arange(len(offsets) - 1, dtype=np.int64), np.diff(offsets))
+    all_pairs = np.concatenate([old_pairs, np.asarray(pairs, dtype=np.int64)])
+    new_offsets = np.zeros(n_pairs + 1, dtype=np.int64)
+    new_offsets[1:] = np.cumsum(np.bincount(all_pairs, minlength=n_pairs))
+    return new_offsets, np.concatenate([rows, new_rows]).astype(np.int64)[np.argsort(all_pairs, kind='stable')]
+
+def start_journal(args, journal_filename, offsets):
+    # Starts the journal of completed pairs of a checkpointed run, recording the options and the end of the headers
+    # of the result and metrics files
+    journal = open(journal_filename, 'w', encoding='UTF8')
+    journal.write(json.dumps({'settings': get_run_settings(args), 'offsets': list(offsets)}) + '\n')
+    journal.flush()
+    return journal
+
+def read_journal(args, journal_filename):
+    """
+    Reads the journal of completed pairs of an interrupted checkpointed run.
+
+    Parameters:
+    - args (Namespace): Options of the run
+    - journal_filename (str): Path of the journal file
+
+    Returns:
+    - completed (set): Player pairs (p1, p2) whose rows were written to the result and metrics files
+    - offsets (list): Positions in the result and metrics files just after the rows of the last completed pair
+    """
+    with open(journal_filename, encoding='UTF8') as journal:
+        state = json.loads(journal.readline())
+        if state['settings'] != get_run_settings(args):
+            raise ValueError('The run in ' + journal_filename + ' used different options: ' + str(state['settings']))
+        completed = set()
+        offsets = state['offsets']
+        for line in journal:
+            # Ignore a partially written last line
+            if not line.endswith('\n'):
+                break
+            p1, p2, *pair_offsets = line.rstrip('\n').split('\t')
+            completed.add((p1, p2))
+            offsets = [int(offset) for offset in pair_offsets]
+    return completed, offsets
+
+def prepare_matches(all_matches, upset):
+    """
+    Adds the columns that do not depend on the filters of a run to a copy of the matches of a dataset: the odds with
+    missing values filled in, the canonical player pairs, the win probabilities and the upset classification. These can be shared by all the
+    runs on the dataset with the same upset type.
+
+    Parameters:
+    - all_matches (DataFrame): DataFrame containing all the matches of the dataset, as loaded from the match store
+    - upset (str): 'odds' or 'elo'
+
+    Returns:
+    - matches (DataFrame): Copy of all_matches with the added columns
+    """
+    matches = fill_missing_odds(all_matches.copy())
+    matches = add_pair_columns(matches)
+    matches = add_win_probability_columns(matches, upset)
+    return add_upset_columns(matches)
+
+def filter_matches(matches, args):
+    # Restrict the matches to the tournament, grand slam and date options of a run
+    df = matches
 
     if args.tournament != 'all':
         df = df[(df["Tournament"] == args.tournament)]
@@ -148,171 +586,506 @@ def main():
     elif args.grand_slam == 1:
         df = df[(df["Series"] == "Grand Slam")]
 
-    if args.s_date == 'min':
-        start_date = min(df["Date"])
-    elif args.s_date != 'min':
-        start_date = args.s_date
+    # Restrict the dataframe to be between start date and end date, compared as day numbers
+    if args.s_date != 'min':
+        df = df[(df["Day"] >= date_to_day(args.s_date))]
+    if args.e_date != 'max':
+        df = df[(df["Day"] <= date_to_day(args.e_date))]
+    return df
 
-    if args.e_date == 'max':
-        end_date = max(df["Date"])
-    elif args.e_date != 'max':
-        end_date = args.e_date
-    
-    # Restrict the dataframe to be between start date and end date
-    df = df[((df["Date"] >= start_date) & (df["Date"] <= end_date))]
+def get_player_rows(matches, player, opponent=None):
+    """
+    Looks up the matches of a player, or of a pair of players, with one comparison of the integer player codes of the
+    P_i and P_j columns, for the runs that look up a single player and so do not build a PlayerIndex.
 
-    # if AvgW or AvgL is null, replace with B365 odds
-    df['AvgW'] = df['AvgW'].fillna(df['B365W'])
-    df['AvgL'] = df['AvgL'].fillna(df['B365L'])
+    Parameters:
+    - matches (DataFrame): DataFrame containing the matches, with the P_i and P_j categoricals of the match store
+    - player (str): Player name
+    - opponent (str): Name of the other player of the pair (default = None, the matches against every opponent)
+
+    Returns:
+    - rows (array): Positions in matches of the matches, in ascending order
+    """
+    # P_i and P_j share the players of the match store as their categories
+    players = matches['P_i'].cat.categories
+    p_i = matches['P_i'].cat.codes.to_numpy()
+    p_j = matches['P_j'].cat.codes.to_numpy()
+    code = players.get_loc(player) if player in players else -2
+    is_match = (p_i == code) | (p_j == code)
+    if opponent is not None:
+        opponent_code = players.get_loc(opponent) if opponent in players else -2
+        is_match &= (p_i == opponent_code) | (p_j == opponent_code)
+    return np.flatnonzero(is_match)
+
+def get_player_matches(matches, args, player_index=None):
+    """
+    Looks up the matches of the player (or pair of players) given by the -p1 and -p2 options of a run, and restricts
+    them to the filters of the run.
+
+    Parameters:
+    - matches (DataFrame): DataFrame containing all the matches of the dataset, as indexed by player_index
+    - args (Namespace): Options of the run, with at least one of player_1 and player_2 given
+    - player_index (PlayerIndex): Adjacency index of the matches (default = None, the matches are looked up with
+      get_player_rows)
+
+    Returns:
+    - df (DataFrame): Filtered matches of the player, in the same order as in matches
+    """
+    if args.player_1 != 'all':
+        player, opponent = args.player_1, None if args.player_2 == 'all' else args.player_2
+    else:
+        player, opponent = args.player_2, None
+    rows = player_index.get_rows(player, opponent) if player_index is not None else get_player_rows(matches, player, opponent)
+    return filter_matches(matches.iloc[rows], args)
+
+def get_opponent_order(matches, args, df, player, column, player_index=None):
+    """
+    Orders the opponents of a player by their first appearance in the P_i or P_j column of the filtered matches. A scan
+    over players_1 x players_2 with the player on one side reaches the pairs of the player in the order of their
+    opponents in the unique players of the other side, so this order gives the same output rows, while only the
+    matches of the opponents are filtered instead of the whole table.
+
+    Parameters:
+    - matches (DataFrame): DataFrame containing all the matches of the dataset, as indexed by player_index
+    - args (Namespace): Options of the run
+    - df (DataFrame): Filtered matches of the player, as returned by get_player_matches
+    - player (str): Player name
+    - column (str): P_i or P_j, the column of the players of the other side of the scan
+    - player_index (PlayerIndex): Adjacency index of the matches (default = None, the matches of the opponents are
+      found with one comparison of the integer player codes of the column)
+
+    Returns:
+    - opponents (array): The opponents of the player that appear in the column of the filtered matches, in order of
+      first appearance
+    """
+    opponents = pd.unique(np.concatenate([df['P_i'].to_numpy(dtype=object), df['P_j'].to_numpy(dtype=object)]))
+    opponents = opponents[opponents != player]
+    if len(opponents) == 0:
+        return opponents
+    if player_index is not None:
+        rows = np.unique(np.concatenate([player_index.get_rows(opponent) for opponent in opponents]))
+    else:
+        rows = np.flatnonzero(np.isin(matches[column].cat.codes.to_numpy(), matches[column].cat.categories.get_indexer(opponents)))
+
+    # Only the columns used by the filters and the players of the column are taken from the matches of the opponents
+    candidates = filter_matches(matches.iloc[rows, matches.columns.get_indexer(['Tournament', 'Series', 'Day', column])], args)
+    values = candidates[column].to_numpy(dtype=object)
+    return pd.unique(values[pd.Index(opponents).get_indexer(values) >= 0])
+
+def get_run_matches(matches, args, player_index=None):
+    """
+    Selects the filtered matches of a run, and the players of both sides of the scan over players_1 x players_2 that
+    orders its output rows. When a player is given, only the matches of the player and of their opponents are
+    filtered.
+
+    Parameters:
+    - matches (DataFrame): DataFrame containing all the matches of the dataset, as indexed by player_index
+    - args (Namespace): Options of the run
+    - player_index (PlayerIndex): Adjacency index of the matches (default = None, no index)
 
+    Returns:
+    - df (DataFrame): Filtered matches of the run, in the same order as in matches
+    - players_1 (array-like): Players that can be the first player of a pair
+    - players_2 (array-like): Players that can be the second player of a pair
+    """
     if args.player_1 == 'all' and args.player_2 == 'all':
-        mesh = np.array(np.meshgrid(df["P_i"].unique(), df["P_j"].unique()))
-        combinations = mesh.T.reshape(-1, 2)
-    elif args.player_1 != 'all' and args.player_2 == 'all':
-        mesh = np.array(np.meshgrid(np.array(args.player_1), df["P_j"].unique()))
-        combinations = mesh.T.reshape(-1, 2)
-    elif args.player_1 == 'all' and args.player_2 != 'all':
-        mesh = np.array(np.meshgrid(df["P_i"].unique(), np.array(args.player_2)))
-        combinations = mesh.T.reshape(-1, 2)
-    elif args.player_1 != 'all' and args.player_2 != 'all':
-        mesh = np.array(np.meshgrid(np.array(args.player_1), np.array(args.player_2)))
-        combinations = mesh.T.reshape(-1, 2)
+        df = filter_matches(matches, args)
+        return df, df['P_i'].unique(), df['P_j'].unique()
+
+    df = get_player_matches(matches, args, player_index)
+    players_1 = [args.player_1] if args.player_1 != 'all' else get_opponent_order(matches, args, df, args.player_2, 'P_i', player_index)
+    players_2 = [args.player_2] if args.player_2 != 'all' else get_opponent_order(matches, args, df, args.player_1, 'P_j', player_index)
+    return df, players_1, players_2
 
+def get_output_filename(args):
     # Construct the filename
     filename = 'bogey_results_output' + '_' + args.dataset + '_' + args.upset
     if args.grand_slam == 0:
         filename += '_nongrandslam'
     elif args.grand_slam == 1:
         filename += '_grandslam'
+    # Runs restricted to a tournament or date range get their own files
+    if args.tournament != 'all':
+        filename += '_' + args.tournament.lower().replace(' ', '_')
+    if args.s_date != 'min' or args.e_date != 'max':
+        filename += '_' + args.s_date + '_' + args.e_date
     filename += '.csv'
-    header = ['player1', 'player2', 'match_results', 'results_set', 'upset_results', 'results_set_with_dates', 'upset_results_set_with_dates', 'or', 'p_value_fisher', 'expected_wins_p1', 'expected_wins_p2', 'actual_wins_p1', 'actual_wins_p2']
-    with open(filename, 'w', encoding='UTF8', newline='') as f:
+    return filename
+
+def run_pair_tests(args, df, pair_index, totals, profiler):
+    """
+    Runs the tests of the player pairs of the pair index, from their totals and, for the Poisson-binomial test, the
+    win probabilities of their matches.
+
+    Parameters:
+    - args (Namespace): Options of the run
+    - df (DataFrame): DataFrame containing the matches of the pairs, with the win probability columns
+    - pair_index (list): List of (p1, p2, rows) tuples, as returned by build_pair_index
+    - totals (DataFrame): Totals of each pair, as returned by get_pair_totals
+    - profiler (Profiler): Profiler of the run
+
+    Returns:
+    - oddsratios (array): Odds ratio of each pair
+    - p_vals_fisher (array): Fisher's exact test p-value of each pair
+    - p_vals_pb (array): Poisson-binomial test p-value of each pair, or None if the run does not use the test
+    """
+    # ---------- Conduct Fisher's exact test ----------
+    # Create the contingency table of expected and actual wins for every pair, and test them all at once
+    with profiler.stage('fisher_exact'):
+        observed = np.stack([totals[['expected_wins_p1', 'actual_wins_p1']].to_numpy(dtype=float),
+                             totals[['expected_wins_p2', 'actual_wins_p2']].to_numpy(dtype=float)], axis=1)
+        oddsratios, p_vals_fisher = fisher_exact_batch(observed)
+
+    # ---------- Conduct the exact Poisson-binomial test ----------
+    # The actual wins of player 1 are tested against their distribution over the win probabilities of the matches
+    p_vals_pb = None
+    if args.test == 'poisson-binomial':
+        with profiler.stage('poisson_binomial'):
+            pair_rows = np.concatenate([rows for _, _, rows in pair_index]) if pair_index else np.array([], dtype=np.int64)
+            p_vals_pb = poisson_binomial_test_batch(np.nan_to_num(df['p1_win_prob'].to_numpy(dtype=float)[pair_rows]),
+                                                    totals['matches'].to_numpy(), totals['actual_wins_p1'].to_numpy())
+    return oddsratios, p_vals_fisher, p_vals_pb
+
+def write_results(args, filename, header, pairs, rescored, scored_rows, previous, adjusted, p_vals_significance, completed, profiler):
+    """
+    Writes the result and metrics files of a run in the same pass, one player pair at a time, with the metrics
+    calculated while scoring each pair.
+
+    Parameters:
+    - args (Namespace): Options of the run
+    - filename (str): Path of the result file
+    - header (list): Columns of the result file
+    - pairs (list): List of (p1, p2, n_matches) tuples of the pairs of the output files, in order
+    - rescored (set): Positions in pairs of the pairs that are scored, whose rows are taken from scored_rows in order
+    - scored_rows (generator): Output row and metrics of each rescored pair, as yielded by score_pairs
+    - previous (tuple): Rows of the result and metrics files of the previous run keyed by player pair, copied for the
+      pairs that are not rescored, or None
+    - adjusted (dict): Adjusted p-value of each pair, in the order of pairs, for each adjusted p-value column
+    - p_vals_significance (array): Adjusted p-value of each pair used to count the significant pairs in the progress reports
+    - completed (set): Player pairs (p1, p2) already written by the interrupted run that is resumed
+    - profiler (Profiler): Profiler of the run
+
+    Returns:
+    - journal (file): Journal of the completed pairs, to be removed once the run is complete, or None
+    """
+    file_prefix = os.path.splitext(filename)[0]
+    journal_filename = file_prefix + '_journal.txt'
+    metrics_filename = file_prefix + '_metrics.csv'
+    mode = 'a' if completed else 'w'
+    with open(filename, mode, encoding='UTF8', newline='') as f, open(metrics_filename, mode, encoding='UTF8', newline='') as metrics_f:
         writer = csv.writer(f)
-        writer.writerow(header)
-        
-        # Create an empty set to store existing player pairs
-        existing_pairs = set() 
-        
-        for i in range(len(combinations)):
-            print(str(i + 1) + ' of ' + str(len(combinations)) + ' iterations (' + str(round((i/len(combinations))*100,1)) + '% complete)')
-            
-            p1 = pd.DataFrame(combinations).iloc[i][0]
-            p2 = pd.DataFrame(combinations).iloc[i][1]
-            
-            # Sort the players to ensure we are checking the same player pair, regardless of order
-            p1, p2 = (p1, p2) if p1 < p2 else (p2, p1) 
-            player_pair = (p1, p2) 
-            
-            # Check if the player pair already exists in the set
-            if player_pair in existing_pairs:
-                continue  # if it does, skip to the next iteration
-            else:
-                existing_pairs.add(player_pair)  # if it does not, add it to the set
-            
-            # Get all historical matches between player 1 and player 2
-            match_df = df[((df["Winner"] == p1) & (df["Loser"] == p2)) | ((df["Winner"] == p2) & (df["Loser"] == p1))]
-
-            # If there have been no historical matches between player 1 and player 2, continue
-            if len(match_df) == 0:
-                continue
-
-            historical_results, historical_results_dates, time_diffs = get_historical_results_list(p1, p2, match_df)
-
-            # Considering only the upset results, get the set of upset types — upset wins and upset losses — between the two players
-            upset_results = get_upset_result_list(p1, p2, match_df)[0]
-            upset_results_dates = get_upset_result_list(p1, p2, match_df)[1]
-
-            # ---------- Conduct the chi-squared test ----------
-            from scipy.stats import fisher_exact
-
-            
-            # Get the number of wins and losses for each player
-            player1_wins, player2_wins = get_wins_losses(p1, match_df)
-            
-            match_results_list = get_winner(p1, p2, match_df)
-
-            if args.upset == 'odds':
-                # Get the odds for each player in the matches between the pair of players
-                player1_odds = pd.concat([match_df.loc[((match_df['Winner'] == p1) & (match_df['Loser'] == p2)), 'AvgW'], match_df.loc[((match_df['Winner'] == p2) & (match_df['Loser'] == p1)), 'AvgL']])
-                player2_odds = pd.concat([match_df.loc[((match_df['Winner'] == p2) & (match_df['Loser'] == p1)), 'AvgW'], match_df.loc[((match_df['Winner'] == p1) & (match_df['Loser'] == p2)), 'AvgL']])
-
-                # Convert the odds into probabilities
-                player1_win_prob = 1 / player1_odds
-                player2_win_prob = 1 / player2_odds
-
-                # Calculate the normalization factor
-                total_probability = player1_win_prob + player2_win_prob
-
-                # Normalize the probabilities
-                player1_win_prob_norm = player1_win_prob / total_probability
-                player2_win_prob_norm = player2_win_prob / total_probability
-
-                # Calculate the expected number of matches won based on the sum of the betting odds-implied probabilities
-                # represents the expected numbers of matches the player should win given the betting odds distribution.
-                expected_matches_won_p1 = np.sum(player1_win_prob_norm)
-                expected_matches_won_p2 = np.sum(player2_win_prob_norm)
-                
-            elif args.upset == 'elo':
-                # Get the pre-match Elo ratings for each player in the matchup
-                player1_elo = pd.concat([match_df.loc[((match_df['P_i'] == p1) & (match_df['P_j'] == p2)), 'Elo_i_before_match'], match_df.loc[((match_df['P_i'] == p2) & (match_df['P_j'] == p1)), 'Elo_j_before_match']])
-                player2_elo = pd.concat([match_df.loc[((match_df['P_i'] == p2) & (match_df['P_j'] == p1)), 'Elo_i_before_match'], match_df.loc[((match_df['P_i'] == p1) & (match_df['P_j'] == p2)), 'Elo_j_before_match']])
-
-                # Convert the Elo ratings into win probabilities
-                player1_win_prob = (10 ** (player1_elo/400)) / ((10 ** (player1_elo/400)) + (10 ** (player2_elo/400)))
-                player2_win_prob = (10 ** (player2_elo/400)) / ((10 ** (player1_elo/400)) + (10 ** (player2_elo/400)))
-
-                # Calculate the expected number of matches won based on the player rankings
-                expected_matches_won_p1 = np.sum(player1_win_prob)
-                expected_matches_won_p2 = np.sum(player2_win_prob)
-
-            # Create the contingency table
-            observed = np.array([[expected_matches_won_p1, player1_wins],
-                                    [expected_matches_won_p2, player2_wins]])
-
-            # Perform Fisher's exact test on the contingency table
-            oddsratio, p_val_fisher = fisher_exact(observed)
-
-            data = [str(p1), str(p2), match_results_list, historical_results, upset_results, historical_results_dates, upset_results_dates, oddsratio, p_val_fisher, expected_matches_won_p1, expected_matches_won_p2, player1_wins, player2_wins]
-
-            writer.writerow(data)
+        # The metrics file ends lines with \n, as when it was written by pandas
+        metrics_writer = csv.writer(metrics_f, lineterminator='\n')
+        journal = None
+        if completed:
+            journal = open(journal_filename, 'a', encoding='UTF8')
+        else:
+            writer.writerow(header)
+            metrics_writer.writerow(header + METRICS_COLUMNS)
             f.flush()
+            metrics_f.flush()
+            if args.checkpoint or args.resume:
+                journal = start_journal(args, journal_filename, (f.tell(), metrics_f.tell()))
+
+        # Report the progress at a fixed interval rather than for every pair
+        progress = Progress(len(pairs), int(sum(n_matches for _, _, n_matches in pairs)), args.progress, args.progress_interval, filename)
+        adjusted_columns = [(header.index(column), values) for column, values in adjusted.items()]
+        with profiler.hot_loop(file_prefix + '_hot_loop.prof' if args.profile_hot_loop else None):
+            for i, (p1, p2, n_matches) in enumerate(pairs):
+                if (str(p1), str(p2)) in completed:
+                    progress.update(n_matches, scored=False, significant=p_vals_significance[i] < SIGNIFICANCE_LEVEL)
+                    continue
+                if i in rescored:
+                    with profiler.stage('score_pair'):
+                        data, metrics = next(scored_rows)
+                    metrics_data = data + metrics
+                else:
+                    data = previous[0][(str(p1), str(p2))]
+                    metrics_data = previous[1][(str(p1), str(p2))]
+                    # The adjusted p-values depend on the p-values of all the pairs, so they are updated for every pair
+                    for k, values in adjusted_columns:
+                        data[k] = metrics_data[k] = values[i]
+                with profiler.stage('write_rows'):
+                    writer.writerow(data)
+                    metrics_writer.writerow(metrics_data)
+                    # The files only have to be flushed after every pair when their offsets are journaled
+                    if journal is not None:
+                        f.flush()
+                        metrics_f.flush()
+                        journal.write(str(p1) + '\t' + str(p2) + '\t' + str(f.tell()) + '\t' + str(metrics_f.tell()) + '\n')
+                        journal.flush()
+                progress.update(n_matches, scored=i in rescored, significant=p_vals_significance[i] < SIGNIFICANCE_LEVEL)
+        progress.finish()
+    return journal
+
+def finish_run(journal, filename):
+    # The run is complete, so it no longer needs to be resumed
+    if journal is not None:
+        journal.close()
+        os.remove(os.path.splitext(filename)[0] + '_journal.txt')
+
+def run_analysis(args, all_matches, matches, profiler=None, player_index=None):
+    """
+    Runs the bogey analysis for one set of options and writes its result and metrics files. With --incremental, it
+    also writes the run state from which the next --incremental run is updated by update_run.
+
+    Parameters:
+    - args (Namespace): Options of the run, as parsed by parser
+    - all_matches (DataFrame): DataFrame containing all the matches of the dataset, as loaded from the match store
+    - matches (DataFrame): all_matches with the columns added by prepare_matches for args.upset
+    - profiler (Profiler): Profiler of the run, which writes its report next to the output file (default = profiling off)
+    - player_index (PlayerIndex): Adjacency index of matches, used to look up the matches of the given players, e.g.,
+      when it is reused over many runs (default = None, the matches are looked up with get_player_rows)
+    """
+    if profiler is None:
+        profiler = Profiler(args.profile)
+
+    # When a player is given, only the matches of that player can be in the output, so the rest of the run works on
+    # the player's matches, in the same order as in the table
+    with profiler.stage('filter'):
+        df, players_1, players_2 = get_run_matches(matches, args, player_index)
+
+    # Index the player pairs that have played each other, with their matches already grouped
+    with profiler.stage('pair_index'):
+        pair_index = build_pair_index(df, players_1, players_2)
+
+    # Calculate the expected and actual wins for every pair at once, from the win probabilities of every match
+    with profiler.stage('pair_totals'):
+        totals = get_pair_totals(df, pair_index)
+    p1_won = df['p1_won'].to_numpy(dtype=bool)
+
+    oddsratios, p_vals_fisher, p_vals_pb = run_pair_tests(args, df, pair_index, totals, profiler)
+
+    # Adjust the p-values for multiple comparisons over all the pairs of the run
+    with profiler.stage('p_adjust'):
+        p_vals_fisher_adj = p_adjust(p_vals_fisher, args.p_adj_method)
+        p_vals_pb_adj = p_adjust(p_vals_pb, args.p_adj_method) if p_vals_pb is not None else None
+    # Adjusted p-values of the test used to count the significant pairs in the progress reports
+    p_vals_significance = p_vals_pb_adj if p_vals_pb_adj is not None else p_vals_fisher_adj
+
+    filename = get_output_filename(args)
+    file_prefix = os.path.splitext(filename)[0]
+    header = RESULT_COLUMNS + (POISSON_BINOMIAL_COLUMNS if p_vals_pb is not None else [])
+    positions = list(range(len(pair_index)))
+
+    # When resuming a checkpointed run, the pairs recorded in its journal are already in the result and metrics files,
+    # which are truncated to the rows of the last recorded pair and then appended to
+    journal_filename = file_prefix + '_journal.txt'
+    metrics_filename = file_prefix + '_metrics.csv'
+    completed = set()
+    if args.resume and os.path.exists(journal_filename):
+        completed, offsets = read_journal(args, journal_filename)
+        for name, offset in zip([filename, metrics_filename], offsets):
+            with open(name, 'r+b') as f:
+                f.truncate(offset)
+        positions = [i for i in positions if (str(pair_index[i][0]), str(pair_index[i][1])) not in completed]
+        print('Resuming the run in ' + journal_filename + ', ' + str(len(completed)) + ' of ' + str(len(pair_index)) + ' player pairs already completed')
+    elif args.resume:
+        print('No interrupted run found in ' + journal_filename + ', starting a new run')
+
+    set_shared(df, pair_index, totals, oddsratios, p_vals_fisher, p_vals_fisher_adj, p_vals_pb, p_vals_pb_adj)
+    journal = write_results(args, filename, header, [(p1, p2, len(rows)) for p1, p2, rows in pair_index], set(positions),
+                            score_pairs(positions, args.workers, args.dataset), None, {}, p_vals_significance, completed, profiler)
+
+    # Store the list-valued columns as typed arrays, so they can be loaded without parsing the text of the lists
+    with profiler.stage('write_lists'):
+        write_result_lists(filename, [pair[0] for pair in pair_index], [pair[1] for pair in pair_index], [pair[2] for pair in pair_index],
+                           df['Day'].to_numpy(), p1_won, _shared['is_upset'])
+
+    # Keep the totals and test results of every pair of the run, including the pairs that the output files leave out
+    # because of the player options, so that the next --incremental run only has to fold in the new matches
+    if args.incremental:
+        with profiler.stage('write_state'):
+            in_output = {(str(p1), str(p2)) for p1, p2, _ in pair_index}
+            # The next run orders the pairs of new opponents among all the players of the filtered matches
+            if args.player_1 != 'all' or args.player_2 != 'all':
+                filtered = filter_matches(matches, args)
+                players_1 = filtered['P_i'].unique() if args.player_1 == 'all' else players_1
+                players_2 = filtered['P_j'].unique() if args.player_2 == 'all' else players_2
+            other_pairs = [pair for pair in get_all_pairs(df) if (str(pair[0]), str(pair[1])) not in in_output]
+            other_totals = get_pair_totals(df, other_pairs)
+            no_tests = np.full(len(other_pairs), np.nan)
+            state = get_pair_state(df, pair_index + other_pairs, pd.concat([totals, other_totals], ignore_index=True),
+                                   np.arange(len(pair_index) + len(other_pairs)) < len(pair_index),
+                                   np.concatenate([oddsratios, no_tests]), np.concatenate([p_vals_fisher, no_tests]),
+                                   np.concatenate([p_vals_pb, no_tests]) if p_vals_pb is not None else None, players_1, players_2)
+            store = load_match_store(args.dataset)
+            write_run_state(args, file_prefix, len(store), [[0, len(store), store.hash_rows(0, len(store))]], state)
+    profiler.write_report(file_prefix + '_profile.json', get_run_settings(args))
+    finish_run(journal, filename)
+
+def update_run(args, profiler=None):
+    """
+    Updates the output files of the previous --incremental run with the same options, folding in only the matches
+    added to the end of the match data file since then. The totals and test results of every player pair of the
+    previous run are kept in its state file, so only the new matches are prepared and filtered, and only the pairs
+    with new matches (or that are new to the output) are tested and scored again, from their own matches. The rows of
+    the other pairs are copied from the previous output files, with their adjusted p-values updated, since these
+    depend on the p-values of all the pairs.
+
+    Parameters:
+    - args (Namespace): Options of the run, as parsed by parser
+    - profiler (Profiler): Profiler of the run, which writes its report next to the output file (default = profiling off)
+
+    Returns:
+    - updated (bool): Whether the output files were updated, False if they must be computed in full by run_analysis
+    """
+    if profiler is None:
+        profiler = Profiler(args.profile)
+    filename = get_output_filename(args)
+    file_prefix = os.path.splitext(filename)[0]
+
+    with profiler.stage('read_previous_run'):
+        state = read_run_state(args, file_prefix)
+    if state is None:
+        return False
+
+    # The matches of the previous run must be the first matches of the dataset, unchanged
+    with profiler.stage('load'):
+        store = load_match_store(args.dataset)
+    n_previous, n_matches = state['n_matches'], len(store)
+    with profiler.stage('check_previous_matches'):
+        unchanged = n_previous <= n_matches and all(store.hash_rows(start, end) == digest for start, end, digest in state['match_hashes'])
+    if not unchanged:
+        print('The matches of the previous run have changed, computing the results for all player pairs')
+        return False
+
+    # Prepare and filter only the new matches
+    with profiler.stage('prepare'):
+        new_matches = prepare_matches(store.to_frame(rows=np.arange(n_previous, n_matches)), args.upset)
+    with profiler.stage('filter'):
+        new_df = filter_matches(new_matches, args)
+    # The players of the new matches are scanned after the players of the previous matches, as in a run over all the matches
+    players_1 = pd.unique(np.concatenate([state['players_1'].astype(object), new_df['P_i'].to_numpy(dtype=object)])) if args.player_1 == 'all' else [args.player_1]
+    players_2 = pd.unique(np.concatenate([state['players_2'].astype(object), new_df['P_j'].to_numpy(dtype=object)])) if args.player_2 == 'all' else [args.player_2]
+    if args.player_1 != 'all' or args.player_2 != 'all':
+        with profiler.stage('player_matches'):
+            new_df = get_player_matches(new_matches, args)
+
+    # Fold the new matches into the pairs of the state, adding the pairs that are new
+    with profiler.stage('fold'):
+        new_pairs = get_all_pairs(new_df)
+        new_totals = get_pair_totals(new_df, new_pairs)
+        previous_pairs = pd.MultiIndex.from_arrays([state['player1'].astype(object), state['player2'].astype(object)])
+        new_keys = pd.MultiIndex.from_arrays([[str(pair[0]) for pair in new_pairs], [str(pair[1]) for pair in new_pairs]])
+        k = previous_pairs.get_indexer(new_keys) if len(previous_pairs) else np.full(len(new_pairs), -1)
+        is_new = k < 0
+        n_previous_pairs = len(previous_pairs)
+        k[is_new] = n_previous_pairs + np.arange(is_new.sum())
+        n_pairs = n_previous_pairs + int(is_new.sum())
+
+        def extend(values, fill):
+            return np.concatenate([values, np.full(n_pairs - n_previous_pairs, fill, dtype=values.dtype)])
+
+        player1 = np.concatenate([state['player1'].astype(object), new_keys.get_level_values(0).to_numpy(dtype=object)[is_new]])
+        player2 = np.concatenate([state['player2'].astype(object), new_keys.get_level_values(1).to_numpy(dtype=object)[is_new]])
+        for name in ['matches', 'expected_wins_p1', 'expected_wins_p2', 'actual_wins_p1']:
+            state[name] = extend(state[name], 0)
+            state[name][k] += new_totals[name].to_numpy(dtype=state[name].dtype)
+        for name in ['oddsratio', 'p_value_fisher', 'p_value_poisson_binomial']:
+            if name in state:
+                state[name] = extend(state[name], np.nan)
+        in_output = extend(state['in_output'], False)
+        new_rows = new_df.index.to_numpy()
+        state['offsets'], state['rows'] = add_pair_rows(state['offsets'], state['rows'], np.repeat(k, [len(rows) for _, _, rows in new_pairs]),
+                                                        np.concatenate([new_rows[rows] for _, _, rows in new_pairs]) if new_pairs else np.array([], dtype=np.int64), n_pairs)
+        changed = np.zeros(n_pairs, dtype=bool)
+        changed[k] = True
+
+        # Pairs of the output files, in scan order, and the pairs among them to score: those with new matches, and
+        # those that were not in the previous output files
+        order = get_scan_order(pd.Index(player1), pd.Index(player2), players_1, players_2)
+        rescore = order[changed[order] | ~in_output[order]]
+    print(str(len(new_df)) + ' new matches, rescoring ' + str(len(rescore)) + ' of ' + str(len(order)) + ' player pairs')
+
+    # Only the matches of the pairs to score are prepared, and their totals are calculated from their matches, as in
+    # a run over all the matches
+    with profiler.stage('pair_matches'):
+        pair_rows = [state['rows'][state['offsets'][j]:state['offsets'][j + 1]] for j in rescore]
+        match_rows = np.sort(np.concatenate(pair_rows)) if pair_rows else np.array([], dtype=np.int64)
+        df = prepare_matches(store.to_frame(rows=match_rows), args.upset)
+        pair_index = [(player1[j], player2[j], np.searchsorted(match_rows, rows)) for j, rows in zip(rescore, pair_rows)]
+    with profiler.stage('pair_totals'):
+        totals = get_pair_totals(df, pair_index)
+    oddsratios, p_vals_fisher, p_vals_pb = run_pair_tests(args, df, pair_index, totals, profiler)
+    for name in ['matches', 'expected_wins_p1', 'expected_wins_p2', 'actual_wins_p1']:
+        state[name][rescore] = totals[name].to_numpy()
+    state['oddsratio'][rescore] = oddsratios
+    state['p_value_fisher'][rescore] = p_vals_fisher
+    if p_vals_pb is not None:
+        state['p_value_poisson_binomial'][rescore] = p_vals_pb
 
-        def safely_parse_list(lst):
-            try:
-                return ast.literal_eval(lst)
-            except (SyntaxError, ValueError):
-                return []
+    # Adjust the p-values for multiple comparisons over all the pairs of the output files
+    with profiler.stage('p_adjust'):
+        p_vals_fisher_adj = np.full(n_pairs, np.nan)
+        p_vals_fisher_adj[order] = p_adjust(state['p_value_fisher'][order], args.p_adj_method)
+        adjusted = {'p_value_fisher_adj': p_vals_fisher_adj[order]}
+        p_vals_pb_adj = None
+        if p_vals_pb is not None:
+            p_vals_pb_adj = np.full(n_pairs, np.nan)
+            p_vals_pb_adj[order] = p_adjust(state['p_value_poisson_binomial'][order], args.p_adj_method)
+            adjusted['p_value_poisson_binomial_adj'] = p_vals_pb_adj[order]
+    p_vals_significance = (p_vals_pb_adj if p_vals_pb_adj is not None else p_vals_fisher_adj)[order]
 
-        # Function to extract non-date elements from the list of tuples
-        def extract_non_date(lst):
-            return [item[0] for item in lst]
+    with profiler.stage('read_previous_run'):
+        _, previous_rows = read_result_rows(filename)
+        _, previous_metrics_rows = read_result_rows(file_prefix + '_metrics.csv')
+        previous_lists = load_result_lists(filename)
 
-        data = pd.read_csv(filename)
+    set_shared(df, pair_index, totals, oddsratios, p_vals_fisher, p_vals_fisher_adj[rescore], p_vals_pb,
+               p_vals_pb_adj[rescore] if p_vals_pb_adj is not None else None)
+    header = RESULT_COLUMNS + (POISSON_BINOMIAL_COLUMNS if p_vals_pb is not None else [])
+    is_rescored = np.zeros(n_pairs, dtype=bool)
+    is_rescored[rescore] = True
+    journal = write_results(args, filename, header, [(player1[j], player2[j], int(state['matches'][j])) for j in order],
+                            set(np.flatnonzero(is_rescored[order]).tolist()), score_pairs(list(range(len(rescore))), args.workers, args.dataset),
+                            (previous_rows, previous_metrics_rows), adjusted, p_vals_significance, set(), profiler)
 
-        # Apply the safely_parse_list function to 'results_set_with_dates' column
-        data['results_set_with_dates'] = data['results_set_with_dates'].apply(safely_parse_list)
-        data['upset_results_set_with_dates'] = data['upset_results_set_with_dates'].apply(safely_parse_list)
+    # The typed lists of the pairs that were not scored are copied from the previous typed list file
+    with profiler.stage('write_lists'):
+        previous_keys = pd.MultiIndex.from_arrays([previous_lists.player1.astype(object), previous_lists.player2.astype(object)])
+        previous_k = previous_keys.get_indexer(pd.MultiIndex.from_arrays([player1[order], player2[order]]))
+        local = dict(zip(rescore.tolist(), range(len(rescore))))
+        n_previous_lists = len(previous_lists.day)
+        rows = [n_previous_lists + pair_index[local[j]][2] if is_rescored[j] else np.arange(previous_lists.offsets[kk], previous_lists.offsets[kk + 1])
+                for j, kk in zip(order, previous_k)]
+        write_result_lists(filename, player1[order], player2[order], rows,
+                           np.concatenate([previous_lists.day, df['Day'].to_numpy(dtype=np.int32)]),
+                           np.concatenate([previous_lists.p1_won, df['p1_won'].to_numpy(dtype=bool)]),
+                           np.concatenate([previous_lists.is_upset, _shared['is_upset']]))
 
-        # Extract non-date elements and store them in a new column
-        data['results_set'] = data['results_set_with_dates'].apply(extract_non_date)
-        data['upset_results_set'] = data['upset_results_set_with_dates'].apply(extract_non_date)
+    with profiler.stage('write_state'):
+        state['player1'], state['player2'] = player1.astype(str), player2.astype(str)
+        state['in_output'] = np.zeros(n_pairs, dtype=bool)
+        state['in_output'][order] = True
+        state['players_1'] = np.array([str(player) for player in players_1], dtype=str)
+        state['players_2'] = np.array([str(player) for player in players_2], dtype=str)
+        match_hashes = state.pop('match_hashes') + ([[n_previous, n_matches, store.hash_rows(n_previous, n_matches)]] if n_matches > n_previous else [])
+        del state['n_matches']
+        write_run_state(args, file_prefix, n_matches, match_hashes, state)
+    profiler.write_report(file_prefix + '_profile.json', get_run_settings(args))
+    finish_run(journal, filename)
+    return True
 
-        # Calculate the metrics for each row
-        data['total_matches'] = data['results_set_with_dates'].apply(lambda x: len(x) if isinstance(x, list) else 0)
-        data['upset_matches'] = data['results_set_with_dates'].apply(lambda x: sum([1 for result in x if result[0] == 'U']))
+def main(args):
+    if args.resume and args.incremental:
+        parser.error('--resume cannot be combined with --incremental')
 
-        # Calculate the number of upset wins and losses
-        data['upset_wins'] = data['upset_results_set'].apply(lambda x: x.count('UW'))
-        data['upset_losses'] = data['upset_results_set'].apply(lambda x: x.count('UL'))
+    profiler = Profiler(args.profile)
 
-        # Calculate the upset percentage, upset win percentage, and upset loss percentage
-        data['upset_percentage'] = (data['upset_matches'] / data['total_matches']) * 100
-        data['upset_win_percentage'] = (data['upset_wins'] / data['upset_matches']) * 100
-        data['upset_loss_percentage'] = (data['upset_losses'] / data['upset_matches']) * 100
+    # An incremental run only loads the matches added since the previous run
+    if args.incremental and update_run(args, profiler):
+        return
 
-        # Save the updated data to a new CSV file
-        file_prefix = os.path.splitext(filename)[0]
-        data.to_csv(file_prefix + '_metrics.csv', index=False)
+    # Load the columns used in the analysis from the memory-mapped match store
+    with profiler.stage('load'):
+        all_matches = load_match_store(args.dataset).to_frame()
+    with profiler.stage('prepare'):
+        matches = prepare_matches(all_matches, args.upset)
+    # A single run looks up its players with get_player_rows, since building a PlayerIndex only pays off when it is
+    # reused over many queries
+    run_analysis(args, all_matches, matches, profiler)
 
 if __name__ == '__main__':
-    main()
+    args, _ = parser.parse_known_args()
+    main(args)
@@ -0,0 +1,236 @@
+import argparse
+import time
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from match_store import load_match_store, date_to_day
+from fisher_batch import fisher_exact_batch
+from p_adjust import p_adjust, P_ADJUST_METHODS
+import bogey_tennis_fisher as bogey
+
+# Sliding time-window bogey analysis, to see when a bogey relationship appeared and disappeared. Instead of running
+# bogey_tennis_fisher.py once per -s/-e window, the matches of each player pair are sorted by date and the cumulative
+# expected and actual wins of the pair are built once. The totals of any window are then the difference of two
+# cumulative values, and the Fisher's exact tests of every pair and window are run in one batch. The output is a long
+# table with one row per pair and window.
+parser = argparse.ArgumentParser()
+parser.add_argument('-p1', '--player_1', type=str, required=False, default='all', help='player name in format Last Name Initial., enclosed in double quotes e.g., "Djokovic N." (default = all players)')
+parser.add_argument('-p2', '--player_2', type=str, required=False, default='all', help='player name in format Last Name Initial., enclosed in double quotes e.g., "Djokovic N." (default = all players)')
+parser.add_argument('-d', '--dataset', type=str, required=True, help='atp or wta')
+parser.add_argument('-g', '--grand_slam', type=int, required=False, default=2, help='0 = non grand slams, 1 = grand slams only, 2 = grand slams and non grand slams (default)')
+parser.add_argument('-t', '--tournament', type=str, required=False, default='all', help='tournament name, e.g., Australian Open')
+parser.add_argument('-p', '--p_adj_method', type=str, required=False, choices=P_ADJUST_METHODS, default='BH', help='p-value adjustment for multiple comparisons method, applied over the pairs of each window, e.g., bonferroni, hochberg, BH, holm, hommel, BY')
+parser.add_argument('-u', '--upset', type=str, required=False, choices=['odds','elo'], default='odds', help='whether an unexpected result is based on the betting odds or elo rating (default=odds)')
+parser.add_argument('--window_years', type=int, required=False, default=3, help='length of each window in calendar years (default = 3)')
+parser.add_argument('--step_years', type=int, required=False, default=1, help='years between the starts of consecutive windows (default = 1)')
+parser.add_argument('--start_year', type=int, required=False, default=None, help='year in which the first window starts (default = first year in dataset)')
+parser.add_argument('--end_year', type=int, required=False, default=None, help='year in which the last window ends at the latest (default = last year in dataset)')
+parser.add_argument('--windows', type=str, nargs='+', required=False, default=None, help='windows in start:end format with YYYY-MM-DD dates, e.g., 2005-01-01:2007-12-31, instead of the yearly windows')
+
+class WindowError(Exception):
+    # No window fits the options and the dates of the filtered matches, reported as a usage error
+    pass
+
+WINDOW_COLUMNS = ['window_start', 'window_end', 'player1', 'player2', 'matches', 'expected_wins_p1', 'expected_wins_p2', 'actual_wins_p1', 'actual_wins_p2', 'or', 'p_value_fisher', 'p_value_fisher_adj']
+
+def get_windows(args, days):
+    """
+    Builds the windows of a run, from the --windows option or as calendar year windows stepped by --step_years.
+
+    Parameters:
+    - args (Namespace): Options of the run
+    - days (array): Day number of each match, used for the default first and last years
+
+    Returns:
+    - windows (list): List of (start, end) dates of each window in YYYY-MM-DD format, both included
+
+    Raises:
+    - WindowError: If no window fits, e.g., when the matches span fewer years than --window_years
+    """
+    if args.windows is not None:
+        return [tuple(window.split(':')) for window in args.windows]
+    years = np.asarray(days).astype('datetime64[D]').astype('datetime64[Y]').astype(int) + 1970
+    if len(years) == 0 and (args.start_year is None or args.end_year is None):
+        raise WindowError('no matches are left after the filters, so there are no years to place the windows in')
+    start_year = args.start_year if args.start_year is not None else int(years.min())
+    end_year = args.end_year if args.end_year is not None else int(years.max())
+    windows = [(str(year) + '-01-01', str(year + args.window_years - 1) + '-12-31')
+               for year in range(start_year, end_year - args.window_years + 2, args.step_years)]
+    if not windows:
+        raise WindowError('no ' + str(args.window_years) + '-year window fits in ' + str(start_year) + '-' + str(end_year)
+                          + ', use a smaller --window_years, other --start_year and --end_year, or --windows')
+    return windows
+
+def build_pair_prefix_sums(df, pair_index):
+    """
+    Builds the cumulative expected and actual wins of every pair over its matches in date order.
+
+    The matches of the pairs are laid out one pair after the other, each pair starting with a zero entry, so that the
+    totals of the matches in positions lo to hi of a pair are cumulative[hi] - cumulative[lo - 1]. The sums are
+    accumulated separately for each pair, so the totals of a pair do not depend on the size of the dataset.
+
+    Parameters:
+    - df (DataFrame): DataFrame containing the matches, with the win probability columns
+    - pair_index (list): List of (p1, p2, rows) tuples, as returned by build_pair_index
+
+    Returns:
+    - prefix_sums (dict): The arrays keys (pair position and day of each entry, in ascending order), expected_wins_p1,
+      expected_wins_p2 and actual_wins_p1 (cumulative sums), and the day number of the first day, day_min, and the
+      span of days between the pairs' keys, day_span
+    """
+    n_pairs = len(pair_index)
+    matches = np.array([len(rows) for _, _, rows in pair_index], dtype=np.int64)
+    rows = np.concatenate([rows for _, _, rows in pair_index]) if n_pairs else np.array([], dtype=np.int64)
+    pairs = np.repeat(np.arange(n_pairs, dtype=np.int64), matches)
+    day = df['Day'].to_numpy(dtype=np.int64)[rows]
+
+    # Sort the matches of each pair by date, keeping the order of the table for matches on the same day
+    order = np.lexsort((day, pairs))
+    rows, day = rows[order], day[order]
+
+    # Insert a zero entry at the start of each pair, keyed before its first day
+    day_min = int(day.min()) if len(day) else 0
+    day_span = int(day.max()) - day_min + 2 if len(day) else 2
+    positions = np.arange(len(rows)) + pairs + 1
+    n_entries = len(rows) + n_pairs
+    entry_pairs = np.repeat(np.arange(n_pairs, dtype=np.int64), matches + 1)
+    keys = entry_pairs * day_span
+    keys[positions] += day - day_min + 1
+
+    def cumulative(values):
+        padded = np.zeros(n_entries, dtype=values.dtype)
+        padded[positions] = values
+        return pd.Series(padded).groupby(entry_pairs).cumsum().to_numpy()
+
+    # Missing probabilities are skipped when summing, as in get_pair_totals
+    return {
+        'keys': keys,
+        'expected_wins_p1': cumulative(np.nan_to_num(df['p1_win_prob'].to_numpy(dtype=float)[rows])),
+        'expected_wins_p2': cumulative(np.nan_to_num(df['p2_win_prob'].to_numpy(dtype=float)[rows])),
+        'actual_wins_p1': cumulative(df['p1_won'].to_numpy(dtype=np.int64)[rows]),
+        'day_min': day_min,
+        'day_span': day_span,
+    }
+
+def get_window_totals(prefix_sums, n_pairs, start_day, end_day):
+    """
+    Calculates the totals of every pair in a window, as the difference of the cumulative sums at its ends.
+
+    Parameters:
+    - prefix_sums (dict): Cumulative sums of the pairs, as returned by build_pair_prefix_sums
+    - n_pairs (int): Number of pairs
+    - start_day (int): Day number of the first day of the window
+    - end_day (int): Day number of the last day of the window
+
+    Returns:
+    - totals (DataFrame): DataFrame with one row per pair, in pair index order, with the columns matches,
+      expected_wins_p1, expected_wins_p2, actual_wins_p1 and actual_wins_p2
+    """
+    day_min, day_span = prefix_sums['day_min'], prefix_sums['day_span']
+    base = np.arange(n_pairs, dtype=np.int64) * day_span
+    # Days are clipped to the span of the keys, so that the windows never reach into the keys of another pair
+    start_key = base + min(max(start_day - day_min + 1, 1), day_span)
+    end_key = base + min(max(end_day - day_min + 1, 0), day_span - 1)
+    before = np.searchsorted(prefix_sums['keys'], start_key, side='left') - 1
+    last = np.searchsorted(prefix_sums['keys'], end_key, side='right') - 1
+    last = np.maximum(last, before)
+
+    def window_sum(name):
+        return prefix_sums[name][last] - prefix_sums[name][before]
+
+    matches = last - before
+    actual_wins_p1 = window_sum('actual_wins_p1')
+    return pd.DataFrame({
+        'matches': matches,
+        'expected_wins_p1': window_sum('expected_wins_p1'),
+        'expected_wins_p2': window_sum('expected_wins_p2'),
+        'actual_wins_p1': actual_wins_p1,
+        'actual_wins_p2': matches - actual_wins_p1,
+    })
+
+def run_windows(args, matches, player_index=None):
+    """
+    Runs the bogey analysis of every pair over every window.
+
+    Parameters:
+    - args (Namespace): Options of the run
+    - matches (DataFrame): Matches of the dataset with the columns added by prepare_matches for args.upset
+    - player_index (PlayerIndex): Adjacency index of matches, used when a player is given (default = None, no index,
+      the matches of the player are looked up with bogey_tennis_fisher.get_player_rows)
+
+    Returns:
+    - results (DataFrame): One row per pair and window with at least one match in the window, with the columns
+      WINDOW_COLUMNS, ordered by window and then in the order of the output rows of bogey_tennis_fisher.py
+      over the whole period
+    """
+    # The windows take the place of the date options of bogey_tennis_fisher.py
+    args = argparse.Namespace(**dict(vars(args), s_date='min', e_date='max'))
+    # The windows span the dates of all the filtered matches, also when a player is given
+    windows = get_windows(args, bogey.filter_matches(matches, args)['Day'].to_numpy())
+    df, players_1, players_2 = bogey.get_run_matches(matches, args, player_index)
+    pair_index = bogey.build_pair_index(df, players_1, players_2)
+    prefix_sums = build_pair_prefix_sums(df, pair_index)
+
+    # Only the pairs that played in a window are tested, as in a run restricted to the window
+    window_totals, window, pair = [], [], []
+    for k, (start, end) in enumerate(windows):
+        totals = get_window_totals(prefix_sums, len(pair_index), date_to_day(start), date_to_day(end))
+        played = np.flatnonzero(totals['matches'].to_numpy() > 0)
+        window_totals.append(totals.iloc[played])
+        window.append(np.full(len(played), k))
+        pair.append(played)
+    totals = pd.concat(window_totals, ignore_index=True) if windows else get_window_totals(prefix_sums, 0, 0, 0)
+    window = np.concatenate(window) if windows else np.array([], dtype=np.int64)
+    pair = np.concatenate(pair) if windows else np.array([], dtype=np.int64)
+
+    # Test every pair and window in one batch
+    observed = np.stack([totals[['expected_wins_p1', 'actual_wins_p1']].to_numpy(dtype=float),
+                         totals[['expected_wins_p2', 'actual_wins_p2']].to_numpy(dtype=float)], axis=1)
+    oddsratios, p_vals_fisher = fisher_exact_batch(observed)
+
+    # Adjust the p-values over the pairs of each window
+    p_vals_fisher_adj = np.zeros(len(p_vals_fisher))
+    for k in range(len(windows)):
+        in_window = np.flatnonzero(window == k)
+        p_vals_fisher_adj[in_window] = p_adjust(p_vals_fisher[in_window], args.p_adj_method)
+
+    starts = np.array([start for start, _ in windows], dtype=object)
+    ends = np.array([end for _, end in windows], dtype=object)
+    return pd.DataFrame({
+        'window_start': starts[window],
+        'window_end': ends[window],
+        'player1': [str(pair_index[k][0]) for k in pair],
+        'player2': [str(pair_index[k][1]) for k in pair],
+        'matches': totals['matches'],
+        'expected_wins_p1': totals['expected_wins_p1'],
+        'expected_wins_p2': totals['expected_wins_p2'],
+        'actual_wins_p1': totals['actual_wins_p1'],
+        'actual_wins_p2': totals['actual_wins_p2'],
+        'or': oddsratios,
+        'p_value_fisher': p_vals_fisher,
+        'p_value_fisher_adj': p_vals_fisher_adj,
+    }, columns=WINDOW_COLUMNS)
+
+def get_windows_filename(args):
+    # Same name as the result file of bogey_tennis_fisher.py without date options, with a different prefix
+    args = argparse.Namespace(**dict(vars(args), s_date='min', e_date='max'))
+    return bogey.get_output_filename(args).replace('bogey_results_output', 'bogey_windows_output', 1)
+
+def main():
+    args = parser.parse_args()
+    start = time.time()
+
+    all_matches = load_match_store(args.dataset).to_frame()
+    matches = bogey.prepare_matches(all_matches, args.upset)
+    try:
+        results = run_windows(args, matches)
+    except WindowError as e:
+        parser.error(str(e))
+
+    filename = get_windows_filename(args)
+    results.to_csv(filename, index=False)
+    n_windows = results[['window_start', 'window_end']].drop_duplicates().shape[0]
+    print(datetime.now().strftime('%d/%m/%Y %H:%M:%S') + ' ' + str(len(results)) + ' pair windows in ' + str(n_windows) + ' windows written to ' + filename + ' in ' + str(round(time.time() - start, 1)) + 's')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,223 @@
+"""
+Yearly descriptive statistics of the betting odds and Elo ratings of a dataset, computed in one streaming pass.
+
+The matches are read in chunks, and the count, mean and sum of squared deviations (M2) of each variable are kept
+for every (year, Series, Tournament) cell. The moments of each chunk are merged into the running moments with the
+parallel form of Welford's algorithm (Chan et al.), which is numerically stable and never holds more than one
+chunk of values. The cells are cached next to the match store, so the descriptive plots and reports only combine the
+cells selected by their grand slam and tournament options, with the same merge, instead of reading the matches.
+The variances are sample variances (ddof = 1), as in pandas.
+"""
+
+import os
+import numpy as np
+import pandas as pd
+from match_data import DATASET_FILES, get_source_signature, is_source_unchanged
+from match_store import load_match_store, get_store_path, date_to_day
+
+# Variables of the statistics, and the match data columns pooled into each of them
+STAT_VARIABLES = {
+    'win_odds': ['AvgW'],
+    'lose_odds': ['AvgL'],
+    'odds': ['AvgW', 'AvgL'],
+    'elo': ['Elo_i_after_match', 'Elo_j_after_match'],
+}
+
+# Matches per chunk of the streaming pass
+CHUNK_MATCHES = 1 << 16
+
+def get_chunk_moments(groups, values, n_groups):
+    """
+    Calculates the count, mean and M2 of the values of each group of a chunk, skipping missing values.
+
+    Parameters:
+    - groups (array): Group of each value
+    - values (array): Values of the chunk
+    - n_groups (int): Number of groups
+
+    Returns:
+    - moments (tuple): Arrays of the count, mean and M2 of each group
+    """
+    valid = ~np.isnan(values)
+    groups, values = groups[valid], values[valid]
+    count = np.bincount(groups, minlength=n_groups).astype(float)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.bincount(groups, weights=values, minlength=n_groups) / count
+    m2 = np.bincount(groups, weights=(values - mean[groups]) ** 2, minlength=n_groups)
+    return count, np.nan_to_num(mean), m2
+
+def merge_moments(a, b):
+    # Merge the count, mean and M2 of two sets of values, group by group (Chan et al.)
+    count_a, mean_a, m2_a = a
+    count_b, mean_b, m2_b = b
+    count = count_a + count_b
+    delta = mean_b - mean_a
+    with np.errstate(invalid='ignore', divide='ignore'):
+        share_b = np.where(count > 0, count_b / count, 0.0)
+    return count, mean_a + delta * share_b, m2_a + m2_b + delta ** 2 * count_a * share_b
+
+def accumulate_moments(groups, columns, n_groups):
+    """
+    Streams over the matches in chunks and accumulates the moments of every variable in every group.
+
+    Parameters:
+    - groups (array): Group of each match
+    - columns (dict): Values of each match data column used by STAT_VARIABLES
+    - n_groups (int): Number of groups
+
+    Returns:
+    - moments (dict): Count, mean and M2 arrays of each variable
+    """
+    moments = {name: (np.zeros(n_groups), np.zeros(n_groups), np.zeros(n_groups)) for name in STAT_VARIABLES}
+    for start in range(0, len(groups), CHUNK_MATCHES):
+        chunk_groups = groups[start:start + CHUNK_MATCHES]
+        for name, variable_columns in STAT_VARIABLES.items():
+            for column in variable_columns:
+                chunk = get_chunk_moments(chunk_groups, np.asarray(columns[column][start:start + CHUNK_MATCHES], dtype=float), n_groups)
+                moments[name] = merge_moments(moments[name], chunk)
+    return moments
+
+def get_match_columns(store):
+    # Columns of the statistics, with missing average odds replaced by the Bet365 odds, and the year of every match
+    df = store.to_frame(['Day', 'AvgW', 'AvgL', 'B365W', 'B365L', 'Elo_i_after_match', 'Elo_j_after_match'])
+    columns = {column: df[column].to_numpy(dtype=float) for column in ['Elo_i_after_match', 'Elo_j_after_match']}
+    columns['AvgW'] = df['AvgW'].fillna(df['B365W']).to_numpy(dtype=float)
+    columns['AvgL'] = df['AvgL'].fillna(df['B365L']).to_numpy(dtype=float)
+    year = df['Day'].to_numpy().astype('datetime64[D]').astype('datetime64[Y]').astype(np.int64) + 1970
+    return columns, year
+
+def get_cells_path(dataset):
+    return get_store_path(dataset) + '_descriptives.npz'
+
+def build_descriptive_stats(dataset):
+    """
+    Computes the moments of every variable in every (year, Series, Tournament) cell of a dataset and writes them to
+    the cache file.
+
+    Parameters:
+    - dataset (str): 'atp', 'wta' or 'test'
+    """
+    store = load_match_store(dataset)
+    columns, year = get_match_columns(store)
+    keys = pd.DataFrame({'year': year, 'series': np.asarray(store.series), 'tournament': np.asarray(store.tournament)})
+    grouped = keys.groupby(['year', 'series', 'tournament'])
+    groups, cells = grouped.ngroup().to_numpy(), grouped.size().index
+    moments = accumulate_moments(groups, columns, len(cells))
+
+    arrays = {
+        'year': cells.get_level_values('year').to_numpy(),
+        'series': cells.get_level_values('series').to_numpy(),
+        'tournament': cells.get_level_values('tournament').to_numpy(),
+        'series_categories': store.series_categories,
+        'tournament_categories': store.tournament_categories,
+        'source': get_source_signature(DATASET_FILES[dataset]),
+    }
+    for name, (count, mean, m2) in moments.items():
+        arrays[name + '_count'], arrays[name + '_mean'], arrays[name + '_m2'] = count, mean, m2
+
+    # Write to a temporary file first, so that an interrupted run never leaves a partial cache behind
+    cells_path = get_cells_path(dataset)
+    tmp_path = cells_path + '.tmp.npz'
+    np.savez(tmp_path, **arrays)
+    os.replace(tmp_path, cells_path)
+
+def load_descriptive_stats(dataset):
+    """
+    Loads the cached cells of a dataset, computing them first if they do not exist or the match data file has changed.
+
+    Parameters:
+    - dataset (str): 'atp', 'wta' or 'test'
+
+    Returns:
+    - cells (DataFrame): One row per (year, Series, Tournament) cell, with the year, Series and Tournament of the
+      cell and the count, mean and M2 of each variable
+    """
+    cells_path = get_cells_path(dataset)
+    if not os.path.exists(cells_path) or not is_source_unchanged(DATASET_FILES[dataset], np.load(cells_path)['source']):
+        build_descriptive_stats(dataset)
+
+    arrays = np.load(cells_path)
+    cells = pd.DataFrame({
+        'year': arrays['year'],
+        'Series': pd.Categorical.from_codes(arrays['series'], categories=arrays['series_categories']),
+        'Tournament': pd.Categorical.from_codes(arrays['tournament'], categories=arrays['tournament_categories']),
+    })
+    for name in STAT_VARIABLES:
+        for moment in ['count', 'mean', 'm2']:
+            cells[name + '_' + moment] = arrays[name + '_' + moment]
+    return cells
+
+def combine_years(groups, moments, years):
+    """
+    Merges the moments of the cells of each year and calculates the yearly statistics.
+
+    Parameters:
+    - groups (array): Position in years of the year of each cell
+    - moments (dict): Count, mean and M2 arrays of each variable, with one value per cell
+    - years (array): The years
+
+    Returns:
+    - yearly (DataFrame): One row per year with at least one match, with the columns Year, and the count, mean,
+      variance and CV of each variable
+    """
+    yearly = pd.DataFrame({'Year': years})
+    n_years = len(years)
+    for name, (count, mean, m2) in moments.items():
+        year_count = np.bincount(groups, weights=count, minlength=n_years)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            year_mean = np.bincount(groups, weights=count * mean, minlength=n_years) / year_count
+            # The M2 of a year is the M2 of its cells plus the spread of the cell means around the yearly mean
+            year_m2 = np.bincount(groups, weights=m2 + count * (mean - year_mean[groups]) ** 2, minlength=n_years)
+            variance = np.where(year_count > 1, year_m2 / (year_count - 1), np.nan)
+        yearly[name + '_count'] = year_count.astype(np.int64)
+        yearly[name + '_mean'] = np.where(year_count > 0, year_mean, np.nan)
+        yearly[name + '_variance'] = variance
+        yearly[name + '_cv'] = np.sqrt(variance) / yearly[name + '_mean']
+    return yearly
+
+def get_yearly_stats(dataset, grand_slam=2, tournament='all', s_date='min', e_date='max'):
+    """
+    Calculates the yearly statistics of the matches of a dataset selected by the grand slam, tournament and date
+    options. Without date options they are combined from the cached cells; with date options, which can cut a
+    year, the selected matches are streamed over instead.
+
+    Parameters:
+    - dataset (str): 'atp', 'wta' or 'test'
+    - grand_slam (int): 0 = non grand slams, 1 = grand slams only, 2 = grand slams and non grand slams (default = 2)
+    - tournament (str): Tournament name, or all (default = all)
+    - s_date (str): Start date in YYYY-MM-DD format, or min (default = min)
+    - e_date (str): End date in YYYY-MM-DD format, or max (default = max)
+
+    Returns:
+    - yearly (DataFrame): Yearly statistics, as returned by combine_years
+    """
+    from_cells = s_date == 'min' and e_date == 'max'
+    if from_cells:
+        df = load_descriptive_stats(dataset)
+    else:
+        store = load_match_store(dataset)
+        columns, year = get_match_columns(store)
+        df = store.to_frame(['Day', 'Series', 'Tournament'])
+        df['year'] = year
+
+    # Matches without a series count as non grand slams
+    if tournament != 'all':
+        df = df[(df['Tournament'] == tournament)]
+    if grand_slam == 0:
+        df = df[(df['Series'] != 'Grand Slam')]
+    elif grand_slam == 1:
+        df = df[(df['Series'] == 'Grand Slam')]
+    if s_date != 'min':
+        df = df[(df['Day'] >= date_to_day(s_date))]
+    if e_date != 'max':
+        df = df[(df['Day'] <= date_to_day(e_date))]
+
+    groups, years = pd.factorize(df['year'].to_numpy(), sort=True)
+    if from_cells:
+        moments = {name: tuple(df[name + '_' + moment].to_numpy() for moment in ['count', 'mean', 'm2']) for name in STAT_VARIABLES}
+        return combine_years(groups, moments, years)
+
+    # The moments of the selected matches are accumulated by year directly
+    rows = df.index.to_numpy()
+    moments = accumulate_moments(groups, {column: values[rows] for column, values in columns.items()}, len(years))
+    return combine_years(np.arange(len(years)), moments, years)
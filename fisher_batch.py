@@ -0,0 +1,189 @@
+"""
+Batched Fisher's exact test for arrays of 2x2 contingency tables.
+
+Gives the same odds ratios and two-sided p-values as scipy.stats.fisher_exact, which is what
+bogey_tennis_fisher.py used to call once per player pair, but evaluates a whole array of tables in a few
+vectorized calls. The tables are truncated to integers exactly as fisher_exact does, and because
+head-to-head counts are small the same tables recur many times, so p-values are kept in a lookup table
+keyed by the table cells that persists across calls (e.g. across the dataset/upset/grand slam variants of a sweep).
+Every small table is precomputed, and only the most recently used larger tables are kept.
+"""
+
+import threading
+from collections import OrderedDict
+import numpy as np
+from scipy.stats import hypergeom
+
+# Tables with at most this many observations are precomputed in one go the first time the lookup table is used
+SMALL_TABLE_MAX = 24
+
+# Relative tolerance used by fisher_exact when comparing the probabilities of two tables
+EPSILON = 1e-14
+GAMMA = 1 + EPSILON
+
+# Larger tables are kept in a least recently used cache of at most this many tables, so that a long-running process
+# (e.g. the query server) does not keep the p-value of every table it has seen
+LARGE_TABLE_CACHE_SIZE = 100000
+
+# Lookup tables of two-sided p-values of the small and of the most recently used larger tables, keyed by the
+# (a, b, c, d) cells of the table [[a, b], [c, d]]
+_small_pvalues = {}
+_large_pvalues = OrderedDict()
+# The lookup tables are shared by the threads of the query server
+_lookup_lock = threading.Lock()
+
+def _binary_search(fn, target, lo, hi):
+    """
+    Vectorized version of the binary search used by fisher_exact to find the value on the other side of the mode
+    from which the second tail of the two-sided p-value is summed.
+
+    Parameters:
+    - fn (function): Function of an array of x values, increasing between lo and hi for every table
+    - target (array): Value to search for, per table
+    - lo (array): Lower end of the range to search, per table
+    - hi (array): Higher end of the range to search, per table
+
+    Returns:
+    - guess (array): The index i between lo and hi such that fn(i) <= target < fn(i + 1), per table
+    """
+    lo = lo.copy()
+    hi = hi.copy()
+    found = np.zeros(len(lo), dtype=bool)
+    result = np.zeros(len(lo), dtype=np.int64)
+
+    while True:
+        active = ~found & (lo < hi)
+        if not active.any():
+            break
+        mid = lo + (hi - lo) // 2
+        midval = fn(mid)
+        below = active & (midval < target)
+        above = active & (midval > target)
+        equal = active & ~below & ~above
+        lo = np.where(below, mid + 1, lo)
+        hi = np.where(above, mid - 1, hi)
+        result = np.where(equal, mid, result)
+        found |= equal
+
+    last = np.where(fn(lo) <= target, lo, lo - 1)
+    return np.where(found, result, last)
+
+def _two_sided_pvalues(c):
+    """
+    Calculates the two-sided p-values of Fisher's exact test for an array of integer 2x2 tables, following the same
+    steps as fisher_exact so that the p-values are identical to it.
+
+    Parameters:
+    - c (array): Integer array of shape (n, 4) containing the cells a, b, c, d of each table [[a, b], [c, d]]
+
+    Returns:
+    - pvalue (array): Two-sided p-value of each table
+    """
+    pvalue = np.ones(len(c))
+
+    # If both values in a row or column are zero, the p-value is 1
+    valid = (c[:, 0] + c[:, 1] > 0) & (c[:, 2] + c[:, 3] > 0) & (c[:, 0] + c[:, 2] > 0) & (c[:, 1] + c[:, 3] > 0)
+    if not valid.any():
+        return pvalue
+    idx = np.flatnonzero(valid)
+    c = c[idx]
+
+    n1 = c[:, 0] + c[:, 1]
+    n2 = c[:, 2] + c[:, 3]
+    n = c[:, 0] + c[:, 2]
+    total = n1 + n2
+    x = c[:, 0]
+
+    def pmf(k):
+        return hypergeom.pmf(k, total, n1, n)
+
+    mode = ((n + 1) * (n1 + 1) // (total + 2)).astype(np.int64)
+    pexact = hypergeom.pmf(x, total, n1, n)
+    pmode = hypergeom.pmf(mode, total, n1, n)
+
+    # Tables as probable as the most probable table have a p-value of 1
+    at_mode = np.abs(pexact - pmode) / np.maximum(pexact, pmode) <= EPSILON
+    result = np.ones(len(c))
+
+    # The observed table is below the mode, so the second tail is above the mode
+    lower = ~at_mode & (x < mode)
+    if lower.any():
+        li = np.flatnonzero(lower)
+        args = (total[li], n1[li], n[li])
+        plower = hypergeom.cdf(x[li], *args)
+        one_tail = hypergeom.pmf(n[li], *args) > pexact[li] * GAMMA
+        guess = _binary_search(lambda k: -hypergeom.pmf(k, *args), -pexact[li] * GAMMA, mode[li], n[li])
+        result[li] = np.where(one_tail, plower, plower + hypergeom.sf(guess, *args))
+
+    # The observed table is above the mode, so the second tail is below the mode
+    upper = ~at_mode & (x >= mode)
+    if upper.any():
+        ui = np.flatnonzero(upper)
+        args = (total[ui], n1[ui], n[ui])
+        pupper = hypergeom.sf(x[ui] - 1, *args)
+        one_tail = hypergeom.pmf(0, *args) > pexact[ui] * GAMMA
+        guess = _binary_search(lambda k: hypergeom.pmf(k, *args), pexact[ui] * GAMMA, np.zeros(len(ui), dtype=np.int64), mode[ui])
+        result[ui] = np.where(one_tail, pupper, pupper + hypergeom.cdf(guess, *args))
+
+    pvalue[idx] = np.minimum(result, 1.0)
+    return pvalue
+
+def _precompute_small_tables():
+    # Fill the lookup table with every table with at most SMALL_TABLE_MAX observations
+    cells = np.array(np.meshgrid(*[np.arange(SMALL_TABLE_MAX + 1)] * 4, indexing='ij')).reshape(4, -1).T
+    cells = cells[cells.sum(axis=1) <= SMALL_TABLE_MAX]
+    _small_pvalues.update(zip(map(tuple, cells.tolist()), _two_sided_pvalues(cells).tolist()))
+
+def fisher_exact_batch(tables):
+    """
+    Performs Fisher's exact test (two-sided) on an array of 2x2 contingency tables.
+
+    Parameters:
+    - tables (array-like): Array of shape (n, 2, 2) of contingency tables. As in fisher_exact, non-integer values are
+      truncated to integers
+
+    Returns:
+    - oddsratio (array): Odds ratio of each table (nan if a row or column sums to zero, inf if b or c is zero)
+    - pvalue (array): Two-sided p-value of each table
+    """
+    c = np.asarray(tables, dtype=np.int64).reshape(-1, 4)
+    if np.any(c < 0):
+        raise ValueError("All values in `tables` must be nonnegative.")
+    if len(c) == 0:
+        return np.array([]), np.array([])
+
+    with _lookup_lock:
+        if not _small_pvalues:
+            _precompute_small_tables()
+
+    a, b, cc, d = c.T
+    empty_margin = (a + b == 0) | (cc + d == 0) | (a + cc == 0) | (b + d == 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        oddsratio = np.where((cc > 0) & (b > 0), (a * d) / np.maximum(cc * b, 1), np.inf)
+    oddsratio[empty_margin] = np.nan
+
+    # Only the distinct tables that are not yet in the lookup table need to be calculated
+    unique_tables, inverse = np.unique(c, axis=0, return_inverse=True)
+    keys = list(map(tuple, unique_tables.tolist()))
+    unique_pvalues = np.empty(len(keys))
+    missing = []
+    with _lookup_lock:
+        for k, key in enumerate(keys):
+            pvalue = _small_pvalues.get(key)
+            if pvalue is None:
+                pvalue = _large_pvalues.get(key)
+                if pvalue is not None:
+                    _large_pvalues.move_to_end(key)
+            if pvalue is None:
+                missing.append(k)
+            else:
+                unique_pvalues[k] = pvalue
+    if missing:
+        new_pvalues = _two_sided_pvalues(unique_tables[missing])
+        unique_pvalues[missing] = new_pvalues
+        with _lookup_lock:
+            _large_pvalues.update(zip([keys[k] for k in missing], new_pvalues.tolist()))
+            while len(_large_pvalues) > LARGE_TABLE_CACHE_SIZE:
+                _large_pvalues.popitem(last=False)
+
+    return oddsratio, unique_pvalues[inverse.reshape(-1)]
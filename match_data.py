@@ -0,0 +1,117 @@
+"""
+Loading of the cleaned match data files (the Data_Clean csv files created by create_data_clean_csv_files.R).
+
+The first time a csv file is loaded it is converted into a typed columnar cache (a .npz file with one array per
+column, where text columns are stored as integer codes and their categories), so that later runs can load only
+the columns they need instead of parsing the whole csv file. The cache is rebuilt when the csv file changes, which
+is checked by its size and modification time and, if these differ, by its hash.
+"""
+
+import os
+import hashlib
+import numpy as np
+import pandas as pd
+
+DATASET_FILES = {
+    'test': 'Data_Clean_Test.csv',
+    'wta': 'Data_Clean_WTA.csv',
+    'atp': 'Data_Clean_ATP_Elo_WElo.csv',
+}
+
+CACHE_DIR = '.match_data_cache'
+
+# Columns used by the bogey analysis, out of the ~100 columns in the match data files
+ANALYSIS_COLUMNS = ['Tournament', 'Date', 'Series', 'Surface', 'Winner', 'Loser', 'P_i', 'P_j',
+                    'AvgW', 'AvgL', 'B365W', 'B365L',
+                    'Elo_i_before_match', 'Elo_j_before_match', 'Elo_i_after_match', 'Elo_j_after_match']
+
+def file_hash(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+def get_cache_path(csv_path):
+    directory, name = os.path.split(os.path.abspath(csv_path))
+    return os.path.join(directory, CACHE_DIR, os.path.splitext(name)[0] + '.npz')
+
+def write_cache(csv_path, cache_path):
+    """
+    Parses the csv file and writes its columns to the columnar cache.
+
+    Parameters:
+    - csv_path (str): Path of the csv file
+    - cache_path (str): Path of the .npz cache file
+    """
+    df = pd.read_csv(csv_path, low_memory=False)
+    arrays = {
+        '__columns__': np.array(df.columns, dtype=str),
+        '__source__': get_source_signature(csv_path),
+    }
+    for k, column in enumerate(df.columns):
+        values = df[column]
+        if values.dtype.kind in 'biuf':
+            arrays['values_%d' % k] = values.to_numpy()
+        else:
+            # Text (or mixed) columns are stored as integer codes into an array of categories, with -1 for missing values
+            codes, categories = pd.factorize(values.astype(object))
+            arrays['codes_%d' % k] = codes.astype(np.int32)
+            arrays['categories_%d' % k] = np.array([str(c) for c in categories], dtype=str)
+
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    # Write to a temporary file first, so that an interrupted run never leaves a partial cache behind
+    tmp_path = cache_path + '.tmp.npz'
+    np.savez(tmp_path, **arrays)
+    os.replace(tmp_path, cache_path)
+
+def get_source_signature(csv_path):
+    # Size, modification time and hash of a csv file, used to check whether files derived from it are up to date
+    stat = os.stat(csv_path)
+    return np.array([str(stat.st_size), str(stat.st_mtime_ns), file_hash(csv_path)])
+
+def is_source_unchanged(csv_path, signature):
+    size, mtime_ns, sha = signature
+    stat = os.stat(csv_path)
+    if str(stat.st_size) != size:
+        return False
+    if str(stat.st_mtime_ns) == mtime_ns:
+        return True
+    # The file has been touched, so check whether its contents have actually changed
+    return file_hash(csv_path) == sha
+
+def read_column(cache, k):
+    if 'values_%d' % k in cache.files:
+        return cache['values_%d' % k]
+    codes = cache['codes_%d' % k]
+    categories = cache['categories_%d' % k].astype(object)
+    values = categories[np.maximum(codes, 0)] if len(categories) else np.full(len(codes), np.nan, dtype=object)
+    values[codes < 0] = np.nan
+    return values
+
+def load_matches(dataset, columns=None):
+    """
+    Loads the cleaned match data of a dataset, from the columnar cache if it is up to date.
+
+    Parameters:
+    - dataset (str): 'atp', 'wta' or 'test'
+    - columns (list): Columns to load (default = all columns). Columns that are not in the file are ignored
+
+    Returns:
+    - df (DataFrame): DataFrame containing the matches
+    """
+    csv_path = DATASET_FILES[dataset]
+    cache_path = get_cache_path(csv_path)
+
+    cache = np.load(cache_path) if os.path.exists(cache_path) else None
+    if cache is None or not is_source_unchanged(csv_path, cache['__source__']):
+        if cache is not None:
+            cache.close()
+        write_cache(csv_path, cache_path)
+        cache = np.load(cache_path)
+
+    with cache:
+        all_columns = list(cache['__columns__'])
+        if columns is None:
+            columns = all_columns
+        return pd.DataFrame({column: read_column(cache, all_columns.index(column)) for column in columns if column in all_columns})
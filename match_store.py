@@ -0,0 +1,259 @@
+"""
+Compact, integer-encoded store of the match data used by the bogey analysis.
+
+Instead of a DataFrame with a Python string for every player name, the store keeps a dictionary of players plus
+parallel arrays with one value per match: int32 player ids, int32 day numbers, int16 codes for Series, Tournament,
+Surface and Date, and the odds and Elo ratings. Each array is written as a .npy file, so that the store can be
+memory-mapped (without copying) by the worker processes of bogey_tennis_fisher.py and by the plotting scripts.
+
+Player ids are assigned in alphabetical order of the player names, so comparing two ids gives the same result as
+comparing the names, e.g. when building the canonical (min, max) player pair of a match.
+"""
+
+import os
+import hashlib
+import shutil
+import time
+import numpy as np
+import pandas as pd
+from match_data import DATASET_FILES, ANALYSIS_COLUMNS, load_matches, get_source_signature, is_source_unchanged
+
+STORE_DIR = '.match_store'
+
+# Format of the Date column in each dataset
+DATE_FORMATS = {
+    'test': '%Y-%m-%d',
+    'atp': '%Y-%m-%d',
+    'wta': '%d/%m/%Y',
+}
+
+# Columns that can be built from the store: the analysis columns of the match data file, plus the day number
+# (days since 1970-01-01) of each match
+FRAME_COLUMNS = ANALYSIS_COLUMNS + ['Day']
+
+PLAYER_COLUMNS = {'Winner': 'winner', 'Loser': 'loser', 'P_i': 'p_i', 'P_j': 'p_j'}
+CATEGORY_COLUMNS = {'Series': 'series', 'Tournament': 'tournament', 'Surface': 'surface', 'Date': 'date'}
+# The odds and Elo ratings are kept in float64 so that the expected wins are the same as when computed from the csv file
+FLOAT_COLUMNS = {'AvgW': 'avg_w', 'AvgL': 'avg_l', 'B365W': 'b365_w', 'B365L': 'b365_l',
+                 'Elo_i_before_match': 'elo_i_before', 'Elo_j_before_match': 'elo_j_before',
+                 'Elo_i_after_match': 'elo_i_after', 'Elo_j_after_match': 'elo_j_after'}
+
+class MatchStore:
+    """
+    Integer-encoded match data of one dataset. Every array attribute has one value per match, in the order of the
+    match data file; players and the category columns are decoded with the players and <name>_categories arrays.
+    """
+
+    def __init__(self, dataset, arrays):
+        self.dataset = dataset
+        self.players = arrays['players']
+        self.day = arrays['day']
+        for name in PLAYER_COLUMNS.values():
+            setattr(self, name, arrays[name])
+        for name in CATEGORY_COLUMNS.values():
+            setattr(self, name, arrays[name])
+            setattr(self, name + '_categories', arrays[name + '_categories'])
+        for name in FLOAT_COLUMNS.values():
+            setattr(self, name, arrays.get(name))
+
+    def __len__(self):
+        return len(self.day)
+
+    def player_id(self, name):
+        # Id of a player, or -1 if the player is not in the store
+        k = np.searchsorted(self.players, name)
+        return int(k) if k < len(self.players) and self.players[k] == name else -1
+
+    def to_frame(self, columns=FRAME_COLUMNS, rows=None):
+        """
+        Builds a DataFrame with the given match data columns, decoded from the store. Player, Series, Tournament and
+        Surface columns are returned as categoricals sharing the store's dictionaries.
+
+        Parameters:
+        - columns (list): Match data columns to include, and/or Day (default = the columns used in the analysis and Day)
+        - rows (array): Positions of the matches to include, in ascending order (default = None, all the matches)
+
+        Returns:
+        - df (DataFrame): DataFrame containing the matches, with one row per match in the order of the match data file,
+          indexed by the position of the match in the store
+        """
+        def get(array):
+            return array if rows is None else np.asarray(array[rows])
+
+        data = {}
+        for column in columns:
+            if column == 'Day':
+                data[column] = get(self.day)
+            elif column in PLAYER_COLUMNS:
+                data[column] = pd.Categorical.from_codes(get(getattr(self, PLAYER_COLUMNS[column])), categories=self.players)
+            elif column == 'Date':
+                # Dates are returned as the strings of the match data file, as written to the result files (the date
+                # filters use the Day column)
+                codes = get(self.date)
+                dates = self.date_categories.astype(object)[codes]
+                dates[np.asarray(codes) < 0] = np.nan
+                data[column] = dates
+            elif column in CATEGORY_COLUMNS:
+                name = CATEGORY_COLUMNS[column]
+                data[column] = pd.Categorical.from_codes(get(getattr(self, name)), categories=getattr(self, name + '_categories'))
+            elif column in FLOAT_COLUMNS and getattr(self, FLOAT_COLUMNS[column]) is not None:
+                data[column] = get(getattr(self, FLOAT_COLUMNS[column]))
+        return pd.DataFrame(data, index=None if rows is None else pd.Index(rows))
+
+    def hash_rows(self, start, end):
+        """
+        Hashes the matches in positions start to end of the store. The hash does not depend on the encoding of the
+        store, e.g., on the player ids, which change when players are added, so that it can be compared with the hash
+        of the same matches taken before matches were added to the match data file.
+
+        Parameters:
+        - start (int): Position of the first match
+        - end (int): Position after the last match
+
+        Returns:
+        - digest (str): Hex digest of the matches
+        """
+        h = hashlib.sha256()
+        h.update(np.ascontiguousarray(self.day[start:end], dtype=np.int32).tobytes())
+
+        def update_codes(codes, categories):
+            # Each code is replaced by the hash of its player or category, with 0 for missing values
+            codes = np.asarray(codes[start:end], dtype=np.int64)
+            category_hashes = np.append(pd.util.hash_array(np.asarray(categories, dtype=object)), np.uint64(0))
+            h.update(category_hashes[np.where(codes >= 0, codes, len(categories))].tobytes())
+
+        for name in PLAYER_COLUMNS.values():
+            update_codes(getattr(self, name), self.players)
+        for name in CATEGORY_COLUMNS.values():
+            update_codes(getattr(self, name), getattr(self, name + '_categories'))
+        for name in FLOAT_COLUMNS.values():
+            values = getattr(self, name)
+            if values is not None:
+                h.update(name.encode())
+                h.update(np.ascontiguousarray(values[start:end], dtype=np.float64).tobytes())
+        return h.hexdigest()
+
+def date_to_day(date):
+    # Day number of a date given in YYYY-MM-DD format
+    return int(np.datetime64(date, 'D').astype(np.int64))
+
+def get_store_path(dataset):
+    directory = os.path.dirname(os.path.abspath(DATASET_FILES[dataset]))
+    return os.path.join(directory, STORE_DIR, dataset)
+
+def encode_categories(values):
+    # Integer codes into the sorted unique values, with -1 for missing values
+    codes, categories = pd.factorize(pd.Series(values, dtype=object), sort=True)
+    return codes.astype(np.int16 if len(categories) < np.iinfo(np.int16).max else np.int32), np.array([str(c) for c in categories], dtype=str)
+
+def build_match_store(dataset):
+    """
+    Encodes the match data of a dataset and writes it to the store folder as one .npy file per array.
+
+    Parameters:
+    - dataset (str): 'atp', 'wta' or 'test'
+    """
+    df = load_matches(dataset, ANALYSIS_COLUMNS)
+    arrays = {}
+
+    # Dictionary of all players, sorted by name, and the id of each player of each match
+    players = np.unique(np.concatenate([df[column].dropna().astype(str).to_numpy() for column in PLAYER_COLUMNS]))
+    arrays['players'] = players.astype(str)
+    for column, name in PLAYER_COLUMNS.items():
+        ids = np.searchsorted(players, df[column].astype(str).to_numpy()).astype(np.int32)
+        ids[df[column].isna().to_numpy()] = -1
+        arrays[name] = ids
+
+    # Day number of each match (days since 1970-01-01)
+    dates = pd.to_datetime(df['Date'], format=DATE_FORMATS[dataset])
+    arrays['day'] = (dates.to_numpy().astype('datetime64[D]').astype(np.int64)).astype(np.int32)
+
+    for column, name in CATEGORY_COLUMNS.items():
+        arrays[name], arrays[name + '_categories'] = encode_categories(df[column] if column in df else np.full(len(df), np.nan))
+    for column, name in FLOAT_COLUMNS.items():
+        if column in df:
+            arrays[name] = df[column].to_numpy(dtype=np.float64)
+    arrays['source'] = get_source_signature(DATASET_FILES[dataset])
+    write_array_folder(get_store_path(dataset), arrays)
+
+def write_array_folder(path, arrays):
+    """
+    Writes arrays to a folder as one .npy file per array, replacing the folder if it exists. The files are written
+    to a new folder which is then swapped into place, so that a reader (e.g., a worker process of a sweep) never
+    maps a partially written folder. A build id is added to the arrays so that a reader can tell that the folder was
+    replaced while it was mapping the files, see read_array_folder.
+
+    Parameters:
+    - path (str): Path of the folder
+    - arrays (dict): Arrays to write, keyed by name
+    """
+    # The temporary folder is only written by this process, and is left over only if a previous build was interrupted
+    tmp_path = path + '.tmp' + str(os.getpid())
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    build = str(os.getpid()) + '.' + str(time.time_ns())
+    for name, values in dict(arrays, build=build).items():
+        np.save(os.path.join(tmp_path, name + '.npy'), values)
+
+    # os.replace can only replace a folder that is empty, so the old folder is moved aside first and removed after
+    # the swap. Files of the old folder that are mapped by a reader stay valid until the reader closes them
+    old_path = tmp_path + '.old'
+    try:
+        os.replace(path, old_path)
+    except FileNotFoundError:
+        pass
+    try:
+        os.replace(tmp_path, path)
+    except OSError:
+        # Another process has put its folder in place in the meantime, written from the same source
+        shutil.rmtree(tmp_path, ignore_errors=True)
+    shutil.rmtree(old_path, ignore_errors=True)
+
+def read_array_folder(path):
+    """
+    Memory-maps the .npy files of a folder written by write_array_folder.
+
+    Parameters:
+    - path (str): Path of the folder
+
+    Returns:
+    - arrays (dict): The arrays, memory-mapped read-only and keyed by name, or None if the folder was missing or
+      replaced while its files were mapped, in which case it should be read again
+    """
+    build_path = os.path.join(path, 'build.npy')
+    try:
+        build = str(np.load(build_path))
+        arrays = {}
+        for name in os.listdir(path):
+            if name.endswith('.npy'):
+                arrays[name[:-len('.npy')]] = np.load(os.path.join(path, name), mmap_mode='r')
+        if str(np.load(build_path)) != build:
+            return None
+    except FileNotFoundError:
+        return None
+    return arrays
+
+def is_array_folder_current(path, csv_path):
+    # Whether a folder written by write_array_folder exists and was written from the current version of a csv file
+    try:
+        return os.path.exists(os.path.join(path, 'build.npy')) and is_source_unchanged(csv_path, np.load(os.path.join(path, 'source.npy')))
+    except FileNotFoundError:
+        return False
+
+def load_match_store(dataset):
+    """
+    Memory-maps the match store of a dataset, building it first if it does not exist or the match data file has changed.
+
+    Parameters:
+    - dataset (str): 'atp', 'wta' or 'test'
+
+    Returns:
+    - store (MatchStore): The match store, with its arrays memory-mapped read-only
+    """
+    store_path = get_store_path(dataset)
+    while True:
+        if not is_array_folder_current(store_path, DATASET_FILES[dataset]):
+            build_match_store(dataset)
+        arrays = read_array_folder(store_path)
+        if arrays is not None:
+            return MatchStore(dataset, arrays)
@@ -0,0 +1,207 @@
+"""
+Adjustment of p-values for multiple comparisons, with the same methods and results as R's stats::p.adjust
+(which the archived runs-test scripts called through rpy2): bonferroni, holm, hochberg, hommel, BH (or fdr) and BY.
+
+Run as a script, it adjusts the p-values of several result files together, e.g., the outputs of the scenarios of a
+sweep that are to be treated as one family of tests, and writes the adjusted p-values to each file:
+    python p_adjust.py -p BH bogey_results_output_atp_odds_grandslam.csv bogey_results_output_atp_odds_nongrandslam.csv
+Only the p-value column of each file is held in memory, and the files are rewritten one row at a time.
+"""
+
+import argparse
+import array
+import csv
+import math
+import os
+import numpy as np
+
+P_ADJUST_METHODS = ['holm', 'hochberg', 'hommel', 'bonferroni', 'BH', 'BY', 'fdr', 'none']
+
+def _hommel_sorted(p):
+    """
+    Hommel adjusted p-values of p-values sorted in increasing order.
+
+    R computes these with a loop over every subset size m that takes O(n^2) time. For each m, the Simes p-value of
+    the m largest p-values is c_m = m * min_j p_(n-m+j) / j, which is m times the smallest slope from the point
+    (n-m, 0) to the points (k, p_(k)) with k > n-m. These slopes are found on the lower convex hull of the points,
+    which is built from right to left as m increases, so that all the c_m are found in O(n log n) time. The adjusted
+    p-value of the r-th smallest p-value is then the maximum over m of min(m * p_(r), c_m) (with p_(n-m+1) in place
+    of p_(r) for m > n-r+1), which is taken for all r at once.
+
+    Parameters:
+    - p (array): P-values, sorted in increasing order
+
+    Returns:
+    - adjusted (array): Adjusted p-values, in the same order
+    """
+    n = len(p)
+    if n <= 1:
+        return p.copy()
+    values = p.tolist()
+
+    # Lower convex hull of the points (k, p_(k)) to the right of n-m, as 1-based indices k from right to left
+    hull = []
+    slope = np.empty(n)
+    argmin = np.empty(n, dtype=np.int64)
+    for m in range(1, n + 1):
+        s = n - m
+        k = s + 1
+        pk = values[k - 1]
+        while len(hull) >= 2:
+            b, c = hull[-1], hull[-2]
+            # Remove b if it is not below the line from the new point to c
+            if (b - k) * (values[c - 1] - pk) - (values[b - 1] - pk) * (c - k) <= 0:
+                hull.pop()
+            else:
+                break
+        hull.append(k)
+
+        # Smallest slope from (s, 0): the first hull vertex (from the left) whose right neighbour is not below the line
+        # from (s, 0) through it. Hull vertices from left to right are hull[-1], hull[-2], ..., hull[0]
+        lo, hi = 0, len(hull) - 1
+        while lo < hi:
+            mid = (lo + hi) // 2
+            v, w = hull[len(hull) - 1 - mid], hull[len(hull) - 2 - mid]
+            if (v - s) * values[w - 1] - values[v - 1] * (w - s) >= 0:
+                hi = mid
+            else:
+                lo = mid + 1
+        best = hull[len(hull) - 1 - lo]
+        argmin[m - 1] = best
+        slope[m - 1] = values[best - 1] / (best - s)
+
+    m = np.arange(1, n + 1)
+    # Simes p-value of the m largest p-values, calculated as in R
+    simes = (m * p[argmin - 1]) / (argmin - (n - m))
+    suffix_max = np.append(np.maximum.accumulate(simes[::-1])[::-1], -np.inf)
+
+    # For the r-th smallest p-value, min(m * p_(r), c_m) is m * p_(r) for the m up to the number of subsets whose
+    # smallest slope is at least p_(r) (the slopes decrease with m), and c_m for larger m
+    slope = np.minimum.accumulate(slope)
+    r = np.arange(1, n + 1)
+    n_above = n - np.searchsorted(slope[::-1], p, side='left')
+    m1 = np.minimum(n_above, n - r + 1)
+    return np.maximum(m1 * p, suffix_max[m1])
+
+def p_adjust(p, method='BH'):
+    """
+    Adjusts p-values for multiple comparisons, as R's p.adjust(p, method). Missing p-values are left missing and not
+    counted in the number of comparisons.
+
+    Parameters:
+    - p (array-like): P-values
+    - method (str): 'bonferroni', 'holm', 'hochberg', 'hommel', 'BH' (or 'fdr'), 'BY' or 'none'
+
+    Returns:
+    - adjusted (array): Adjusted p-values
+    """
+    if method not in P_ADJUST_METHODS:
+        raise ValueError('Unknown p-value adjustment method: ' + str(method) + ', must be one of ' + ', '.join(P_ADJUST_METHODS))
+    p = np.asarray(p, dtype=float)
+    adjusted = np.full(p.shape, np.nan)
+    valid = ~np.isnan(p)
+    values = p[valid]
+    n = len(values)
+    if n <= 1 or method == 'none':
+        adjusted[valid] = values
+        return adjusted
+    if n == 2 and method == 'hommel':
+        method = 'hochberg'
+
+    if method == 'bonferroni':
+        result = np.minimum(1, n * values)
+    elif method in ['holm', 'hommel']:
+        # Sort increasing, with ties in their original order as R's order()
+        order = np.argsort(values, kind='stable')
+        if method == 'holm':
+            i = np.arange(1, n + 1)
+            sorted_result = np.minimum(1, np.maximum.accumulate((n + 1 - i) * values[order]))
+        else:
+            sorted_result = _hommel_sorted(values[order])
+        result = np.empty(n)
+        result[order] = sorted_result
+    else:
+        # Sort decreasing, with ties in their original order as R's order(decreasing = TRUE)
+        order = np.argsort(-values, kind='stable')
+        i = np.arange(n, 0, -1)
+        if method == 'hochberg':
+            factor = (n + 1 - i)
+        elif method in ['BH', 'fdr']:
+            factor = n / i
+        else:
+            factor = math.fsum(1 / np.arange(1, n + 1)) * n / i
+        result = np.empty(n)
+        result[order] = np.minimum(1, np.minimum.accumulate(factor * values[order]))
+
+    adjusted[valid] = result
+    return adjusted
+
+def adjusted_column_name(column):
+    return column + '_adj'
+
+def read_pvalue_column(filename, column):
+    # Reads one column of p-values from a csv file, one row at a time
+    pvalues = array.array('d')
+    with open(filename, encoding='UTF8', newline='') as f:
+        reader = csv.reader(f)
+        k = next(reader).index(column)
+        for row in reader:
+            pvalues.append(float(row[k]) if row[k] != '' else np.nan)
+    return np.frombuffer(pvalues, dtype=float)
+
+def write_adjusted_column(filename, column, adjusted):
+    """
+    Writes adjusted p-values to a csv file, replacing its adjusted p-value column or adding it as the last column.
+    The file is rewritten one row at a time, keeping its line endings.
+
+    Parameters:
+    - filename (str): Path of the csv file
+    - column (str): Name of the p-value column that was adjusted
+    - adjusted (array): Adjusted p-value of each row of the file
+    """
+    with open(filename, encoding='UTF8', newline='') as f:
+        first_line = f.readline()
+    lineterminator = '\r\n' if first_line.endswith('\r\n') else '\n'
+
+    tmp_filename = filename + '.tmp'
+    with open(filename, encoding='UTF8', newline='') as f, open(tmp_filename, 'w', encoding='UTF8', newline='') as out:
+        reader = csv.reader(f)
+        writer = csv.writer(out, lineterminator=lineterminator)
+        header = next(reader)
+        name = adjusted_column_name(column)
+        k = header.index(name) if name in header else None
+        writer.writerow(header if k is not None else header + [name])
+        for row, value in zip(reader, adjusted.tolist()):
+            if k is not None:
+                row[k] = value
+            else:
+                row.append(value)
+            writer.writerow(row)
+    os.replace(tmp_filename, filename)
+
+def merge_adjusted_pvalues(filenames, method='BH', column='p_value_fisher'):
+    """
+    Adjusts the p-values of several result files together, as one family of tests, and writes the adjusted p-values
+    to each file. Only the p-value columns are held in memory.
+
+    Parameters:
+    - filenames (list): Paths of the result (or metrics) csv files
+    - method (str): P-value adjustment method, as in p_adjust
+    - column (str): Name of the p-value column (default = p_value_fisher)
+    """
+    pvalues = [read_pvalue_column(filename, column) for filename in filenames]
+    adjusted = p_adjust(np.concatenate(pvalues) if pvalues else np.array([]), method)
+    bounds = np.cumsum([0] + [len(values) for values in pvalues])
+    for filename, start, end in zip(filenames, bounds[:-1], bounds[1:]):
+        write_adjusted_column(filename, column, adjusted[start:end])
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('filenames', type=str, nargs='+', help='result files whose p-values are adjusted together')
+    parser.add_argument('-p', '--p_adj_method', type=str, required=False, choices=P_ADJUST_METHODS, default='BH', help='p-value adjustment for multiple comparisons method (default = BH)')
+    parser.add_argument('-c', '--column', type=str, required=False, default='p_value_fisher', help='name of the p-value column (default = p_value_fisher)')
+    args = parser.parse_args()
+    merge_adjusted_pvalues(args.filenames, args.p_adj_method, args.column)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""
+Player-centric adjacency index of the matches of a dataset, for one-vs-all and head-to-head queries.
+
+The index is stored in compressed sparse row (CSR) form: the players are numbered in order of first appearance, and
+the matches of the k-th player are positions offsets[k] to offsets[k + 1] of the rows array (positions of the
+matches in the DataFrame, in ascending order) and of the opponents array (number of the opponent in each match).
+Looking up the matches of a player, or of a pair of players, then takes time proportional to the player's number of
+matches instead of a scan over the whole table.
+"""
+
+import numpy as np
+import pandas as pd
+
+class PlayerIndex:
+    """
+    CSR adjacency index from each player to the positions of their matches and their opponents.
+    """
+
+    def __init__(self, df):
+        """
+        Builds the index of the matches of a DataFrame.
+
+        Parameters:
+        - df (DataFrame): DataFrame containing the matches, with the players in the P_i and P_j columns
+        """
+        n_matches = len(df)
+        codes, players = pd.factorize(np.concatenate([df['P_i'].to_numpy(dtype=object), df['P_j'].to_numpy(dtype=object)]))
+        # Each match appears once for each of its players, with the other player as the opponent
+        rows = np.tile(np.arange(n_matches, dtype=np.int64), 2)
+        opponents = np.concatenate([codes[n_matches:], codes[:n_matches]])
+
+        order = np.lexsort((rows, codes))
+        self.players = pd.Index(players)
+        self.offsets = np.zeros(len(players) + 1, dtype=np.int64)
+        self.offsets[1:] = np.cumsum(np.bincount(codes, minlength=len(players)))
+        self.rows = rows[order]
+        self.opponents = opponents[order]
+
+    def __len__(self):
+        return len(self.players)
+
+    def get_code(self, player):
+        # Number of the player in the index, or -1 if the player has no matches
+        return self.players.get_loc(player) if player in self.players else -1
+
+    def get_rows(self, player, opponent=None):
+        """
+        Looks up the matches of a player, or of a pair of players.
+
+        Parameters:
+        - player (str): Player name
+        - opponent (str): Name of the other player of the pair (default = None, the matches against every opponent)
+
+        Returns:
+        - rows (array): Positions in the indexed DataFrame of the matches, in ascending order
+        """
+        code = self.get_code(player)
+        if code < 0:
+            return np.array([], dtype=np.int64)
+        rows = self.rows[self.offsets[code]:self.offsets[code + 1]]
+        if opponent is None:
+            return rows
+        opponents = self.opponents[self.offsets[code]:self.offsets[code + 1]]
+        return rows[opponents == self.get_code(opponent)]
@@ -1,82 +1,147 @@
+import argparse
+import glob
+import os
+import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
 from matplotlib import rcParams
+from plot_expected_actual_win_data import get_significant_pairs
+
+# pyplot is only imported by the functions that draw, so that a script importing this module, e.g., plot_figures.py,
+# can select the backend first
 
 # Set global font to Times New Roman
 rcParams['font.family'] = 'serif'
 rcParams['font.serif'] = ['Times New Roman']
 
-# Define the dataset
-data = {
-    'Dataset': ['ATP Elo', 'ATP Elo', 'ATP Odds', 'ATP Odds', 'ATP Elo Grandslam', 'ATP Elo Grandslam', 'ATP Elo Non-Grand slam', 'ATP Elo Non-Grand slam',
-                'ATP Odds Grandslam', 'ATP Odds Grandslam', 'ATP Odds Non-Grand slam', 'ATP Odds Non-Grand slam', 'WTA Elo', 'WTA Elo', 'WTA Odds', 'WTA Odds',
-                'WTA Elo Grandslam', 'WTA Elo Grandslam', 'WTA Elo Non-Grand slam', 'WTA Elo Non-Grand slam', 'WTA Odds Grandslam', 'WTA Odds Grandslam',
-                'WTA Odds Non-Grand slam', 'WTA Odds Non-Grand slam'],
-    'Player pair type': ['Pair w/o bogey player', 'Pair w/ bogey player', 'Pair w/o bogey player', 'Pair w/ bogey player',
-                         'Pair w/o bogey player', 'Pair w/ bogey player', 'Pair w/o bogey player', 'Pair w/ bogey player',
-                         'Pair w/o bogey player', 'Pair w/ bogey player', 'Pair w/o bogey player', 'Pair w/ bogey player',
-                         'Pair w/o bogey player', 'Pair w/ bogey player', 'Pair w/o bogey player', 'Pair w/ bogey player',
-                         'Pair w/o bogey player', 'Pair w/ bogey player', 'Pair w/o bogey player', 'Pair w/ bogey player',
-                         'Pair w/o bogey player', 'Pair w/ bogey player', 'Pair w/o bogey player', 'Pair w/ bogey player'],
-    'Average Expected Win': [0.6952, 0.704, 0.6787, 0.708, 0.7333, '-', 0.6886, 0.715, 0.7358, 0.6904, 0.6676, 0.7041, 0.6887, 0.7322, 0.6722, 0.6929,
-                             0.7244, '-', 0.6807, 0.7217, 0.7133, '-', 0.6626, 0.6677],
-    'Average Actual wins': [0.6665, 0.0172, 0.7034, 0, 0.7329, '-', 0.6497, 0.0102, 0.7741, 0, 0.6841, 0, 0.6592, 0.0282, 0.6925, 0, 0.7043, '-', 0.6475, 0.0567,
-                            0.7331, '-', 0.6814, 0],
-    'Average difference in Expected and Actual wins': [-0.0073, 0.6868, -0.0247, 0.708, 0.00044, '-', 0.0389, 0.7048, -0.0382, 0.6904, -0.0166, 0.7041,
-                                                       0.0295, 0.704, -0.0203, 0.6929, 0.02, '-', 0.0331, 0.665, -0.0198, '-', -0.0188, 0.6677]
-}
-
-# Create DataFrame
-df = pd.DataFrame(data)
-
-# Remove rows with missing values ('-')
-df = df.replace('-', pd.NA)
-df = df.dropna()
-
-# Convert columns to numeric
-df[['Average Expected Win', 'Average Actual wins', 'Average difference in Expected and Actual wins']] = df[
-    ['Average Expected Win', 'Average Actual wins', 'Average difference in Expected and Actual wins']].apply(pd.to_numeric)
-
-# Sort DataFrame by 'Dataset' column
-df = df.sort_values(by='Dataset')
-
-# Plot
-plt.figure(figsize=(14, 10))
-
-for pair_type, group in df.groupby('Player pair type'):
-    actual_wins = group['Average Actual wins']
-    expected_wins = group['Average Expected Win']
-    
-    plt.scatter(group['Dataset'], actual_wins, label=f'{pair_type} - Actual Wins', s=100)  # Increase marker size
-    plt.scatter(group['Dataset'], expected_wins, label=f'{pair_type} - Expected Wins', marker='x', s=100)  # Increase marker size
-    # Plotting the difference as line segments
-    # In the plotting loop
-    for i in range(len(group)):
-        plt.plot([group['Dataset'].iloc[i], group['Dataset'].iloc[i]], [actual_wins.iloc[i], expected_wins.iloc[i]], color='gray', linestyle='--')
-        
-        # Determine color and shift for the labels
-        if pair_type == 'Pair w/o bogey player':
-            color = 'red'
-            shift = 0.2  # Shift to the right
-        else:
-            color = 'blue'
-            shift = 0  # No shift
-        
-        # Get the x position based on the index in the group
-        x_pos = i + (0.1 if pair_type == 'Pair w/o bogey player' else 0)
-        
-        plt.text(x_pos, (actual_wins.iloc[i] + expected_wins.iloc[i]) / 2, 
-                f"{group['Average difference in Expected and Actual wins'].iloc[i]:.4f}", 
-                color=color, ha='left', va='center', fontsize=14)
-
-
-plt.xticks(rotation=90, fontsize=14)  # Increase font size for x-ticks
-plt.yticks(fontsize=14)  # Increase font size for y-ticks
-plt.xlabel('Dataset', fontsize=14)  # Increase font size for x-axis label
-plt.ylabel('Average Wins', fontsize=14)  # Increase font size for y-axis label
-# plt.title('Performance Metrics by Dataset and Player Pair Type', fontsize=16)  # Increase font size for title
-plt.legend(fontsize=12)  # Increase font size for legend
-
-plt.tight_layout()
-plt.savefig('avg_expected_win_plot.png')
-plt.show()
+parser = argparse.ArgumentParser()
+parser.add_argument('-i', '--input', type=str, nargs='+', required=False, default=None, help='result files of bogey_tennis_fisher.py to plot (default = all bogey_results_output_*.csv files in the current folder)')
+parser.add_argument('-a', '--alpha', type=float, required=False, default=0.1, help='largest p-value of the player pairs with a bogey player (default = 0.1)')
+parser.add_argument('--p_value', type=str, required=False, default='p_value_fisher', help='p-value column of the result files used to find the pairs with a bogey player, e.g., p_value_fisher_adj (default = p_value_fisher)')
+parser.add_argument('-o', '--output', type=str, required=False, default='avg_expected_win_plot.png', help='image file to save the figure to (default = avg_expected_win_plot.png)')
+parser.add_argument('--no_show', action='store_true', help='only save the figure, without showing it')
+
+# Labels of the grand slam options in the file names of the result files
+GRAND_SLAM_LABELS = {'grandslam': 'Grandslam', 'nongrandslam': 'Non-Grand slam'}
+
+def get_result_files(folder='.'):
+    # Result files of bogey_tennis_fisher.py in a folder, using the metrics file of a run only if it has no result file
+    filenames = sorted(glob.glob(os.path.join(folder, 'bogey_results_output_*.csv')))
+    return [filename for filename in filenames
+            if not filename.endswith('_metrics.csv') or filename[:-len('_metrics.csv')] + '.csv' not in filenames]
+
+def get_dataset_label(filename):
+    # Label of a result file, e.g., ATP Elo Non-Grand slam for bogey_results_output_atp_elo_nongrandslam.csv
+    name = os.path.basename(filename)[len('bogey_results_output_'):-len('.csv')]
+    if name.endswith('_metrics'):
+        name = name[:-len('_metrics')]
+    parts = name.split('_')
+    label = [parts[0].upper(), parts[1].capitalize()]
+    rest = parts[2:]
+    if rest and rest[0] in GRAND_SLAM_LABELS:
+        label.append(GRAND_SLAM_LABELS[rest[0]])
+        rest = rest[1:]
+    return ' '.join(label + rest)
+
+def get_pair_type_averages(results, dataset, alpha=0.1, p_value_column='p_value_fisher'):
+    """
+    Calculates the average share of the matches of a player pair that the favourite (the player with more expected
+    wins) was expected to win and won, for the pairs with and without a bogey player. A pair has a bogey player when
+    its p-value is at most alpha and the player with fewer expected wins won more of the matches.
+
+    Parameters:
+    - results (DataFrame): Rows of a result (or metrics) file of bogey_tennis_fisher.py
+    - dataset (str): Label of the result file
+    - alpha (float): Largest p-value of the pairs with a bogey player (default = 0.1)
+    - p_value_column (str): Column of the p-values (default = p_value_fisher)
+
+    Returns:
+    - averages (DataFrame): One row for each pair type with any pairs, with the columns Dataset, Player pair type,
+      Average Expected Win, Average Actual wins and Average difference in Expected and Actual wins
+    """
+    significant = get_significant_pairs(results, alpha, p_value_column)
+    bogey_pairs = set(significant.loc[significant['bogey_effect'] == 'Y', 'player_pair'])
+    has_bogey = (results['player1'] + ' vs ' + results['player2']).isin(bogey_pairs).to_numpy()
+
+    matches = (results['actual_wins_p1'] + results['actual_wins_p2']).to_numpy()
+    p1_favourite = (results['expected_wins_p1'] >= results['expected_wins_p2']).to_numpy()
+    expected = np.where(p1_favourite, results['expected_wins_p1'], results['expected_wins_p2']) / matches
+    actual = np.where(p1_favourite, results['actual_wins_p1'], results['actual_wins_p2']) / matches
+
+    rows = []
+    for pair_type, selected in [('Pair w/o bogey player', ~has_bogey), ('Pair w/ bogey player', has_bogey)]:
+        if selected.any():
+            rows.append({'Dataset': dataset, 'Player pair type': pair_type,
+                         'Average Expected Win': expected[selected].mean(),
+                         'Average Actual wins': actual[selected].mean(),
+                         'Average difference in Expected and Actual wins': (expected[selected] - actual[selected]).mean()})
+    return pd.DataFrame(rows, columns=['Dataset', 'Player pair type', 'Average Expected Win', 'Average Actual wins', 'Average difference in Expected and Actual wins'])
+
+def plot_pair_type_averages(df):
+    """
+    Plots the average expected and actual wins of the favourites of the pairs with and without a bogey player, and
+    their difference, for each result file.
+
+    Parameters:
+    - df (DataFrame): Averages of the result files, as returned by get_pair_type_averages
+
+    Returns:
+    - fig (Figure): The figure
+    """
+    import matplotlib.pyplot as plt
+
+    # Sort DataFrame by 'Dataset' column
+    df = df.sort_values(by='Dataset')
+
+    # Plot
+    fig = plt.figure(figsize=(14, 10))
+
+    for pair_type, group in df.groupby('Player pair type'):
+        actual_wins = group['Average Actual wins']
+        expected_wins = group['Average Expected Win']
+
+        plt.scatter(group['Dataset'], actual_wins, label=f'{pair_type} - Actual Wins', s=100)  # Increase marker size
+        plt.scatter(group['Dataset'], expected_wins, label=f'{pair_type} - Expected Wins', marker='x', s=100)  # Increase marker size
+        # Plotting the difference as line segments
+        # In the plotting loop
+        for i in range(len(group)):
+            plt.plot([group['Dataset'].iloc[i], group['Dataset'].iloc[i]], [actual_wins.iloc[i], expected_wins.iloc[i]], color='gray', linestyle='--')
+
+            # Determine color and shift for the labels
+            if pair_type == 'Pair w/o bogey player':
+                color = 'red'
+                shift = 0.2  # Shift to the right
+            else:
+                color = 'blue'
+                shift = 0  # No shift
+
+            # Get the x position based on the index in the group
+            x_pos = i + (0.1 if pair_type == 'Pair w/o bogey player' else 0)
+
+            plt.text(x_pos, (actual_wins.iloc[i] + expected_wins.iloc[i]) / 2,
+                    f"{group['Average difference in Expected and Actual wins'].iloc[i]:.4f}",
+                    color=color, ha='left', va='center', fontsize=14)
+
+
+    plt.xticks(rotation=90, fontsize=14)  # Increase font size for x-ticks
+    plt.yticks(fontsize=14)  # Increase font size for y-ticks
+    plt.xlabel('Dataset', fontsize=14)  # Increase font size for x-axis label
+    plt.ylabel('Average Wins', fontsize=14)  # Increase font size for y-axis label
+    # plt.title('Performance Metrics by Dataset and Player Pair Type', fontsize=16)  # Increase font size for title
+    plt.legend(fontsize=12)  # Increase font size for legend
+
+    plt.tight_layout()
+    return fig
+
+def main():
+    args = parser.parse_args()
+    filenames = args.input if args.input is not None else get_result_files()
+    df = pd.concat([get_pair_type_averages(pd.read_csv(filename), get_dataset_label(filename), args.alpha, args.p_value) for filename in filenames], ignore_index=True)
+
+    fig = plot_pair_type_averages(df)
+    fig.savefig(args.output)
+    if not args.no_show:
+        import matplotlib.pyplot as plt
+        plt.show()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+import argparse
+import json
+import multiprocessing
+import os
+import time
+from datetime import datetime
+import matplotlib
+# Render without a display, so that the figures can be made in worker processes and on servers
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import pandas as pd
+from match_data import get_source_signature, is_source_unchanged
+import plot_expected_actual_win_data as expected_actual
+import plot_bogey_results_output as pair_types
+
+# Batch rendering of the result figures directly from the result files of bogey_tennis_fisher.py: the expected
+# against actual wins difference of the significant player pairs of every result file, and the average expected and
+# actual wins of the pairs with and without a bogey player over all the result files. The figures are rendered in
+# worker processes and saved to files, and a figure is only rendered again when its result files, the plotting code or
+# the options have changed since it was last rendered, as recorded in a manifest in the output folder.
+parser = argparse.ArgumentParser()
+parser.add_argument('-i', '--input_dir', type=str, required=False, default='.', help='folder with the result files (default = current folder)')
+parser.add_argument('-o', '--output_dir', type=str, required=False, default='figures', help='folder to save the figures to (default = figures)')
+parser.add_argument('-a', '--alpha', type=float, required=False, default=0.1, help='largest p-value of the significant player pairs (default = 0.1)')
+parser.add_argument('--p_value', type=str, required=False, default='p_value_fisher', help='p-value column of the result files used to select the player pairs, e.g., p_value_fisher_adj (default = p_value_fisher)')
+parser.add_argument('-f', '--format', type=str, required=False, choices=['png', 'pdf', 'svg'], default='png', help='image format of the figures (default = png)')
+parser.add_argument('--dpi', type=int, required=False, default=150, help='resolution of png figures (default = 150)')
+parser.add_argument('--force', action='store_true', help='render every figure, even if its inputs have not changed')
+parser.add_argument('-w', '--workers', type=int, required=False, default=1, help='number of worker processes used to render the figures (default = 1, no worker processes)')
+
+MANIFEST_FILENAME = 'figures_manifest.json'
+
+def get_figure_jobs(args):
+    """
+    Lists the figures of the result files in the input folder.
+
+    Parameters:
+    - args (Namespace): Options of the run
+
+    Returns:
+    - jobs (list): One dict per figure, with its kind, output file, input files (the result files and the plotting
+      code) and the options it is rendered with
+    """
+    filenames = pair_types.get_result_files(args.input_dir)
+    settings = {'alpha': args.alpha, 'p_value': args.p_value, 'format': args.format, 'dpi': args.dpi}
+    jobs = []
+    for filename in filenames:
+        name = os.path.basename(filename)[len('bogey_results_output_'):-len('.csv')]
+        jobs.append({'kind': 'expected_actual_wins', 'results': [filename],
+                     'figure': os.path.join(args.output_dir, 'expected_actual_wins_' + name + '.' + args.format),
+                     'inputs': [filename, expected_actual.__file__], 'settings': settings})
+    if filenames:
+        jobs.append({'kind': 'pair_type_averages', 'results': filenames,
+                     'figure': os.path.join(args.output_dir, 'avg_expected_win_plot.' + args.format),
+                     'inputs': filenames + [expected_actual.__file__, pair_types.__file__], 'settings': settings})
+    return jobs
+
+def read_manifest(filename):
+    if not os.path.exists(filename):
+        return {}
+    with open(filename) as f:
+        return json.load(f)
+
+def write_manifest(manifest, filename):
+    # Write to a temporary file first, so that an interrupted run never leaves a partial manifest behind
+    tmp_filename = filename + '.tmp'
+    with open(tmp_filename, 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp_filename, filename)
+
+def is_figure_unchanged(job, entry):
+    """
+    Checks whether a figure was rendered from the same inputs and options as the job.
+
+    Parameters:
+    - job (dict): Figure job, as returned by get_figure_jobs
+    - entry (dict): Manifest entry of the figure, or None if it has never been rendered
+
+    Returns:
+    - unchanged (bool): True if the figure does not have to be rendered again
+    """
+    if entry is None or entry['settings'] != job['settings'] or sorted(entry['inputs']) != sorted(job['inputs']):
+        return False
+    # A figure without any pairs to plot is recorded without a file
+    if entry['rendered'] and not os.path.exists(job['figure']):
+        return False
+    return all(os.path.exists(path) and is_source_unchanged(path, signature) for path, signature in entry['inputs'].items())
+
+def render_figure(job):
+    """
+    Renders a figure from its result files and saves it.
+
+    Parameters:
+    - job (dict): Figure job, as returned by get_figure_jobs
+
+    Returns:
+    - rendered (bool): Whether the figure was saved, False if there were no player pairs to plot
+    """
+    settings = job['settings']
+    if job['kind'] == 'expected_actual_wins':
+        df = expected_actual.get_significant_pairs(pd.read_csv(job['results'][0]), settings['alpha'], settings['p_value'])
+        if len(df) == 0:
+            # Remove the figure of a previous run that had significant pairs
+            if os.path.exists(job['figure']):
+                os.remove(job['figure'])
+            return False
+        fig = expected_actual.plot_expected_actual_wins(df)
+    else:
+        df = pd.concat([pair_types.get_pair_type_averages(pd.read_csv(filename), pair_types.get_dataset_label(filename), settings['alpha'], settings['p_value'])
+                        for filename in job['results']], ignore_index=True)
+        fig = pair_types.plot_pair_type_averages(df)
+
+    # Save to a temporary file first, so that an interrupted run never leaves a partial figure behind
+    tmp_filename = job['figure'] + '.tmp'
+    fig.savefig(tmp_filename, format=settings['format'], dpi=settings['dpi'])
+    plt.close(fig)
+    os.replace(tmp_filename, job['figure'])
+    return True
+
+def main():
+    args = parser.parse_args()
+    start = time.time()
+    os.makedirs(args.output_dir, exist_ok=True)
+    manifest_filename = os.path.join(args.output_dir, MANIFEST_FILENAME)
+    manifest = read_manifest(manifest_filename)
+
+    jobs = get_figure_jobs(args)
+    todo = [job for job in jobs if args.force or not is_figure_unchanged(job, manifest.get(job['figure']))]
+    # The signatures of the inputs are taken before rendering, so that a result file rewritten during the run is
+    # rendered again next time
+    signatures = [{path: [str(value) for value in get_source_signature(path)] for path in job['inputs']} for job in todo]
+
+    if args.workers > 1 and len(todo) > 1:
+        with multiprocessing.get_context().Pool(min(args.workers, len(todo))) as pool:
+            rendered = pool.map(render_figure, todo, chunksize=1)
+    else:
+        rendered = [render_figure(job) for job in todo]
+
+    for job, inputs, job_rendered in zip(todo, signatures, rendered):
+        manifest[job['figure']] = {'inputs': inputs, 'settings': job['settings'], 'rendered': job_rendered}
+    write_manifest(manifest, manifest_filename)
+
+    empty = [job['figure'] for job, job_rendered in zip(todo, rendered) if not job_rendered]
+    print(datetime.now().strftime('%d/%m/%Y %H:%M:%S') + ' ' + str(len(todo) - len(empty)) + ' figures rendered to ' + args.output_dir + ', '
+          + str(len(jobs) - len(todo)) + ' unchanged, ' + str(len(empty)) + ' without significant player pairs, in ' + str(round(time.time() - start, 1)) + 's')
+
+if __name__ == '__main__':
+    main()
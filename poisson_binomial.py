@@ -0,0 +1,78 @@
+"""
+Batched exact Poisson-binomial test of the wins of player pairs.
+
+The number of matches a player wins against an opponent is a sum of independent Bernoulli variables with the
+pre-match win probabilities of the matches, so under the null hypothesis that the probabilities are right it follows
+a Poisson-binomial distribution. The distribution of every pair is computed exactly with the recursive convolution
+of one match at a time, run for all the pairs of a bucket at once: pairs are bucketed by their number of matches
+(up to the next power of two) and padded with matches that player 1 never wins, which leave the distribution
+unchanged. Head-to-heads are short, so this is a few array operations per bucket, and unlike an FFT convolution it
+keeps the small tail probabilities exact.
+"""
+
+import numpy as np
+
+# Tolerance used when comparing the distances of win counts from the expected wins
+DISTANCE_TOLERANCE = 1e-9
+
+def poisson_binomial_pmf(probs):
+    """
+    Calculates the Poisson-binomial distributions of a batch of pairs with the same (padded) number of matches.
+
+    Parameters:
+    - probs (array): Array of shape (n_pairs, n_matches) of the win probabilities of player 1 in each match
+
+    Returns:
+    - pmf (array): Array of shape (n_pairs, n_matches + 1), where pmf[k, s] is the probability that player 1 of the
+      k-th pair wins s matches
+    """
+    n_pairs, n_matches = probs.shape
+    pmf = np.zeros((n_pairs, n_matches + 1))
+    pmf[:, 0] = 1.0
+    for j in range(n_matches):
+        p = probs[:, j:j + 1]
+        # Player 1 either loses match j, keeping the number of wins, or wins it
+        pmf[:, 1:j + 2] = pmf[:, 1:j + 2] * (1 - p) + pmf[:, :j + 1] * p
+        pmf[:, :1] *= 1 - p
+    return pmf
+
+def poisson_binomial_test_batch(probs, matches, actual):
+    """
+    Performs the exact two-sided Poisson-binomial test of the wins of player 1 of every pair: the p-value is the
+    probability of a number of wins at least as far from the expected wins as the actual wins.
+
+    Parameters:
+    - probs (array): Win probabilities of player 1 in the matches of the pairs, laid out pair after pair
+    - matches (array): Number of matches of each pair
+    - actual (array): Actual wins of player 1 of each pair
+
+    Returns:
+    - pvalue (array): Two-sided p-value of each pair
+    """
+    probs = np.asarray(probs, dtype=float)
+    matches = np.asarray(matches, dtype=np.int64)
+    actual = np.asarray(actual, dtype=np.int64)
+    pvalue = np.ones(len(matches))
+    if len(matches) == 0:
+        return pvalue
+
+    offsets = np.zeros(len(matches) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(matches)
+    # Bucket the pairs by their number of matches, rounded up to a power of two
+    buckets = np.ceil(np.log2(np.maximum(matches, 1))).astype(np.int64)
+    for bucket in np.unique(buckets):
+        pairs = np.flatnonzero(buckets == bucket)
+        width = 1 << int(bucket)
+        # Pad the matches of each pair up to the width of the bucket with matches of probability zero
+        column = np.arange(width)
+        in_pair = column[None, :] < matches[pairs, None]
+        positions = np.where(in_pair, offsets[pairs, None] + column[None, :], 0)
+        padded = np.where(in_pair, probs[positions] if len(probs) else 0.0, 0.0)
+
+        pmf = poisson_binomial_pmf(padded)
+        expected = padded.sum(axis=1)
+        wins = np.arange(width + 1)
+        distance = np.abs(actual[pairs] - expected) - DISTANCE_TOLERANCE
+        extreme = np.abs(wins[None, :] - expected[:, None]) >= distance[:, None]
+        pvalue[pairs] = np.minimum((pmf * extreme).sum(axis=1), 1.0)
+    return pvalue
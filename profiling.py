@@ -0,0 +1,104 @@
+"""
+Per-stage timing and memory profiling for the --profile option of bogey_tennis_fisher.py and the plotting scripts.
+
+Each stage of a run is wrapped in profiler.stage(name), which records its number of calls, wall time, CPU time and,
+with tracemalloc, the peak memory allocated by Python while it ran. The totals are written as a JSON report next to
+the output file. When profiling is off, stage() returns a context manager that does nothing.
+"""
+
+import contextlib
+import cProfile
+import json
+import time
+import tracemalloc
+
+class Profiler:
+    """
+    Collects the calls, wall time, CPU time and peak traced memory of the named stages of a run.
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.stages = {}
+        self.hot_loop_filename = None
+        # Peak traced memory of the whole run, since the peak is reset at the start of every stage
+        self.peak = 0
+        # Peak traced memory of the enclosing stages, recorded when a nested stage resets the peak
+        self._stack = []
+        self.start_wall = time.perf_counter()
+        self.start_cpu = time.process_time()
+        if enabled and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextlib.contextmanager
+    def _profile_stage(self, name):
+        # Peak memory of the enclosing stage so far, before the peak is reset for this stage
+        if self._stack:
+            self._stack[-1] = max(self._stack[-1], tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+        self._stack.append(0)
+        start_wall = time.perf_counter()
+        start_cpu = time.process_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - start_wall
+            cpu = time.process_time() - start_cpu
+            peak = max(self._stack.pop(), tracemalloc.get_traced_memory()[1])
+            # The enclosing stage includes the peak of this stage
+            if self._stack:
+                self._stack[-1] = max(self._stack[-1], peak)
+            self.peak = max(self.peak, peak)
+            stage = self.stages.setdefault(name, {'calls': 0, 'wall_sec': 0.0, 'cpu_sec': 0.0, 'peak_memory_mb': 0.0})
+            stage['calls'] += 1
+            stage['wall_sec'] += wall
+            stage['cpu_sec'] += cpu
+            stage['peak_memory_mb'] = max(stage['peak_memory_mb'], peak / (1024 * 1024))
+
+    def stage(self, name):
+        """
+        Context manager that profiles one call of a stage.
+
+        Parameters:
+        - name (str): Name of the stage. Calls of the same stage are added together in the report
+        """
+        if not self.enabled:
+            return contextlib.nullcontext()
+        return self._profile_stage(name)
+
+    @contextlib.contextmanager
+    def hot_loop(self, filename=None):
+        # Runs the enclosed code under cProfile and dumps its statistics to filename, if a filename is given
+        if filename is None:
+            yield
+            return
+        self.hot_loop_filename = filename
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            profile.dump_stats(filename)
+
+    def write_report(self, filename, settings=None):
+        """
+        Writes the profile of the run as a JSON report. Does nothing when profiling is off.
+
+        Parameters:
+        - filename (str): Path of the JSON report
+        - settings (dict): Options of the run, included in the report
+        """
+        if not self.enabled:
+            return
+        report = {
+            'settings': settings,
+            'total_wall_sec': time.perf_counter() - self.start_wall,
+            'total_cpu_sec': time.process_time() - self.start_cpu,
+            'peak_memory_mb': max(self.peak, tracemalloc.get_traced_memory()[1]) / (1024 * 1024),
+            'stages': self.stages,
+        }
+        if self.hot_loop_filename is not None:
+            report['hot_loop_profile'] = self.hot_loop_filename
+        with open(filename, 'w') as f:
+            json.dump(report, f, indent=2)
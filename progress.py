@@ -0,0 +1,106 @@
+"""
+Progress and throughput reporting for the loop over the player pairs.
+
+Instead of printing a line for every pair, the progress is reported at most once per interval (and once at the
+end), with the throughput in pairs and matches per second, the estimated time remaining, and the numbers of pairs
+scored, skipped (copied from a previous or interrupted run) and significant. Reports are printed as text, or as
+JSON lines for job dashboards. With reporting turned off, update() only increments the counters.
+"""
+
+import json
+import sys
+import time
+
+PROGRESS_MODES = ['text', 'json', 'off']
+
+def format_duration(seconds):
+    # Duration in H:MM:SS format
+    seconds = int(round(seconds))
+    return '%d:%02d:%02d' % (seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+class Progress:
+    """
+    Counts the pairs and matches processed by a run, and reports them at most once every interval seconds.
+    """
+
+    def __init__(self, total_pairs, total_matches, mode='text', interval=5.0, name='', stream=None):
+        self.total_pairs = total_pairs
+        self.total_matches = total_matches
+        self.mode = mode
+        self.interval = interval
+        self.name = name
+        self.stream = stream if stream is not None else sys.stdout
+        self.pairs = 0
+        self.matches = 0
+        self.scored_matches = 0
+        self.scored = 0
+        self.skipped = 0
+        self.significant = 0
+        self.start = time.monotonic()
+        self.next_report = self.start + interval
+
+    def update(self, matches, scored=True, significant=False):
+        """
+        Records one processed pair, and reports the progress if the interval has passed since the last report.
+
+        Parameters:
+        - matches (int): Number of matches of the pair
+        - scored (bool): True if the pair was scored, False if its row was copied from a previous run
+        - significant (bool): True if the pair's adjusted p-value is significant
+        """
+        self.pairs += 1
+        self.matches += matches
+        if scored:
+            self.scored += 1
+            self.scored_matches += matches
+        else:
+            self.skipped += 1
+        if significant:
+            self.significant += 1
+        if self.mode != 'off':
+            now = time.monotonic()
+            if now >= self.next_report:
+                self.next_report = now + self.interval
+                self.report(now)
+
+    def finish(self):
+        # Reports the final counts of the run
+        if self.mode != 'off':
+            self.report(time.monotonic(), event='done')
+
+    def get_state(self, now, event='progress'):
+        elapsed = now - self.start
+        # Throughput is measured over the scored pairs, since copying the rows of skipped pairs takes almost no time
+        pairs_per_sec = self.scored / elapsed if elapsed > 0 else 0.0
+        matches_per_sec = self.scored_matches / elapsed if elapsed > 0 else 0.0
+        remaining = self.total_pairs - self.pairs
+        eta = remaining / pairs_per_sec if pairs_per_sec > 0 else None
+        return {
+            'event': event,
+            'name': self.name,
+            'time': time.time(),
+            'elapsed_sec': round(elapsed, 3),
+            'pairs_done': self.pairs,
+            'pairs_total': self.total_pairs,
+            'matches_done': self.matches,
+            'matches_total': self.total_matches,
+            'scored': self.scored,
+            'skipped': self.skipped,
+            'significant': self.significant,
+            'pairs_per_sec': round(pairs_per_sec, 3),
+            'matches_per_sec': round(matches_per_sec, 3),
+            'eta_sec': round(eta, 3) if eta is not None else None,
+        }
+
+    def report(self, now, event='progress'):
+        state = self.get_state(now, event)
+        if self.mode == 'json':
+            line = json.dumps(state)
+        else:
+            percentage = (self.pairs / self.total_pairs) * 100 if self.total_pairs > 0 else 100.0
+            line = (str(self.pairs) + ' of ' + str(self.total_pairs) + ' player pairs (' + str(round(percentage, 1)) + '% complete), '
+                    + str(round(state['pairs_per_sec'], 1)) + ' pairs/s, ' + str(round(state['matches_per_sec'], 1)) + ' matches/s, '
+                    + ('ETA ' + format_duration(state['eta_sec']) if event == 'progress' and state['eta_sec'] is not None else 'elapsed ' + format_duration(state['elapsed_sec'])) + ', '
+                    + str(self.scored) + ' scored, ' + str(self.skipped) + ' skipped, ' + str(self.significant) + ' significant')
+        self.stream.write(line + '\n')
+        self.stream.flush()
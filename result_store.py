@@ -0,0 +1,123 @@
+"""
+Typed storage of the list-valued columns of a bogey result file.
+
+The result csv files hold the match results, upset results and match dates of each player pair as the text of
+Python lists, which have to be parsed back with ast.literal_eval. Next to each result file, bogey_tennis_fisher.py
+also writes a .npz file with the same information as flat typed arrays with one value per match, grouped by pair:
+the matches of the k-th pair of the result file are positions offsets[k] to offsets[k + 1] of the match arrays.
+"""
+
+import os
+import numpy as np
+import pandas as pd
+
+def get_result_lists_path(filename):
+    # Path of the typed list file written next to a result csv file
+    return os.path.splitext(filename)[0] + '_lists.npz'
+
+def write_result_lists(filename, player1, player2, rows, day, p1_won, is_upset):
+    """
+    Writes the list-valued columns of a result file as typed arrays.
+
+    Parameters:
+    - filename (str): Path of the result csv file
+    - player1 (list): Player 1 of each pair, in the order of the result file
+    - player2 (list): Player 2 of each pair, in the order of the result file
+    - rows (list): Positions in the match arrays of the matches of each pair
+    - day (array): Day number (days since 1970-01-01) of each match
+    - p1_won (array): Whether player 1 of the pair won each match
+    - is_upset (array): Whether each match was an upset
+    """
+    match_rows = np.concatenate(rows).astype(np.int64) if len(rows) else np.array([], dtype=np.int64)
+    offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(r) for r in rows])
+    arrays = {
+        'player1': np.array([str(p) for p in player1], dtype=str),
+        'player2': np.array([str(p) for p in player2], dtype=str),
+        'offsets': offsets,
+        'day': np.asarray(day, dtype=np.int32)[match_rows],
+        'p1_won': np.asarray(p1_won, dtype=bool)[match_rows],
+        'is_upset': np.asarray(is_upset, dtype=bool)[match_rows],
+    }
+    # Write to a temporary file first, so that an interrupted run never leaves a partial file behind
+    path = get_result_lists_path(filename)
+    tmp_path = path + '.tmp.npz'
+    np.savez(tmp_path, **arrays)
+    os.replace(tmp_path, path)
+
+class ResultLists:
+    """
+    List-valued columns of a result file, as flat arrays with one value per match grouped by pair.
+    """
+
+    def __init__(self, arrays):
+        self.player1 = arrays['player1']
+        self.player2 = arrays['player2']
+        self.offsets = arrays['offsets']
+        self.day = arrays['day']
+        self.p1_won = arrays['p1_won']
+        self.is_upset = arrays['is_upset']
+
+    def __len__(self):
+        return len(self.player1)
+
+    def pair_slice(self, k):
+        # Positions in the match arrays of the matches of the k-th pair
+        return slice(self.offsets[k], self.offsets[k + 1])
+
+    def get_meeting_gaps(self):
+        """
+        Calculates the number of days between consecutive meetings of each pair, with one np.diff over the day numbers
+        of all the pairs, sorted by pair and day, instead of a date parse and subtraction per match.
+
+        Returns:
+        - gaps (array): Days between consecutive meetings, grouped by pair
+        - gap_offsets (array): The gaps of the k-th pair are positions gap_offsets[k] to gap_offsets[k + 1] of gaps
+        """
+        pairs = np.repeat(np.arange(len(self), dtype=np.int64), np.diff(self.offsets))
+        order = np.lexsort((self.day, pairs))
+        gaps = np.diff(np.asarray(self.day, dtype=np.int64)[order])
+        # Differences across the boundary between two pairs are dropped, so every pair has one gap less than matches
+        same_pair = pairs[order][1:] == pairs[order][:-1]
+        gap_offsets = np.zeros(len(self) + 1, dtype=np.int64)
+        gap_offsets[1:] = np.cumsum(np.maximum(np.diff(self.offsets) - 1, 0))
+        return gaps[same_pair], gap_offsets
+
+    def to_frame(self):
+        """
+        Builds a DataFrame with the list-valued columns of the result file, with one numpy array per pair and column
+        instead of the text of a list.
+
+        Returns:
+        - df (DataFrame): DataFrame with the columns player1, player2, match_results ('p1'/'p2'), results_set
+          ('U'/'N'), upset_results ('UW'/'UL' for player 1), results_set_with_dates (datetime64 dates) and
+          meeting_gaps (days between consecutive meetings, in date order)
+        """
+        match_results = np.where(self.p1_won, 'p1', 'p2')
+        results_set = np.where(self.is_upset, 'U', 'N')
+        upset_types = np.where(self.p1_won, 'UW', 'UL')
+        dates = np.asarray(self.day).astype('datetime64[D]')
+        slices = [self.pair_slice(k) for k in range(len(self))]
+        gaps, gap_offsets = self.get_meeting_gaps()
+        return pd.DataFrame({
+            'player1': self.player1,
+            'player2': self.player2,
+            'match_results': [match_results[s] for s in slices],
+            'results_set': [results_set[s] for s in slices],
+            'upset_results': [upset_types[s][self.is_upset[s]] for s in slices],
+            'results_set_with_dates': [dates[s] for s in slices],
+            'meeting_gaps': [gaps[gap_offsets[k]:gap_offsets[k + 1]] for k in range(len(self))],
+        })
+
+def load_result_lists(filename):
+    """
+    Loads the typed list-valued columns written next to a result file.
+
+    Parameters:
+    - filename (str): Path of the result csv file
+
+    Returns:
+    - result_lists (ResultLists): The list-valued columns of the result file
+    """
+    with np.load(get_result_lists_path(filename)) as arrays:
+        return ResultLists({name: arrays[name] for name in arrays.files})
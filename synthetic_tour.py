@@ -0,0 +1,129 @@
+"""
+Seeded generator of synthetic tennis tours with the columns of the Data_Clean match data files used by the bogey
+analysis, for benchmarking the pipeline on datasets far larger than Data_Clean_Test.csv.
+
+Players have a latent skill, and the most active players play most of the matches so that head-to-heads recur as in
+the real tours. The winner of each match is drawn from the players' skills, while the betting odds and Elo ratings
+are noisy estimates of them, so that there are upsets to find. A small share of the average odds is left missing so
+that the fallback to the Bet365 odds is exercised.
+"""
+
+import numpy as np
+import pandas as pd
+
+# Tournaments of each week of the year, with four grand slams
+GRAND_SLAM_WEEKS = {2: 'Australian Open', 21: 'French Open', 26: 'Wimbledon', 35: 'US Open'}
+GRAND_SLAM_SURFACES = {'Australian Open': 'Hard', 'French Open': 'Clay', 'Wimbledon': 'Grass', 'US Open': 'Hard'}
+SERIES = ['ATP250', 'ATP500', 'Masters 1000']
+SURFACES = ['Hard', 'Clay', 'Hard', 'Grass', 'Carpet']
+
+# Roughly the number of matches per year on the ATP tour
+MATCHES_PER_YEAR = 2600
+
+# Share of matches with missing average odds
+MISSING_ODDS_RATE = 0.02
+
+def get_player_names(n_players):
+    # Player names in the Last Name Initial. format of the match data files
+    initials = np.array(list('ABCDEFGHIJKLMNOPQRSTUVWXYZ'))
+    return np.array(['Player' + str(k).zfill(6) + ' ' + initials[k % 26] + '.' for k in range(n_players)], dtype=object)
+
+def get_tournaments():
+    # Name, series and surface of the tournament of each week of the year
+    names, series, surfaces = [], [], []
+    for week in range(52):
+        if week in GRAND_SLAM_WEEKS:
+            names.append(GRAND_SLAM_WEEKS[week])
+            series.append('Grand Slam')
+            surfaces.append(GRAND_SLAM_SURFACES[GRAND_SLAM_WEEKS[week]])
+        else:
+            names.append('Synthetic Open ' + str(week))
+            series.append(SERIES[week % len(SERIES)])
+            surfaces.append(SURFACES[week % len(SURFACES)])
+    return np.array(names, dtype=object), np.array(series, dtype=object), np.array(surfaces, dtype=object)
+
+def generate_matches(n_matches, n_players, seed=0, start_date='2000-01-01'):
+    """
+    Generates a synthetic tour in the format of the Data_Clean match data files.
+
+    Parameters:
+    - n_matches (int): Number of matches
+    - n_players (int): Number of players
+    - seed (int): Seed of the random number generator (default = 0), the same seed always gives the same tour
+    - start_date (str): Date of the first week of the tour in YYYY-MM-DD format (default = 2000-01-01)
+
+    Returns:
+    - df (DataFrame): DataFrame containing the matches in date order, with the Tournament, Date, Series, Surface,
+      Winner, Loser, B365W, B365L, AvgW, AvgL, P_i, P_j, Y_i, Y_j and Elo columns of the match data files
+    """
+    rng = np.random.default_rng(seed)
+    names = get_player_names(n_players)
+    skill = rng.normal(0, 1, n_players)
+
+    # The most active players play most of the matches
+    activity = 1 / (np.arange(n_players) + 10.0)
+    activity /= activity.sum()
+    player_i = rng.choice(n_players, n_matches, p=activity)
+    player_j = rng.choice(n_players, n_matches, p=activity)
+    same = player_i == player_j
+    while same.any():
+        player_j[same] = rng.choice(n_players, same.sum(), p=activity)
+        same = player_i == player_j
+
+    # Outcome of each match, from the difference in skill
+    true_prob_i = 1 / (1 + np.exp(-(skill[player_i] - skill[player_j])))
+    y_i = rng.random(n_matches) < true_prob_i
+
+    # Elo ratings before and after the match, as noisy estimates of the skills
+    elo_i_before = 1500 + 200 * skill[player_i] + rng.normal(0, 60, n_matches)
+    elo_j_before = 1500 + 200 * skill[player_j] + rng.normal(0, 60, n_matches)
+    elo_prob_i = 1 / (1 + 10 ** ((elo_j_before - elo_i_before) / 400))
+    elo_i_after = elo_i_before + 32 * (y_i - elo_prob_i)
+    elo_j_after = elo_j_before - 32 * (y_i - elo_prob_i)
+
+    # Betting odds, from noisy implied probabilities with a bookmaker's margin
+    implied_prob_i = np.clip(true_prob_i + rng.normal(0, 0.1, n_matches), 0.02, 0.98)
+    margin = 1.05
+    odds_i = np.round(1 / (implied_prob_i * margin), 2)
+    odds_j = np.round(1 / ((1 - implied_prob_i) * margin), 2)
+    avg_w = np.where(y_i, odds_i, odds_j)
+    avg_l = np.where(y_i, odds_j, odds_i)
+    b365_w = np.round(avg_w * rng.uniform(0.97, 1.03, n_matches), 2)
+    b365_l = np.round(avg_l * rng.uniform(0.97, 1.03, n_matches), 2)
+    missing = rng.random(n_matches) < MISSING_ODDS_RATE
+    avg_w[missing] = np.nan
+    avg_l[missing] = np.nan
+
+    # Dates in order, at the rate of matches of the ATP tour, with the tournament of each week
+    n_days = max(7, int(n_matches / MATCHES_PER_YEAR * 364))
+    day = np.sort(rng.integers(0, n_days, n_matches))
+    dates = np.datetime64(start_date, 'D') + day
+    tournaments, series, surfaces = get_tournaments()
+    week = (day // 7) % 52
+
+    winner = np.where(y_i, player_i, player_j)
+    loser = np.where(y_i, player_j, player_i)
+    return pd.DataFrame({
+        'Tournament': tournaments[week],
+        'Date': np.datetime_as_string(dates, unit='D'),
+        'Series': series[week],
+        'Surface': surfaces[week],
+        'Winner': names[winner],
+        'Loser': names[loser],
+        'B365W': b365_w,
+        'B365L': b365_l,
+        'AvgW': avg_w,
+        'AvgL': avg_l,
+        'P_i': names[player_i],
+        'P_j': names[player_j],
+        'Y_i': y_i.astype(int),
+        'Y_j': 1 - y_i.astype(int),
+        'Elo_i_before_match': elo_i_before,
+        'Elo_j_before_match': elo_j_before,
+        'Elo_i_after_match': elo_i_after,
+        'Elo_j_after_match': elo_j_after,
+    })
+
+def write_matches(filename, n_matches, n_players, seed=0):
+    # Generates a synthetic tour and writes it to a csv file in the format of the match data files
+    generate_matches(n_matches, n_players, seed).to_csv(filename, index=False)
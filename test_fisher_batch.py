@@ -0,0 +1,65 @@
+"""
+Checks that fisher_exact_batch gives the same odds ratios and p-values as scipy.stats.fisher_exact.
+Run with: python -m pytest test_fisher_batch.py
+"""
+
+import itertools
+import numpy as np
+from scipy.stats import fisher_exact
+import fisher_batch
+from fisher_batch import fisher_exact_batch
+
+def get_reference(tables):
+    # Odds ratio and p-value of each table from scipy, one call per table
+    results = [fisher_exact(table) for table in tables]
+    return np.array([r[0] for r in results], dtype=float), np.array([r[1] for r in results], dtype=float)
+
+def check_tables(tables):
+    oddsratio, pvalue = fisher_exact_batch(tables)
+    expected_oddsratio, expected_pvalue = get_reference(tables)
+    np.testing.assert_array_equal(np.isnan(oddsratio), np.isnan(expected_oddsratio))
+    np.testing.assert_allclose(oddsratio, expected_oddsratio, rtol=1e-12, equal_nan=True)
+    np.testing.assert_allclose(pvalue, expected_pvalue, rtol=1e-12, atol=0)
+
+def test_small_grid():
+    # Every table with cells from 0 to 6, including tables with empty rows and columns
+    tables = np.array(list(itertools.product(range(7), repeat=4))).reshape(-1, 2, 2)
+    check_tables(tables)
+
+def test_large_tables():
+    # Tables with more observations than the precomputed lookup table, as for pairs with many matches
+    rng = np.random.default_rng(0)
+    tables = rng.integers(0, 60, size=(300, 2, 2))
+    tables[:50, 0, 0] += 200
+    check_tables(tables)
+
+def test_cold_lookup_table():
+    # The p-values of the large tables do not depend on what was computed before
+    rng = np.random.default_rng(1)
+    tables = rng.integers(20, 80, size=(100, 2, 2))
+    fisher_batch._large_pvalues.clear()
+    check_tables(tables)
+
+def test_lookup_table_is_bounded(monkeypatch):
+    # Only the most recently used large tables are kept, and evicted tables are calculated again when they recur
+    monkeypatch.setattr(fisher_batch, 'LARGE_TABLE_CACHE_SIZE', 50)
+    rng = np.random.default_rng(3)
+    tables = rng.integers(20, 80, size=(200, 2, 2))
+    check_tables(tables)
+    assert len(fisher_batch._large_pvalues) == 50
+    check_tables(tables[::-1])
+    assert len(fisher_batch._large_pvalues) == 50
+
+def test_expected_wins_are_truncated():
+    # The expected wins in the contingency tables are not integers, and are truncated as in fisher_exact
+    rng = np.random.default_rng(2)
+    tables = rng.uniform(0, 15, size=(300, 2, 2))
+    tables[:, :, 1] = np.floor(tables[:, :, 1])
+    oddsratio, pvalue = fisher_exact_batch(tables)
+    expected_oddsratio, expected_pvalue = get_reference(tables.astype(np.int64))
+    np.testing.assert_allclose(oddsratio, expected_oddsratio, rtol=1e-12, equal_nan=True)
+    np.testing.assert_allclose(pvalue, expected_pvalue, rtol=1e-12, atol=0)
+
+def test_empty():
+    oddsratio, pvalue = fisher_exact_batch(np.zeros((0, 2, 2)))
+    assert len(oddsratio) == 0 and len(pvalue) == 0
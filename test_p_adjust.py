@@ -0,0 +1,138 @@
+"""
+Checks p_adjust against R's stats::p.adjust, with fixed reference values and with a line-by-line transcription of
+R's implementation (including its O(n^2) Hommel loop) over random p-values with ties and missing values.
+Run with: python -m pytest test_p_adjust.py
+"""
+
+import itertools
+import numpy as np
+import pytest
+from p_adjust import p_adjust
+
+# Values of p.adjust(c(0.01, 0.02, 0.02, NA, 0.04, 0.3, 0.3, 0.5, 0.001, 1), method) in R, as given by the
+# transcription of R's implementation below. The hommel values are also the closed testing values of
+# get_closed_simes_pvalues, and the values of the other methods were worked out by hand
+REFERENCE_P = [0.01, 0.02, 0.02, np.nan, 0.04, 0.3, 0.3, 0.5, 0.001, 1]
+H9 = sum(1 / k for k in range(1, 10))
+REFERENCE_VALUES = {
+    'bonferroni': [0.09, 0.18, 0.18, np.nan, 0.36, 1, 1, 1, 0.009, 1],
+    'holm': [0.08, 0.14, 0.14, np.nan, 0.2, 1, 1, 1, 0.009, 1],
+    'hochberg': [0.08, 0.12, 0.12, np.nan, 0.2, 0.9, 0.9, 1, 0.009, 1],
+    'hommel': [0.07, 0.12, 0.12, np.nan, 0.2, 0.75, 0.75, 1, 0.009, 1],
+    'BH': [0.045, 0.045, 0.045, np.nan, 0.072, 2.7 / 7, 2.7 / 7, 0.5625, 0.009, 1],
+    'BY': [0.045 * H9, 0.045 * H9, 0.045 * H9, np.nan, 0.072 * H9, 1, 1, 1, 0.009 * H9, 1],
+}
+
+def r_p_adjust(p, method):
+    # Transcription of R's p.adjust(p, method), with 0-based indices
+    p = np.asarray(p, dtype=float)
+    p0 = p.copy()
+    nna = ~np.isnan(p)
+    p = p[nna]
+    n = lp = len(p)
+    if n <= 1:
+        return p0
+    if n == 2 and method == 'hommel':
+        method = 'hochberg'
+    if method == 'fdr':
+        method = 'BH'
+
+    if method == 'bonferroni':
+        q = np.minimum(1, n * p)
+    elif method == 'holm':
+        i = np.arange(1, lp + 1)
+        o = np.argsort(p, kind='stable')
+        ro = np.argsort(o, kind='stable')
+        q = np.minimum(1, np.maximum.accumulate((n + 1 - i) * p[o]))[ro]
+    elif method == 'hommel':
+        i = np.arange(1, n + 1)
+        o = np.argsort(p, kind='stable')
+        p = p[o]
+        ro = np.argsort(o, kind='stable')
+        q = np.full(n, np.min(n * p / i))
+        pa = q.copy()
+        for m in range(n - 1, 1, -1):
+            i1 = np.arange(n - m + 1)
+            i2 = np.arange(n - m + 1, n)
+            q1 = np.min(m * p[i2] / np.arange(2, m + 1))
+            q[i1] = np.minimum(m * p[i1], q1)
+            q[i2] = q[n - m]
+            pa = np.maximum(pa, q)
+        q = np.maximum(pa, p)[ro]
+    elif method in ['hochberg', 'BH', 'BY']:
+        i = np.arange(lp, 0, -1)
+        o = np.argsort(-p, kind='stable')
+        ro = np.argsort(o, kind='stable')
+        if method == 'hochberg':
+            factor = n + 1 - i
+        elif method == 'BH':
+            factor = n / i
+        else:
+            factor = np.sum(1 / np.arange(1, n + 1)) * n / i
+        q = np.minimum(1, np.minimum.accumulate(factor * p[o]))[ro]
+    else:
+        q = p
+    p0[nna] = q
+    return p0
+
+def get_closed_simes_pvalues(p):
+    # Hommel adjusted p-values from their definition: the largest Simes p-value of the sets of p-values that contain
+    # each p-value, found by trying every set
+    n = len(p)
+    adjusted = np.zeros(n)
+    for i in range(n):
+        others = [k for k in range(n) if k != i]
+        for size in range(n):
+            for subset in itertools.combinations(others, size):
+                values = np.sort(p[list(subset) + [i]])
+                simes = np.min(len(values) * values / np.arange(1, len(values) + 1))
+                adjusted[i] = max(adjusted[i], min(1, simes))
+    return adjusted
+
+@pytest.mark.parametrize('method', sorted(REFERENCE_VALUES))
+def test_reference_values(method):
+    np.testing.assert_allclose(p_adjust(REFERENCE_P, method), REFERENCE_VALUES[method], rtol=1e-12, equal_nan=True)
+
+@pytest.mark.parametrize('method', sorted(REFERENCE_VALUES))
+def test_transcription_matches_reference_values(method):
+    np.testing.assert_allclose(r_p_adjust(REFERENCE_P, method), REFERENCE_VALUES[method], rtol=1e-12, equal_nan=True)
+
+@pytest.mark.parametrize('method', ['bonferroni', 'holm', 'hochberg', 'hommel', 'BH', 'BY', 'fdr', 'none'])
+def test_random_pvalues(method):
+    rng = np.random.default_rng(0)
+    for n in list(range(0, 12)) + [50, 200, 1000]:
+        for _ in range(20 if n < 50 else 3):
+            p = rng.uniform(size=n)
+            # Ties, as in the p-values of pairs with the same contingency table, and p-values of 1
+            if n > 2:
+                p[rng.integers(0, n, size=n // 2)] = p[rng.integers(0, n, size=n // 2)]
+                p[rng.integers(0, n, size=n // 4)] = 1
+            # Small p-values, and missing values that are not counted in the number of comparisons
+            p[rng.uniform(size=n) < 0.2] *= 1e-4
+            p[rng.uniform(size=n) < 0.1] = np.nan
+            np.testing.assert_allclose(p_adjust(p, method), r_p_adjust(p, method), rtol=1e-12, atol=1e-15, equal_nan=True)
+
+def test_hommel_discrete_pvalues():
+    # Many tied p-values from few distinct values, the worst case for the convex hull of the Hommel adjustment
+    rng = np.random.default_rng(1)
+    for n in [3, 4, 5, 10, 100, 500]:
+        for _ in range(10):
+            p = rng.choice([0.001, 0.01, 0.02, 0.05, 0.2, 0.5, 1.0], size=n)
+            np.testing.assert_allclose(p_adjust(p, 'hommel'), r_p_adjust(p, 'hommel'), rtol=1e-12, equal_nan=True)
+
+def test_hommel_closed_testing():
+    rng = np.random.default_rng(2)
+    for n in range(1, 9):
+        for _ in range(10):
+            p = rng.choice([0.001, 0.01, 0.02, 0.05, 0.2, 0.5, 1.0, rng.uniform()], size=n)
+            np.testing.assert_allclose(p_adjust(p, 'hommel'), get_closed_simes_pvalues(p), rtol=1e-12)
+    reference = np.array(REFERENCE_P)
+    valid = ~np.isnan(reference)
+    np.testing.assert_allclose(get_closed_simes_pvalues(reference[valid]), np.array(REFERENCE_VALUES['hommel'])[valid], rtol=1e-12)
+
+def test_hommel_all_missing():
+    np.testing.assert_array_equal(np.isnan(p_adjust([np.nan, np.nan, np.nan], 'hommel')), [True, True, True])
+
+def test_unknown_method():
+    with pytest.raises(ValueError):
+        p_adjust([0.1, 0.2], 'sidak')
@@ -0,0 +1,45 @@
+"""
+Checks the meeting gaps of the typed list-valued columns of a result file against the gaps worked out one pair at a
+time from the match dates.
+Run with: python -m pytest test_result_store.py
+"""
+
+from datetime import date
+import numpy as np
+from result_store import ResultLists
+
+def get_result_lists(pair_days):
+    # Typed list columns of the pairs with the given match days, in the same layout as write_result_lists
+    offsets = np.zeros(len(pair_days) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(days) for days in pair_days])
+    day = np.concatenate(pair_days).astype(np.int32) if pair_days else np.array([], dtype=np.int32)
+    return ResultLists({
+        'player1': np.array(['p' + str(k) for k in range(len(pair_days))]),
+        'player2': np.array(['q' + str(k) for k in range(len(pair_days))]),
+        'offsets': offsets,
+        'day': day,
+        'p1_won': np.zeros(len(day), dtype=bool),
+        'is_upset': np.zeros(len(day), dtype=bool),
+    })
+
+def get_reference_gaps(days):
+    # Days between consecutive meetings from the dates, one match at a time, as before the day numbers were stored
+    dates = sorted(date.fromordinal(date(1970, 1, 1).toordinal() + int(d)) for d in days)
+    return [(dates[i] - dates[i - 1]).days for i in range(1, len(dates))]
+
+def test_meeting_gaps():
+    rng = np.random.default_rng(0)
+    # Pairs with one match, matches on the same day, and days out of order in the file
+    pair_days = [rng.integers(12000, 20000, size=n) for n in rng.integers(1, 8, size=200)]
+    pair_days[0] = np.array([15000])
+    pair_days[1] = np.array([15000, 15000, 14990])
+    lists = get_result_lists(pair_days)
+    gaps, gap_offsets = lists.get_meeting_gaps()
+    assert len(gap_offsets) == len(pair_days) + 1
+    for k, days in enumerate(pair_days):
+        assert gaps[gap_offsets[k]:gap_offsets[k + 1]].tolist() == get_reference_gaps(days)
+    assert lists.to_frame()['meeting_gaps'][1].tolist() == [10, 0]
+
+def test_no_pairs():
+    gaps, gap_offsets = get_result_lists([]).get_meeting_gaps()
+    assert len(gaps) == 0 and gap_offsets.tolist() == [0]
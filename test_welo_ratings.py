@@ -0,0 +1,121 @@
+"""
+Checks the Elo and WElo ratings of welo_ratings.py against ratings worked out by hand, and that rating the matches of
+a data file in two runs from a saved state gives the same output file as rating them in one run.
+Run with: python -m pytest test_welo_ratings.py
+"""
+
+import os
+import sys
+import numpy as np
+import pandas as pd
+import pytest
+import welo_ratings
+
+TEST_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Data_Clean_Test.csv')
+
+def get_matches(rows):
+    # Cleaned match data with the columns used to rate the matches, one (P_i, P_j, Y_i, f_g) tuple per match
+    return pd.DataFrame({
+        'P_i': [r[0] for r in rows],
+        'P_j': [r[1] for r in rows],
+        'Y_i': [r[2] for r in rows],
+        'Y_j': [1 - r[2] for r in rows],
+        'f_g_i': [r[3] for r in rows],
+        'f_g_j': [r[3] for r in rows],
+        'f_s_i': [1.0 for r in rows],
+        'f_s_j': [1.0 for r in rows],
+    })
+
+def run_main(monkeypatch, *argv):
+    monkeypatch.setattr(sys, 'argv', ['welo_ratings.py'] + list(argv))
+    welo_ratings.main()
+
+def test_hand_computed_ratings():
+    # A beats B winning 60% of the games, A beats C winning 75%, then C beats B winning 2/3
+    df = get_matches([('A', 'B', 1, 0.6), ('C', 'A', 0, 0.75), ('B', 'C', 0, 2 / 3)])
+    state = welo_ratings.new_state({'weights': 'games', 'start_rating': 1500.0, 'k_factor': 'kovalchik'})
+    ratings = welo_ratings.rate_matches(df, state)
+
+    # Match 1: both players start at 1500 with no matches, so p = 0.5 and K = 250 / 5^0.4
+    k0 = 250 / 5 ** 0.4
+    k1 = 250 / 6 ** 0.4
+    np.testing.assert_allclose(ratings.loc[0, ['Elo_pi_hat', 'WElo_pi_hat']], [0.5, 0.5])
+    np.testing.assert_allclose(ratings.loc[0, ['Elo_i_before_match', 'Elo_j_before_match']], [1500, 1500])
+    elo_a, elo_b = 1500 + k0 * 0.5, 1500 - k0 * 0.5
+    welo_a, welo_b = 1500 + k0 * 0.5 * 0.6, 1500 - k0 * 0.5 * 0.6
+    np.testing.assert_allclose(ratings.loc[0, ['Elo_i_after_match', 'Elo_j_after_match']], [elo_a, elo_b])
+    np.testing.assert_allclose(ratings.loc[0, ['WElo_i_after_match', 'WElo_j_after_match']], [welo_a, welo_b])
+
+    # Match 2: C is new (1500, K = 250 / 5^0.4), A has played once (K = 250 / 6^0.4), and A wins as player j
+    elo_p_c = 1 / (1 + 10 ** ((elo_a - 1500) / 400))
+    welo_p_c = 1 / (1 + 10 ** ((welo_a - 1500) / 400))
+    np.testing.assert_allclose(ratings.loc[1, ['Elo_pi_hat', 'Elo_pj_hat']], [elo_p_c, 1 - elo_p_c])
+    np.testing.assert_allclose(ratings.loc[1, ['WElo_pi_hat', 'WElo_pj_hat']], [welo_p_c, 1 - welo_p_c])
+    elo_c, elo_a = 1500 - k0 * elo_p_c, elo_a + k1 * elo_p_c
+    welo_c, welo_a = 1500 - k0 * welo_p_c * 0.75, welo_a + k1 * welo_p_c * 0.75
+    np.testing.assert_allclose(ratings.loc[1, ['Elo_i_after_match', 'Elo_j_after_match']], [elo_c, elo_a])
+    np.testing.assert_allclose(ratings.loc[1, ['WElo_i_after_match', 'WElo_j_after_match']], [welo_c, welo_a])
+
+    # Match 3: B and C have both played once, so K = 250 / 6^0.4 for both, and C wins as player j
+    elo_p_b = 1 / (1 + 10 ** ((elo_c - elo_b) / 400))
+    welo_p_b = 1 / (1 + 10 ** ((welo_c - welo_b) / 400))
+    np.testing.assert_allclose(ratings.loc[2, ['Elo_i_before_match', 'Elo_j_before_match']], [elo_b, elo_c])
+    np.testing.assert_allclose(ratings.loc[2, ['WElo_i_before_match', 'WElo_j_before_match']], [welo_b, welo_c])
+    np.testing.assert_allclose(ratings.loc[2, ['Elo_i_after_match', 'Elo_j_after_match']],
+                               [elo_b - k1 * elo_p_b, elo_c + k1 * elo_p_b])
+    np.testing.assert_allclose(ratings.loc[2, ['WElo_i_after_match', 'WElo_j_after_match']],
+                               [welo_b - k1 * welo_p_b * 2 / 3, welo_c + k1 * welo_p_b * 2 / 3])
+
+    assert state['matches'] == 3
+    assert [state['players'][p][2] for p in 'ABC'] == [2, 2, 2]
+
+def test_start_rating_and_constant_k():
+    df = get_matches([('A', 'B', 0, 0.6)])
+    state = welo_ratings.new_state({'weights': 'sets', 'start_rating': 1000.0, 'k_factor': '32'})
+    ratings = welo_ratings.rate_matches(df, state)
+    # The sets weights are 1, so the WElo ratings move as much as the Elo ratings
+    np.testing.assert_allclose(ratings.loc[0, ['Elo_i_before_match', 'WElo_j_before_match']], [1000, 1000])
+    np.testing.assert_allclose(ratings.loc[0, ['Elo_i_after_match', 'Elo_j_after_match']], [984, 1016])
+    np.testing.assert_allclose(ratings.loc[0, ['WElo_i_after_match', 'WElo_j_after_match']], [984, 1016])
+
+def test_first_fixture_match():
+    df = pd.read_csv(TEST_FILE, low_memory=False).iloc[:1]
+    state = welo_ratings.new_state({'weights': 'games', 'start_rating': 1500.0, 'k_factor': 'kovalchik'})
+    ratings = welo_ratings.rate_matches(df, state)
+    k0 = 250 / 5 ** 0.4
+    sign = 1 if df['Y_i'].iloc[0] == 1 else -1
+    np.testing.assert_allclose(ratings.loc[0, 'Elo_i_after_match'], 1500 + sign * k0 * 0.5)
+    np.testing.assert_allclose(ratings.loc[0, 'WElo_i_after_match'], 1500 + sign * k0 * 0.5 * df['f_g_i'].iloc[0])
+
+def test_split_run_matches_single_run(tmp_path, monkeypatch):
+    df = pd.read_csv(TEST_FILE, low_memory=False)
+    assert len(df) == 699 + 374
+    single = str(tmp_path / 'single.csv')
+    run_main(monkeypatch, '-i', TEST_FILE, '-o', single)
+
+    # Rate the first 699 matches, then the whole file from the saved state, which rates only the last 374
+    first = str(tmp_path / 'first.csv')
+    df.iloc[:699].to_csv(first, index=False)
+    split = str(tmp_path / 'split.csv')
+    state = str(tmp_path / 'state.json')
+    run_main(monkeypatch, '-i', first, '-o', split, '--state', state)
+    run_main(monkeypatch, '-i', TEST_FILE, '-o', split, '--state', state)
+
+    with open(single, 'rb') as f_single, open(split, 'rb') as f_split:
+        assert f_single.read() == f_split.read()
+
+def test_resume_rejects_changed_matches(tmp_path, monkeypatch):
+    df = pd.read_csv(TEST_FILE, low_memory=False)
+    first = str(tmp_path / 'first.csv')
+    df.iloc[:699].to_csv(first, index=False)
+    output = str(tmp_path / 'output.csv')
+    state = str(tmp_path / 'state.json')
+    run_main(monkeypatch, '-i', first, '-o', output, '--state', state)
+
+    # A result changed in the matches already rated: the saved ratings no longer follow from the file
+    changed = df.copy()
+    changed.loc[10, ['Y_i', 'Y_j']] = 1 - changed.loc[10, ['Y_i', 'Y_j']]
+    changed_file = str(tmp_path / 'changed.csv')
+    changed.to_csv(changed_file, index=False)
+    with pytest.raises(SystemExit):
+        run_main(monkeypatch, '-i', changed_file, '-o', output, '--state', state)
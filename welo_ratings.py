@@ -0,0 +1,213 @@
+"""
+Streaming Elo and WElo rating engine, replacing the welofit() step of create_data_clean_csv_files.R.
+
+The matches of a cleaned match data file (the output of welo's clean(), with the P_i, P_j, Y_i, Y_j, f_g_i, f_g_j,
+f_s_i and f_s_j columns) are rated one at a time in file order, which is chronological, as in welofit(). Each match
+only reads and updates the ratings and match counts of its two players, so every update takes constant time:
+
+- The Elo win probability of player i is 1 / (1 + 10^((E_j - E_i) / 400)), from the ratings before the match.
+- The Elo rating of each player moves by K (Y - p), where Y is 1 for the winner and 0 for the loser and p is the
+  player's win probability, and K is 250 / (N + 5)^0.4 (Kovalchik, 2016) with N the number of matches the player has
+  played before, or a constant.
+- The WElo rating (Angelini, Candila & De Angelis, 2022) moves by K (Y - p) f, where p is the WElo win probability
+  and f is the share of the games (f_g_i/f_g_j, the default) or sets (f_s_i/f_s_j) won by the winner of the match.
+
+The ratings and match counts of every player are kept in a state file, so that matches appended to the data file
+later can be rated from the saved state without rating the whole history again.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import numpy as np
+import pandas as pd
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-i', '--input', type=str, required=True, help='cleaned match data csv file, as written by welo\'s clean() function')
+parser.add_argument('-o', '--output', type=str, required=True, help='csv file to write the matches with the Elo and WElo rating columns to, e.g., Data_Clean_ATP_Elo_WElo.csv')
+parser.add_argument('-W', '--weights', type=str, required=False, choices=['games', 'sets'], default='games', help='WElo weights: share of games (f_g_i/f_g_j) or sets (f_s_i/f_s_j) won by the winner (default = games)')
+parser.add_argument('--start_rating', type=float, required=False, default=1500.0, help='rating of players before their first match (default = 1500)')
+parser.add_argument('-k', '--k_factor', type=str, required=False, default='kovalchik', help='kovalchik for K = 250 / (N + 5)^0.4, or a constant K (default = kovalchik)')
+parser.add_argument('--state', type=str, required=False, default=None, help='json file of the ratings of every player after the last rated match. If it exists, only the matches after those it has rated are rated and appended to the output file')
+parser.add_argument('--check', action='store_true', help='compare the rating columns with those already in the input file, e.g., the output of welofit(), and report the largest differences')
+
+# Rating columns added to the match data, with the names used by welofit()
+RATING_COLUMNS = ['Elo_pi_hat', 'Elo_pj_hat', 'WElo_pi_hat', 'WElo_pj_hat',
+                  'Elo_i_before_match', 'Elo_j_before_match', 'Elo_i_after_match', 'Elo_j_after_match',
+                  'WElo_i_before_match', 'WElo_j_before_match', 'WElo_i_after_match', 'WElo_j_after_match']
+
+# Columns of the cleaned match data used to rate the matches
+WEIGHT_COLUMNS = {'games': ('f_g_i', 'f_g_j'), 'sets': ('f_s_i', 'f_s_j')}
+
+def win_probability(rating_i, rating_j):
+    # Probability that player i beats player j, from their ratings
+    return 1 / (1 + 10 ** ((rating_j - rating_i) / 400))
+
+def get_k_factor(k_factor, n_matches):
+    # K factor of a player who has played n_matches before the match
+    if k_factor == 'kovalchik':
+        return 250 / (n_matches + 5) ** 0.4
+    return float(k_factor)
+
+def new_state(settings):
+    """
+    Creates the rating state before the first match.
+
+    Parameters:
+    - settings (dict): The weights, start_rating and k_factor options
+
+    Returns:
+    - state (dict): The settings, the number of rated matches, and the Elo rating, WElo rating and number of
+      matches of each player, in the players dict. The hash of the rated matches is added when the state is saved
+    """
+    return {'settings': settings, 'matches': 0, 'players': {}}
+
+def hash_matches(df, settings):
+    """
+    Hashes the columns of the matches that the ratings depend on, so that a saved state is only used to rate the matches
+    appended to the same match data it was saved from.
+
+    Parameters:
+    - df (DataFrame): DataFrame containing the matches, with the P_i, P_j, Y_i and weight columns of the cleaned match data
+    - settings (dict): The weights, start_rating and k_factor options
+
+    Returns:
+    - digest (str): Hex digest of the matches
+    """
+    h = hashlib.sha256()
+    for column in ['P_i', 'P_j']:
+        h.update(pd.util.hash_array(df[column].to_numpy(dtype=object)).tobytes())
+    for column in ('Y_i',) + WEIGHT_COLUMNS[settings['weights']]:
+        h.update(np.ascontiguousarray(df[column].to_numpy(dtype=float)).tobytes())
+    return h.hexdigest()
+
+def read_state(filename):
+    with open(filename) as f:
+        return json.load(f)
+
+def write_state(state, filename):
+    # Write to a temporary file first, so that an interrupted run never leaves a partial state behind
+    tmp_filename = filename + '.tmp'
+    with open(tmp_filename, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp_filename, filename)
+
+def rate_matches(df, state):
+    """
+    Rates the matches in order, starting from the ratings in the state, and updates the state to the ratings after
+    the last match.
+
+    Parameters:
+    - df (DataFrame): DataFrame containing the matches in chronological order, with the P_i, P_j, Y_i, Y_j and weight
+      columns of the cleaned match data
+    - state (dict): Rating state, as returned by new_state or read_state
+
+    Returns:
+    - ratings (DataFrame): DataFrame with the RATING_COLUMNS of each match, with the same index as df
+    """
+    settings = state['settings']
+    weight_i_column, weight_j_column = WEIGHT_COLUMNS[settings['weights']]
+    weights_i = df[weight_i_column].to_numpy(dtype=float)
+    weights_j = df[weight_j_column].to_numpy(dtype=float)
+    missing = np.flatnonzero(np.isnan(weights_i) | np.isnan(weights_j))
+    if len(missing):
+        raise ValueError(str(len(missing)) + ' matches have no ' + weight_i_column + '/' + weight_j_column + ' weights (first at row '
+                         + str(missing[0]) + '), the matches should be cleaned with welo\'s clean() function first')
+
+    players_i = df['P_i'].to_numpy(dtype=object)
+    players_j = df['P_j'].to_numpy(dtype=object)
+    results_i = df['Y_i'].to_numpy(dtype=float)
+    results_j = df['Y_j'].to_numpy(dtype=float)
+    ratings = np.zeros((len(df), len(RATING_COLUMNS)))
+
+    players = state['players']
+    start = [settings['start_rating'], settings['start_rating'], 0]
+    for m in range(len(df)):
+        # Elo rating, WElo rating and number of matches of each player before the match
+        player_i = players.setdefault(players_i[m], list(start))
+        player_j = players.setdefault(players_j[m], list(start))
+        elo_i, welo_i, n_i = player_i
+        elo_j, welo_j, n_j = player_j
+
+        elo_p_i = win_probability(elo_i, elo_j)
+        welo_p_i = win_probability(welo_i, welo_j)
+        k_i = get_k_factor(settings['k_factor'], n_i)
+        k_j = get_k_factor(settings['k_factor'], n_j)
+
+        player_i[0] = elo_i + k_i * (results_i[m] - elo_p_i)
+        player_j[0] = elo_j + k_j * (results_j[m] - (1 - elo_p_i))
+        player_i[1] = welo_i + k_i * (results_i[m] - welo_p_i) * weights_i[m]
+        player_j[1] = welo_j + k_j * (results_j[m] - (1 - welo_p_i)) * weights_j[m]
+        player_i[2] = n_i + 1
+        player_j[2] = n_j + 1
+
+        ratings[m] = [elo_p_i, 1 - elo_p_i, welo_p_i, 1 - welo_p_i,
+                      elo_i, elo_j, player_i[0], player_j[0],
+                      welo_i, welo_j, player_i[1], player_j[1]]
+    state['matches'] += len(df)
+    return pd.DataFrame(ratings, columns=RATING_COLUMNS, index=df.index)
+
+def check_ratings(df, ratings):
+    """
+    Compares the calculated rating columns with the rating columns already in the match data.
+
+    Parameters:
+    - df (DataFrame): DataFrame containing the matches, with rating columns, e.g., written by welofit()
+    - ratings (DataFrame): Calculated rating columns, as returned by rate_matches
+
+    Returns:
+    - differences (dict): Largest absolute difference of each rating column found in df
+    """
+    return {column: float(np.nanmax(np.abs(df[column].to_numpy(dtype=float) - ratings[column].to_numpy())))
+            for column in RATING_COLUMNS if column in df.columns}
+
+def main():
+    args = parser.parse_args()
+    if args.k_factor != 'kovalchik':
+        try:
+            float(args.k_factor)
+        except ValueError:
+            parser.error('the K factor must be kovalchik or a number')
+    settings = {'weights': args.weights, 'start_rating': args.start_rating, 'k_factor': args.k_factor}
+
+    df = pd.read_csv(args.input, low_memory=False)
+    # Matches that were already rated when the state was saved are not rated again
+    resume = args.state is not None and os.path.exists(args.state) and os.path.exists(args.output)
+    if resume:
+        state = read_state(args.state)
+        if state['settings'] != settings:
+            parser.error('the rating state in ' + args.state + ' was saved with different options: ' + json.dumps(state['settings']))
+        if state['matches'] > len(df):
+            parser.error('the rating state in ' + args.state + ' has rated more matches than there are in ' + args.input)
+        if state.get('hash') != hash_matches(df.iloc[:state['matches']], settings):
+            parser.error('the first ' + str(state['matches']) + ' matches in ' + args.input + ' are not the matches rated in ' + args.state
+                         + ', the matches should only be appended to the file after the state is saved')
+    else:
+        state = new_state(settings)
+    new_matches = df.iloc[state['matches']:]
+
+    # The input may already have rating columns (e.g., when it was written by welofit()), which are replaced
+    ratings = rate_matches(new_matches, state)
+    output = pd.concat([new_matches.drop(columns=[c for c in RATING_COLUMNS if c in new_matches.columns]), ratings], axis=1)
+    if resume:
+        # Append the new matches with the columns of the existing output file
+        columns = pd.read_csv(args.output, nrows=0).columns
+        output.reindex(columns=columns).to_csv(args.output, mode='a', header=False, index=False)
+    else:
+        output.to_csv(args.output, index=False)
+    if args.state is not None:
+        state['hash'] = hash_matches(df, settings)
+        write_state(state, args.state)
+    print('Rated ' + str(len(new_matches)) + ' matches' + (' after the ' + str(len(df) - len(new_matches)) + ' in the saved state' if resume else '')
+          + ', ' + str(len(state['players'])) + ' players, written to ' + args.output)
+
+    if args.check:
+        differences = check_ratings(new_matches, ratings)
+        if not differences:
+            print('No rating columns in ' + args.input + ' to compare with')
+        for column, difference in differences.items():
+            print(column.ljust(22) + 'largest difference ' + str(difference))
+
+if __name__ == '__main__':
+    main()